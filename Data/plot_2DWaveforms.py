@@ -1,7 +1,15 @@
-import pickle
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+import numpy as np
+import argparse
 import os
+import sys
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+import gedi_store
+import gedi_index
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="numpy")
 
 file_path = '/Users/matthewyoon/Documents/cs2370/GEDI/Data Preprocessing/Amazon_cs237_2024.pkl'
@@ -13,35 +21,79 @@ latitudes_to_plot = {
 output_folder = "output_plots" 
 round_precision = 6 
 
-os.makedirs(output_folder, exist_ok=True)
+# waveforms handed to a worker at a time
+batch_size = 64
 
-with open(file_path, "rb") as f:
-    data = pickle.load(f)
 
-for i in range(len(data['prop'])):
-    entry = data['prop'][i]
-    latitude = round(entry['geolocation/latitude_bin0'], round_precision)
-    long = round(entry['geolocation/longitude_bin0'], round_precision)
+# index of the first footprint at each latitude to plot (rounded to round_precision), in file order
+def select_footprints(data, latitudes):
+    index = gedi_index.open_coordinate_index(data, 'prop/geolocation/longitude_bin0', 'prop/geolocation/latitude_bin0',
+                                             decimals=round_precision)
+    first = index.first(sorted(latitudes))
+    return np.sort(first[first >= 0])
 
-    if latitude in latitudes_to_plot:
-        latitudes_to_plot.remove(latitude)
 
-        print('saving lat', latitude, '')
+# ====== RENDERER ======
+
+# one figure per process, only the line data and title change between waveforms
+_store = None
+_figure = None
+_ax = None
+_line = None
+
+
+def _init_renderer(directory):
+    global _store, _figure, _ax, _line
+    _store = gedi_store.GEDIStore(directory)
+    _figure, _ax = plt.subplots()
+    _line, = _ax.plot([], [])
+    _ax.set_xlabel("Index (meters)")
+    _ax.set_ylabel("Energy")
 
-        # plot the waveform
-        waveform = data['y'][i]
-        plt.figure()
-        plt.plot(waveform)
-        plt.xlabel("Index (meters)")
-        plt.ylabel("Energy")
-        plt.title(f"Waveform for Lat {latitude}, Long {long}")
+
+def render_waveforms(footprints):
+    # footprints: (index, latitude, long) of the waveforms to save
+    for i, latitude, long in footprints:
+        waveform = _store['y'][i]
+        _line.set_data(np.arange(len(waveform)), waveform)
+        _ax.relim()
+        _ax.autoscale_view()
+        _ax.set_title(f"Waveform for Lat {latitude}, Long {long}")
 
         # save
         plot_path = os.path.join(output_folder, f"lat_{latitude}.png")
-        plt.savefig(plot_path)
-        plt.close()
+        _figure.savefig(plot_path)
+    return len(footprints)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Save the waveform plots of the footprints in latitudes_to_plot')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args()
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    data = gedi_store.open_gedi(file_path)
+    selected = select_footprints(data, latitudes_to_plot)
+    latitudes = np.round(data['prop/geolocation/latitude_bin0'][selected], round_precision)
+    longs = np.round(data['prop/geolocation/longitude_bin0'][selected], round_precision)
+
+    for latitude in latitudes:
+        print('saving lat', latitude, '')
+
+    footprints = list(zip(selected.tolist(), latitudes, longs))
+    batches = [footprints[start:start + batch_size] for start in range(0, len(footprints), batch_size)]
+
+    if args.workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(args.workers, initializer=_init_renderer, initargs=(data.directory,)) as pool:
+            list(pool.map(render_waveforms, batches))
+    else:
+        _init_renderer(data.directory)
+        for batch in batches:
+            render_waveforms(batch)
+
+    print("Plots saved to:", output_folder)
 
-        if not latitudes_to_plot:
-            break
 
-print("Plots saved to:", output_folder)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,16 @@
-import pickle
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-import matplotlib.ticker as mticker
+import argparse
+import json
+import os
 import numpy as np
-import rasterio
 import warnings
-from rasterio.errors import NotGeoreferencedWarning
-warnings.filterwarnings('ignore', category=NotGeoreferencedWarning)
+from collections import OrderedDict
+import gedi_store
+import gedi_index
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
+# matplotlib, rasterio and scipy are imported by the functions using them, so matching
+# from a notebook or worker doesn't load the plotting and raster stacks
+
 
 # complete bounds for texture
 GEO_BOUNDS = [-68.75, -66.5, -20.95, -19.05]  # salt flats
@@ -19,17 +21,301 @@ TIF_PATH = '../tifs/Bolivia-Saltflats_TandemX_30m.tif'
 PKL_PATH = '../pkls/Bolivia_saltflats.pkl'
 # PKL_PATH = '../pkls/SA_174.pkl'
 
+# GEDI columns matched and compared
+LON_COLUMN = 'prop_rh/lon_lowestmode'
+LAT_COLUMN = 'prop_rh/lat_lowestmode'
+# ELEVATION_COLUMN = 'prop_rh/elev_lowestmode'
+ELEVATION_COLUMN = 'prop_rh/geolocation/digital_elevation_model'
+
+# distance used to match coords to GEDI points
+MATCH_METRIC = 'degrees'  # euclidean in lon/lat degrees
+# MATCH_METRIC = 'haversine'  # great-circle meters
+
+EARTH_RADIUS = 6371008.8  # mean radius, meters
+
+# how the TIF is sampled at GEDI points
+DEM_SAMPLING = 'nearest'  # pixel containing the point
+# DEM_SAMPLING = 'bilinear'  # interpolated between the 4 closest pixel centers
+
+# the TIF is read in windows of about DEM_BLOCK_SIZE pixels square, aligned to its own blocks,
+# and the last DEM_CACHE_BLOCKS windows read are kept decoded
+DEM_BLOCK_SIZE = 512
+DEM_CACHE_BLOCKS = 64
+
+# longest side of the DEM shown by coordinate_picker, larger TIFs are decimated for display
+PICKER_PIXELS = 2048
+
+# GEDI points matched per step, the whole region is never loaded at once
+MATCH_BATCH = 1048576
+
+# report mode (--report DIR): GEDI points handled per step, centroids kept for the percentiles
+# and points kept for the plots
+REPORT_CHUNK = 65536
+REPORT_SKETCH_SIZE = 2000
+REPORT_PLOT_POINTS = 20000
+REPORT_PERCENTILES = [5, 25, 50, 75, 95]
+
 
 def area_filter(lng, lat):
     bounds = (lng > GEO_BOUNDS[0]) & (lng < GEO_BOUNDS[1]) & (lat > GEO_BOUNDS[2]) & (lat < GEO_BOUNDS[3])
     return bounds
 
 
+def match_space(lng, lat, metric=MATCH_METRIC):
+    # points in the space the KD-tree searches
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if metric == 'degrees':
+        return np.column_stack([lng, lat])
+    if metric == 'haversine':
+        # unit sphere, chord length orders points like great-circle distance
+        lng, lat = np.radians(lng), np.radians(lat)
+        return np.column_stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)])
+    raise ValueError(f'unknown match metric {metric}')
+
+
+class PointTree:
+    # KD-tree over the finite (lng, lat) points in the match_space of metric, built once and queried
+    # by nearest_points with any number of query batches
+
+    def __init__(self, lng, lat, metric=MATCH_METRIC):
+        self.metric = metric
+        self.points = match_space(lng, lat, metric)
+        self.valid = np.flatnonzero(np.isfinite(self.points).all(axis=1))
+        self.tree = None
+        if self.valid.size:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(self.points[self.valid])
+
+    def nearest(self, query_lng, query_lat):
+        # index and distance of the closest point to each query, -1 / inf when there is none
+        # ties go to the lowest index, like a linear scan keeping the first strictly closer point
+        points, valid, tree = self.points, self.valid, self.tree
+        queries = match_space(query_lng, query_lat, self.metric)
+
+        nearest = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf)
+
+        searchable = np.flatnonzero(np.isfinite(queries).all(axis=1))
+        if tree is None or searchable.size == 0:
+            return nearest, distances
+
+        def exact_distances(point_index, query_index):
+            offsets = points[point_index] - queries[query_index]
+            return np.sqrt((offsets ** 2).sum(axis=1))
+
+        tree_distances, tree_index = tree.query(queries[searchable], k=[1, 2])
+        nearest[searchable] = valid[tree_index[:, 0]]
+
+        # the tree's distances can be an ulp off the direct formula, so queries whose runner up
+        # is that close are settled over every point in range, in index order
+        ambiguous = tree_distances[:, 1] <= tree_distances[:, 0] * (1 + 1e-9)
+        for q, radius in zip(searchable[ambiguous], tree_distances[ambiguous, 0] * (1 + 1e-9)):
+            in_range = valid[np.sort(tree.query_ball_point(queries[q], radius))]
+            nearest[q] = in_range[np.argmin(exact_distances(in_range, q))]
+
+        distances[searchable] = exact_distances(nearest[searchable], searchable)
+        if self.metric == 'haversine':
+            distances = 2 * EARTH_RADIUS * np.arcsin(np.minimum(distances / 2, 1))
+        return nearest, distances
+
+
+def nearest_points(lng, lat, query_lng, query_lat, metric=MATCH_METRIC):
+    # index and distance of the closest (lng, lat) point to each query, -1 / inf when there is none
+    return PointTree(lng, lat, metric).nearest(query_lng, query_lat)
+
+
+def match_trees(trees, query_lng, query_lat):
+    # nearest over (footprints, PointTree) pairs given in footprint order
+    # returns the footprint index and distance of the closest point to each query, -1 / inf when there is none
+    nearest = np.full(len(query_lng), -1, dtype=np.int64)
+    distances = np.full(len(query_lng), np.inf)
+
+    for footprints, tree in trees:
+        batch_nearest, batch_distances = tree.nearest(query_lng, query_lat)
+        # strictly closer, so ties keep the earlier batch's lower index
+        closer = batch_distances < distances
+        nearest[closer] = footprints[batch_nearest[closer]]
+        distances[closer] = batch_distances[closer]
+
+    return nearest, distances
+
+
+def match_batches(batches, query_lng, query_lat, metric=MATCH_METRIC):
+    # nearest_points over (footprints, lng, lat) batches given in footprint order, see match_trees
+    trees = ((footprints, PointTree(lng, lat, metric)) for footprints, lng, lat in batches)
+    return match_trees(trees, query_lng, query_lat)
+
+
+def region_trees(data, metric=MATCH_METRIC):
+    # (footprints, PointTree) of the store's points inside GEO_BOUNDS, MATCH_BATCH index candidates a tree,
+    # built once for any number of match_region calls
+    candidates = gedi_index.open_index(data, LON_COLUMN, LAT_COLUMN).candidates(GEO_BOUNDS)
+    trees = []
+    for footprints, batch in gedi_store.iter_batches(data, MATCH_BATCH, [LON_COLUMN, LAT_COLUMN], candidates):
+        in_area = np.flatnonzero(area_filter(batch[LON_COLUMN], batch[LAT_COLUMN]))
+        trees.append((footprints[in_area], PointTree(batch[LON_COLUMN][in_area], batch[LAT_COLUMN][in_area], metric)))
+    return trees
+
+
+def match_region(data, query_lng, query_lat, metric=MATCH_METRIC, trees=None):
+    # closest of the store's points inside GEO_BOUNDS to each query, against region_trees(data, metric)
+    # unless trees are given
+    query_lng = np.asarray(query_lng, dtype=np.float64)
+    query_lat = np.asarray(query_lat, dtype=np.float64)
+    nearest = np.full(len(query_lng), -1, dtype=np.int64)
+    distances = np.full(len(query_lng), np.inf)
+
+    # a query sitting on a shot is that shot, looked up in the coordinate index. only in degrees: on the
+    # sphere other coordinates can be at distance 0 too (the poles)
+    if metric == 'degrees':
+        in_area = np.flatnonzero(area_filter(query_lng, query_lat))
+        lookup = gedi_index.open_coordinate_index(data, LON_COLUMN, LAT_COLUMN)
+        nearest[in_area] = lookup.exact(query_lat[in_area], query_lng[in_area])
+        distances[nearest >= 0] = 0
+
+    rest = np.flatnonzero(nearest < 0)
+    if rest.size:
+        trees = region_trees(data, metric) if trees is None else trees
+        nearest[rest], distances[rest] = match_trees(trees, query_lng[rest], query_lat[rest])
+    return nearest, distances
+
+
+def open_tif(path):
+    # rasterio dataset of a TIF, TIFs without georeferencing are expected (see dem_transform)
+    import rasterio
+    from rasterio.errors import NotGeoreferencedWarning
+    warnings.filterwarnings('ignore', category=NotGeoreferencedWarning)
+    return rasterio.open(path)
+
+
+def dem_transform(src):
+    # pixel -> lon/lat affine transform of the TIF
+    # TIFs without georeferencing are assumed to span exactly GEO_BOUNDS
+    if src.transform.is_identity:
+        from rasterio.transform import from_bounds
+        return from_bounds(GEO_BOUNDS[0], GEO_BOUNDS[2], GEO_BOUNDS[1], GEO_BOUNDS[3], src.width, src.height)
+    return src.transform
+
+
+class DEMBlocks:
+    # band 1 of an open rasterio dataset, read one window at a time through an LRU cache
+    # supports dem[rows, cols] with integer arrays, which is all sample_dem needs
+
+    def __init__(self, src, block_size=DEM_BLOCK_SIZE, cache_blocks=DEM_CACHE_BLOCKS):
+        self.src = src
+        self.shape = (src.height, src.width)
+        self.dtype = np.dtype(src.dtypes[0])
+
+        # whole multiples of the TIF's own blocks, so no block is decoded for two windows
+        native_height, native_width = src.block_shapes[0]
+        self.block_height = int(np.ceil(block_size / native_height)) * native_height
+        self.block_width = int(np.ceil(block_size / native_width)) * native_width
+        self.n_block_cols = int(np.ceil(src.width / self.block_width))
+
+        self.cache_blocks = cache_blocks
+        self.cache = OrderedDict()
+
+    def block(self, block_row, block_col):
+        key = (block_row, block_col)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        from rasterio.windows import Window
+        row_off = block_row * self.block_height
+        col_off = block_col * self.block_width
+        window = Window(col_off, row_off, min(self.block_width, self.shape[1] - col_off),
+                        min(self.block_height, self.shape[0] - row_off))
+        data = self.src.read(1, window=window)
+
+        self.cache[key] = data
+        if len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, index):
+        rows, cols = np.broadcast_arrays(*(np.asarray(i, dtype=np.int64) for i in index))
+        shape = rows.shape
+        rows, cols = rows.ravel(), cols.ravel()
+
+        values = np.empty(rows.size, dtype=self.dtype)
+        if rows.size == 0:
+            return values.reshape(shape)
+        block_rows = rows // self.block_height
+        block_cols = cols // self.block_width
+
+        # pixels grouped by window, each window is read once per call
+        block_ids = block_rows * self.n_block_cols + block_cols
+        order = np.argsort(block_ids, kind='stable')
+        _, starts = np.unique(block_ids[order], return_index=True)
+
+        for selected in np.split(order, starts[1:]):
+            block_row, block_col = block_rows[selected[0]], block_cols[selected[0]]
+            data = self.block(block_row, block_col)
+            values[selected] = data[rows[selected] - block_row * self.block_height,
+                                    cols[selected] - block_col * self.block_width]
+        return values.reshape(shape)
+
+
+def sample_dem(dem_data, transform, lng, lat, method=DEM_SAMPLING, nodata=None):
+    # DEM elevations at arrays of lon/lat, NaN outside the DEM or on nodata pixels
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    height, width = dem_data.shape
+
+    # fractional pixel coords, pixel (r, c) covers [c, c + 1) x [r, r + 1)
+    inverse = ~transform
+    cols = inverse.a * lng + inverse.b * lat + inverse.c
+    rows = inverse.d * lng + inverse.e * lat + inverse.f
+
+    elevations = np.full(lng.shape, np.nan)
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+
+    def pixels(r, c):
+        values = np.asarray(dem_data[r, c], dtype=np.float64)
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        return values
+
+    if method == 'nearest':
+        elevations[inside] = pixels(rows[inside].astype(np.int64), cols[inside].astype(np.int64))
+        return elevations
+    if method != 'bilinear':
+        raise ValueError(f'unknown DEM sampling {method}')
+
+    # the 4 pixel centers around each point, clamped at the edges
+    x = cols[inside] - 0.5
+    y = rows[inside] - 0.5
+    c0 = np.floor(x).astype(np.int64)
+    r0 = np.floor(y).astype(np.int64)
+    fx = x - c0
+    fy = y - r0
+    c0, c1 = np.clip(c0, 0, width - 1), np.clip(c0 + 1, 0, width - 1)
+    r0, r1 = np.clip(r0, 0, height - 1), np.clip(r0 + 1, 0, height - 1)
+
+    corners = np.stack([pixels(r0, c0), pixels(r0, c1), pixels(r1, c0), pixels(r1, c1)])
+    weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy])
+
+    # nodata corners drop out and the remaining weights are renormalized
+    weights[np.isnan(corners)] = 0
+    total = weights.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        elevations[inside] = np.where(total > 0, np.nansum(corners * weights, axis=0) / total, np.nan)
+    return elevations
+
+
 # returns list of relative coords
 def coordinate_picker():
+    import matplotlib.pyplot as plt
+
+    with open_tif(TIF_PATH) as src:
+        transform = dem_transform(src)
+        dem_shape = (src.height, src.width)
 
-    with rasterio.open(TIF_PATH) as src:
-        dem_data = src.read(1)  # read first band (elevation data)
+        # decimated first band for display, full resolution is only read at the clicked pixels
+        scale = max(1, int(np.ceil(max(dem_shape) / PICKER_PIXELS)))
+        dem_data = src.read(1, out_shape=(int(np.ceil(src.height / scale)), int(np.ceil(src.width / scale))))
     
     # create figure and display im
     fig, ax = plt.subplots()
@@ -45,33 +331,25 @@ def coordinate_picker():
     # mouse click handler
     def onclick(event):
         if event.xdata is not None and event.ydata is not None:
-            # absolute coords
-            abs_x = int(round(event.xdata))
-            abs_y = int(round(event.ydata))
-
-            # relative coords
-            rel_x = (event.xdata) / dem_data.shape[1]
-            rel_y = (event.ydata) / dem_data.shape[0]
+            # full resolution coords, imshow puts pixel centers on whole numbers
+            col = (event.xdata + 0.5) * dem_shape[1] / dem_data.shape[1]
+            row = (event.ydata + 0.5) * dem_shape[0] / dem_data.shape[0]
+            abs_x = int(np.floor(col))
+            abs_y = int(np.floor(row))
 
             # geographic coords
-            range_long = GEO_BOUNDS[1] - GEO_BOUNDS[0]
-            range_lat = GEO_BOUNDS[3] - GEO_BOUNDS[2]
-            long = rel_x * range_long + GEO_BOUNDS[0]
-            lat = GEO_BOUNDS[3] - rel_y * range_lat
+            long, lat = transform * (col, row)
 
 
 
-            if (abs_x < 0 or abs_x >= dem_data.shape[1] or abs_y < 0 or abs_y >= dem_data.shape[0]):
+            if (abs_x < 0 or abs_x >= dem_shape[1] or abs_y < 0 or abs_y >= dem_shape[0]):
                 return
 
             # mark clicked
             ax.plot(event.xdata, event.ydata, 'ro', markersize=5)
             fig.canvas.draw()
 
-            # get elevation value
-            elevation = dem_data[abs_y, abs_x]
-            
-            coordinates.append((long, lat, elevation))            
+            coordinates.append((long, lat, (abs_y, abs_x)))            
                                     
     
     # connect event handler
@@ -86,6 +364,13 @@ def coordinate_picker():
     
     plt.show()
 
+    # elevation values at the clicked pixels
+    if coordinates:
+        rows, cols = zip(*[pixel for _, _, pixel in coordinates])
+        with open_tif(TIF_PATH) as src:
+            elevations = DEMBlocks(src)[rows, cols]
+        coordinates = [(long, lat, elevation) for (long, lat, _), elevation in zip(coordinates, elevations)]
+
     # temp loop for hardcoded
     # for i in range(10):
     #     for j in range(10):
@@ -108,49 +393,37 @@ def coordinate_picker():
 
 
     
-    return coordinates, dem_data
+    return coordinates
     
 
 # prints elevation difference of closest GEDI point
-def matchGEDI(coords, dem_data):
-    with open(PKL_PATH, 'rb') as f:
-        data = pickle.load(f)
-    
-    # track best matches for each coord
+def matchGEDI(coords, dem_data, transform, nodata=None, metric=MATCH_METRIC, sampling=DEM_SAMPLING):
+    data = gedi_store.open_gedi(PKL_PATH)
+    user_longs = np.array([user_coord[0] for user_coord in coords], dtype=np.float64)
+    user_lats = np.array([user_coord[1] for user_coord in coords], dtype=np.float64)
+
+    # closest GEDI point to each clicked coordinate
+    nearest, distances = match_region(data, user_longs, user_lats, metric)
+
+    matched = np.flatnonzero(nearest >= 0)
+    points = nearest[matched]
+    longitudes = data[LON_COLUMN][points]
+    latitudes = data[LAT_COLUMN][points]
+    elevations = data[ELEVATION_COLUMN][points]
+
     closest_points = [None] * len(coords)
-    min_distances = [float('inf')] * len(coords)
-        
-    # loop thru all GEDI points
-    for i in range(len(data['prop'])):
-            
-        entry = data['prop'][i]
-        prop_rh = data['prop_rh'][i]
-        
-        latitude = prop_rh['lat_lowestmode']
-        longitude = prop_rh['lon_lowestmode']
-        # elevation = entry['elev_lowestmode']
-        elevation = prop_rh['geolocation/digital_elevation_model']
-        
-        if not area_filter(longitude, latitude):
-            continue
-        
-        # check against each clicked coordinate
-        for j, user_coord in enumerate(coords):
-            user_long, user_lat, _ = user_coord
-            
-            # euclidean dist
-            dist = np.sqrt((longitude - user_long)**2 + (latitude - user_lat)**2)
-            
-            # update new closest match
-            if dist < min_distances[j]:
-                min_distances[j] = dist
-                closest_points[j] = {
-                    'longitude': longitude,
-                    'latitude': latitude,
-                    'elevation': elevation,
-                    'distance': dist,
-                    'index': i
-                }
+    for k, j in enumerate(matched):
+        closest_points[j] = {
+            'longitude': longitudes[k],
+            'latitude': latitudes[k],
+            'elevation': elevations[k],
+            'distance': distances[j],
+            'index': points[k]
+        }
+
+    # DEM under every matched GEDI point in one pass
+    tif_at_gedi = np.full(len(coords), np.nan)
+    tif_at_gedi[matched] = sample_dem(dem_data, transform, longitudes, latitudes, sampling, nodata)
     
     # data for viz
     gedi_elevations = []
@@ -165,22 +438,12 @@ def matchGEDI(coords, dem_data):
         closest_point = closest_points[j]
         
         print(f"Processing TIF point {j+1}:")
-        
-        # convert geo coords back to pixel coords
-        range_long = GEO_BOUNDS[1] - GEO_BOUNDS[0]
-        range_lat = GEO_BOUNDS[3] - GEO_BOUNDS[2]
-
-        # convert GEDI geo coordinates to relative coordinates
-        rel_x = (closest_point['longitude'] - GEO_BOUNDS[0]) / range_long
-        rel_y = (GEO_BOUNDS[3] - closest_point['latitude']) / range_lat
 
-        # convert relative to pixel coords
-        pixel_x = int(round(rel_x * dem_data.shape[1]))
-        pixel_y = int(round(rel_y * dem_data.shape[0]))
-        pixel_x = max(0, min(pixel_x, dem_data.shape[1] - 1))
-        pixel_y = max(0, min(pixel_y, dem_data.shape[0] - 1))
+        tif_elevation_at_gedi = tif_at_gedi[j]
+        if closest_point is None or np.isnan(tif_elevation_at_gedi):
+            print("\tNo GEDI point with TIF data\n")
+            continue
 
-        tif_elevation_at_gedi = dem_data[pixel_y, pixel_x]
         elevation_diff = tif_elevation_at_gedi - closest_point['elevation']
 
         # store data for visualization
@@ -196,6 +459,23 @@ def matchGEDI(coords, dem_data):
         print(f"\tElevation difference: \t\t{elevation_diff:.2f}m")
         print()
     
+    plot_differences(gedi_longitudes, gedi_latitudes, gedi_elevations, tif_elevations, elevation_diffs)
+
+
+def show_figure(fig, output_dir, filename):
+    import matplotlib.pyplot as plt
+    if output_dir is None:
+        plt.show()
+    else:
+        fig.savefig(os.path.join(output_dir, filename), dpi=150)
+        plt.close(fig)
+
+
+# histogram, GEDI vs TIF scatter and spatial map of the differences
+# shown interactively, or saved as PNGs when output_dir is given
+def plot_differences(gedi_longitudes, gedi_latitudes, gedi_elevations, tif_elevations, elevation_diffs, output_dir=None):
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mticker
     # viz
     if len(elevation_diffs) > 0:
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
@@ -231,7 +511,7 @@ def matchGEDI(coords, dem_data):
         ax2.set_aspect('equal')
                 
         plt.tight_layout()
-        plt.show()
+        show_figure(fig, output_dir, 'elevation_differences.png')
 
         # color map to show the dem differences
         if len(elevation_diffs) > 0:
@@ -259,33 +539,210 @@ def matchGEDI(coords, dem_data):
             ax_scatter.set_aspect('auto')
 
             plt.tight_layout()
-            plt.show()
+            show_figure(fig_scatter, output_dir, 'spatial_differences.png')
+
 
 
+class RunningStats:
+    # count, mean, variance (Welford, merged a chunk at a time), RMSE and range of a stream
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sum_squares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        if values.size == 0:
+            return
+        chunk_mean = values.mean()
+        chunk_m2 = ((values - chunk_mean) ** 2).sum()
+
+        total = self.count + values.size
+        delta = chunk_mean - self.mean
+        self.mean += delta * values.size / total
+        self.m2 += chunk_m2 + delta ** 2 * self.count * values.size / total
+        self.count = total
+
+        self.sum_squares += (values ** 2).sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count) if self.count else np.nan
+
+    @property
+    def rmse(self):
+        return np.sqrt(self.sum_squares / self.count) if self.count else np.nan
+
+
+class QuantileSketch:
+    # stream summarized as at most size equal-weight centroids, quantile rank error about 1 / size
+
+    def __init__(self, size=REPORT_SKETCH_SIZE):
+        self.size = size
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+        values = np.concatenate([self.values, values])
+
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        if values.size <= self.size:
+            self.values, self.weights = values, weights
+            return
+
+        # neighbouring values merged into size buckets of equal weight
+        cumulative = np.cumsum(weights)
+        buckets = np.minimum(((cumulative - weights / 2) / cumulative[-1] * self.size).astype(np.int64), self.size - 1)
+        bucket_weights = np.bincount(buckets, weights, minlength=self.size)
+        bucket_sums = np.bincount(buckets, values * weights, minlength=self.size)
+
+        filled = bucket_weights > 0
+        self.values = bucket_sums[filled] / bucket_weights[filled]
+        self.weights = bucket_weights[filled]
+
+    def quantile(self, q):
+        if self.values.size == 0:
+            return np.nan
+        midpoints = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(q * self.weights.sum(), midpoints, self.values)
+
+
+class PointSample:
+    # uniform sample of at most size rows of a stream, the rows given the smallest random keys
+
+    def __init__(self, size=REPORT_PLOT_POINTS, seed=0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.rows = None
+
+    def update(self, rows):
+        keys = np.concatenate([self.keys, self.rng.random(len(rows))])
+        rows = rows if self.rows is None else np.concatenate([self.rows, rows])
+        if keys.size > self.size:
+            keep = np.sort(np.argpartition(keys, self.size)[:self.size])
+            keys, rows = keys[keep], rows[keep]
+        self.keys, self.rows = keys, rows
+
+
+def region_queries(data):
+    # (lng, lat) of the store's points inside GEO_BOUNDS, REPORT_CHUNK index candidates at a time
+    candidates = gedi_index.open_index(data, LON_COLUMN, LAT_COLUMN).candidates(GEO_BOUNDS)
+    for _, batch in gedi_store.iter_batches(data, REPORT_CHUNK, [LON_COLUMN, LAT_COLUMN], candidates):
+        in_area = area_filter(batch[LON_COLUMN], batch[LAT_COLUMN])
+        yield batch[LON_COLUMN][in_area], batch[LAT_COLUMN][in_area]
+
+
+def report_region(data, dem_data, transform, nodata=None, metric=MATCH_METRIC, sampling=DEM_SAMPLING, report_dir=None,
+                  queries=None):
+    # headless matchGEDI: the closest GEDI point to each query, region_queries(data) by default, is
+    # compared with the DEM batch by batch and written to report_dir (see write_report), so memory
+    # stays flat however many points the region has. every batch matches against the whole region,
+    # whose trees are built once up front
+    queries = region_queries(data) if queries is None else queries
+    trees = region_trees(data, metric)
+
+    def matched_points():
+        for query_lng, query_lat in queries:
+            nearest, _ = match_region(data, query_lng, query_lat, metric, trees)
+            points = nearest[nearest >= 0]
+            yield data[LON_COLUMN][points], data[LAT_COLUMN][points], data[ELEVATION_COLUMN][points]
+
+    write_report(report_dir, matched_points(), dem_data, transform, nodata, sampling)
+
+
+def write_report(report_dir, points, dem_data, transform, nodata=None, sampling=DEM_SAMPLING):
+    # streams the TIF - GEDI difference of (longitudes, latitudes, elevations) batches of matched points to report_dir:
+    #   differences.csv     longitude, latitude, GEDI and TIF elevation and difference per point
+    #   summary.json        running stats and percentiles of the differences
+    #   *.png               plots of a sample of at most REPORT_PLOT_POINTS points
+    os.makedirs(report_dir, exist_ok=True)
+
+    stats = RunningStats()
+    sketch = QuantileSketch()
+    sample = PointSample()
+    without_dem = 0
+
+    with open(os.path.join(report_dir, 'differences.csv'), 'w') as f:
+        f.write('longitude,latitude,gedi_elevation,tif_elevation,difference\n')
+
+        for longitudes, latitudes, elevations in points:
+            tif_elevations = sample_dem(dem_data, transform, longitudes, latitudes, sampling, nodata)
+            differences = tif_elevations - elevations
+
+            valid = ~np.isnan(differences)
+            without_dem += int(np.count_nonzero(~valid))
+
+            rows = np.column_stack([longitudes, latitudes, elevations, tif_elevations, differences])[valid]
+            np.savetxt(f, rows, fmt=['%.6f', '%.6f', '%.2f', '%.2f', '%.2f'], delimiter=',')
+
+            stats.update(rows[:, 4])
+            sketch.update(rows[:, 4])
+            sample.update(rows)
+
+    summary = {
+        'points': stats.count,
+        'without_dem': without_dem,
+        'mean': stats.mean if stats.count else np.nan,
+        'std': stats.std,
+        'rmse': stats.rmse,
+        'min': stats.min if stats.count else np.nan,
+        'max': stats.max if stats.count else np.nan,
+        'percentiles': {str(p): sketch.quantile(p / 100) for p in REPORT_PERCENTILES},
+    }
+    with open(os.path.join(report_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2, default=float)
+
+    print(f'Points compared: \t\t{stats.count}')
+    print(f'Points without TIF data: \t{without_dem}')
+    print(f"Mean difference: \t\t{summary['mean']:.2f}m")
+    print(f"Median difference: \t\t{summary['percentiles']['50']:.2f}m")
+    print(f"Std of differences: \t\t{summary['std']:.2f}m")
+    print(f"RMSE: \t\t\t\t{summary['rmse']:.2f}m")
+    print(f'Report: \t\t\t{report_dir}')
+
+    # plots straight to files
+    if sample.rows is not None and len(sample.rows) > 0:
+        import matplotlib.pyplot as plt
+        plt.switch_backend('Agg')
+        longitude, latitude, gedi_elevation, tif_elevation, difference = sample.rows.T
+        plot_differences(longitude, latitude, gedi_elevation, tif_elevation, difference, output_dir=report_dir)
+
     
 # if __name__ == "__main__":
-#     coords, dem_data = coordinate_picker()
-#     matchGEDI(coords, dem_data)
+#     coords = coordinate_picker()
+#     with rasterio.open(TIF_PATH) as src:
+#         matchGEDI(coords, DEMBlocks(src), dem_transform(src), src.nodata)
 
 
 if __name__ == "__main__":
-    # Load DEM data
-    with rasterio.open(TIF_PATH) as src:
-        dem_data = src.read(1)
+    parser = argparse.ArgumentParser(description='Compare GEDI elevations with the TIF DEM')
+    parser.add_argument('--report', metavar='DIR', help='write stats, differences and plots to DIR instead of printing and showing them')
+    args = parser.parse_args()
 
     # Load all GEDI waveforms
-    with open(PKL_PATH, 'rb') as f:
-        data = pickle.load(f)
-
-    # Filter GEDI points within bounds
-    coords = []
-    for i in range(len(data['prop_rh'])):
-        prop = data['prop_rh'][i]
-        lon = prop['lon_lowestmode']
-        lat = prop['lat_lowestmode']
-        elev = prop['geolocation/digital_elevation_model']
-        if area_filter(lon, lat):
-            coords.append((lon, lat, elev))
-
-    # Compare and visualize
-    matchGEDI(coords, dem_data)
\ No newline at end of file
+    data = gedi_store.open_gedi(PKL_PATH)
+
+    # DEM data is read window by window as GEDI points need it
+    with open_tif(TIF_PATH) as src:
+        if args.report:
+            # headless: every GEDI point in the region, stats, differences and plots go to the report dir
+            report_region(data, DEMBlocks(src), dem_transform(src), src.nodata, report_dir=args.report)
+        else:
+            # Filter GEDI points within bounds
+            candidates = gedi_index.open_index(data, 'prop_rh/lon_lowestmode', 'prop_rh/lat_lowestmode').candidates(GEO_BOUNDS)
+            lon = data['prop_rh/lon_lowestmode'][candidates]
+            lat = data['prop_rh/lat_lowestmode'][candidates]
+            elev = data['prop_rh/geolocation/digital_elevation_model'][candidates]
+            in_area = area_filter(lon, lat)
+            coords = list(zip(lon[in_area], lat[in_area], elev[in_area]))
+
+            # Compare and visualize
+            matchGEDI(coords, DEMBlocks(src), dem_transform(src), src.nodata)
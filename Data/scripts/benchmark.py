@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic_gedi
+import gedi_metrics
+
+# benchmark of the pkl2CSV.py pipeline and the validator matching on synthetic data
+#   python benchmark.py --footprints 10000 100000 --output results.json
+#   python benchmark.py --footprints 10000 100000 --output new.json --compare results.json
+# each size runs in its own process, so peak RSS is that of one size. every stage records wall
+# and CPU seconds, footprints/s, the peak RSS after it and the bytes it wrote. synthetic inputs
+# are kept in --workdir and reused while size and seed match, so runs differ only by the code
+
+# sizes up to PICKLE_FOOTPRINTS get a pickle and time its loading and conversion, larger ones
+# have their column cache written directly (see synthetic_gedi.py)
+PICKLE_FOOTPRINTS = 1000000
+
+# region exported, inside synthetic_gedi.BOUNDS like mapia_partial.yaml
+GEO_BOUNDS = [-69.0, -68.3, -9.0, -8.3]
+ADAPTIVE_THRESHOLD = 0.1
+CLIP_METERS_ABOVE_RH98 = 5
+
+# bits per waveform value of the codec stages (see gedi_codec.py)
+CODEC_BITS = 12
+
+# coordinates matched by the validator stage
+MATCH_QUERIES = 1000
+
+# a stage is reported as a regression when it gets this much slower, ignoring stages under MIN_SECONDS
+REGRESSION_TOLERANCE = 0.2
+MIN_SECONDS = 0.05
+
+RESULTS_VERSION = 1
+
+
+def measure(stages, name, function, items):
+    # runs function() as stage name of items footprints, records it in stages and returns its result
+    start, cpu_start = time.perf_counter(), time.process_time()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = gedi_metrics.peak_rss_mb()
+    stages[name] = {
+        'seconds': round(seconds, 4),
+        'cpu_seconds': round(time.process_time() - cpu_start, 4),
+        'footprints': int(items),
+        'footprints_per_second': round(items / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': None if peak is None else round(peak, 1),
+        'output_bytes': 0,
+    }
+    print(f"{f'{name}:':<24}{seconds:9.3f} s {stages[name]['footprints_per_second'] or 0:14,.0f} footprints/s")
+    return result
+
+
+def write_config(path, pkl_path, output_dir):
+    config = {
+        'input': {'debug_mode': False, 'pkl_file': pkl_path, 'use_cache': True, 'cache_dir': None},
+        'processing': {
+            'adaptive_threshold': ADAPTIVE_THRESHOLD,
+            'geo_bounds': GEO_BOUNDS,
+            'clip_meters_above_rh98': CLIP_METERS_ABOVE_RH98,
+            'apply_square_root': False,
+            'incremental': False,
+        },
+        'output': {'path': output_dir, 'base_filename': 'benchmark', 'format': 'both'},
+    }
+    import yaml
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+
+def synthetic_inputs(workdir, n_footprints, seed):
+    # (pkl path, tif path) of the synthetic data of a size, generated on first use
+    pkl_path = os.path.join(workdir, f'synthetic_{n_footprints}_{seed}.pkl')
+    tif_path = os.path.join(workdir, f'synthetic_{seed}.tif')
+    import gedi_store
+    if n_footprints <= PICKLE_FOOTPRINTS:
+        if not os.path.exists(pkl_path):
+            synthetic_gedi.write_pickle(pkl_path, n_footprints, seed)
+    elif not os.path.exists(os.path.join(gedi_store.default_cache_dir(pkl_path), gedi_store.META_FILENAME)):
+        synthetic_gedi.write_store(pkl_path, n_footprints, seed)
+    if not os.path.exists(tif_path):
+        try:
+            synthetic_gedi.write_dem(tif_path, seed=seed)
+        except Exception as e:
+            print(f'GeoTIFF error: {e}')
+    return pkl_path, tif_path
+
+
+def run_size(n_footprints, workdir, seed):
+    # stage results of one size, run in a fresh process by main
+    pkl_path, tif_path = synthetic_inputs(workdir, n_footprints, seed)
+
+    import gedi_binary
+    import gedi_codec
+    import gedi_store
+    import pkl2CSV
+
+    output_dir = tempfile.mkdtemp(prefix='benchmark_', dir=workdir)
+    config_path = os.path.join(output_dir, 'benchmark.yaml')
+    write_config(config_path, pkl_path, output_dir + os.sep)
+    pkl2CSV.configure(config_path)
+
+    stages = {}
+    if os.path.exists(pkl_path):
+        # the conversion benchmarked from scratch, without a cache left by an earlier run
+        cache_dir = gedi_store.default_cache_dir(pkl_path)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+        def load_pickle():
+            with open(pkl_path, 'rb') as f:
+                return pickle.load(f)
+
+        data = measure(stages, 'load_pickle', load_pickle, n_footprints)
+        del data
+        measure(stages, 'convert_pickle', lambda: gedi_store.convert_pickle(pkl_path), n_footprints)
+        stages['convert_pickle']['output_bytes'] = directory_bytes(cache_dir)
+
+    store = gedi_store.open_gedi(pkl_path, verbose=False)
+    columns = pkl2CSV.store_columns(store)
+    filtered = measure(stages, 'filter', lambda: pkl2CSV.filter_footprints(columns), len(columns['y']))
+    count = len(filtered['y'])
+    segments = measure(stages, 'downsample', lambda: pkl2CSV.downsample_footprints(filtered), count)
+    normalized = measure(stages, 'normalize', lambda: pkl2CSV.normalize_footprints(segments), count)
+    clipped = measure(stages, 'clip', lambda: pkl2CSV.clip_footprints(filtered, segments, normalized), count)
+    table = pkl2CSV.output_table(filtered, clipped)
+    del filtered, segments, normalized, clipped
+
+    csv_path = os.path.join(output_dir, 'benchmark.csv')
+    measure(stages, 'write_csv', lambda: pkl2CSV.write_csv(pkl2CSV.table_frames(table), csv_path), count)
+    stages['write_csv']['output_bytes'] = os.path.getsize(csv_path)
+
+    binary_path = os.path.join(output_dir, 'benchmark.bin')
+    measure(stages, 'write_binary', lambda: gedi_binary.write_binary(table, binary_path), count)
+    stages['write_binary']['output_bytes'] = os.path.getsize(binary_path)
+
+    # the decoded waveforms must stay within the quantization bound, a failing check stops the run
+    encoded = measure(stages, 'encode_codec', lambda: gedi_codec.encode(table, CODEC_BITS), count)
+    stages['encode_codec']['output_bytes'] = len(encoded)
+    decoded = measure(stages, 'decode_codec', lambda: gedi_codec.decode(encoded), count)
+    errors = gedi_codec.check_errors(table, decoded, CODEC_BITS)
+    stages['decode_codec']['max_errors'] = {name: errors[name] for name in gedi_codec.LOSSY_COLUMNS}
+    del table, encoded, decoded
+
+    run_validator(stages, store, tif_path, seed)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return stages
+
+
+def run_validator(stages, store, tif_path, seed):
+    # nearest footprint matching and DEM sampling of ElevationValidator.py for random coordinates
+    import ElevationValidator
+    # imported lazily by the validator, kept out of the matching time
+    import scipy.spatial
+    ElevationValidator.GEO_BOUNDS = GEO_BOUNDS
+
+    rng = np.random.default_rng(seed)
+    west, east, south, north = GEO_BOUNDS
+    query_lng = rng.uniform(west, east, MATCH_QUERIES)
+    query_lat = rng.uniform(south, north, MATCH_QUERIES)
+    nearest, _ = measure(stages, 'match', lambda: ElevationValidator.match_region(store, query_lng, query_lat), MATCH_QUERIES)
+
+    points = nearest[nearest >= 0]
+    lng = store[ElevationValidator.LON_COLUMN][points]
+    lat = store[ElevationValidator.LAT_COLUMN][points]
+    try:
+        import rasterio
+        with rasterio.open(tif_path) as src:
+            measure(stages, 'sample_dem', lambda: ElevationValidator.sample_dem(
+                src.read(1), ElevationValidator.dem_transform(src), lng, lat, nodata=src.nodata), len(points))
+    except Exception as e:
+        # the DEM stage needs rasterio and the GeoTIFF, the stages before it stand on their own
+        stages['sample_dem'] = {'error': f'{type(e).__name__}: {e}'}
+        print(f"{'sample_dem:':<24}{stages['sample_dem']['error']}")
+
+
+def directory_bytes(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'commit': git_commit(),
+    }
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    # prints the seconds of every stage against the baseline, returns the regressed (size, stage) pairs
+    baseline_runs = {run['footprints']: run['stages'] for run in baseline['runs']}
+    regressions = []
+    print(f"\n{'footprints':>10}  {'stage':<16}{'baseline s':>12}{'new s':>12}{'ratio':>8}")
+    for run in results['runs']:
+        old_stages = baseline_runs.get(run['footprints'])
+        if old_stages is None:
+            continue
+        for name, stage in run['stages'].items():
+            old = old_stages.get(name, {})
+            if 'seconds' not in stage or 'seconds' not in old:
+                continue
+            ratio = stage['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+            regressed = ratio > 1 + tolerance and max(stage['seconds'], old['seconds']) >= MIN_SECONDS
+            if regressed:
+                regressions.append((run['footprints'], name))
+            print(f"{run['footprints']:>10}  {name:<16}{old['seconds']:>12.3f}{stage['seconds']:>12.3f}"
+                  f"{ratio:>8.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GEDI pipeline on synthetic data')
+    parser.add_argument('--footprints', type=int, nargs='+', default=[10000, 100000], help='synthetic sizes to run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'gedi_benchmark'),
+                        help='directory keeping the synthetic inputs between runs')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--compare', metavar='BASELINE', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='slowdown of a stage reported as a regression, 0.2 is 20%%')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--stages-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    if args.run_size:
+        stages = run_size(args.run_size, workdir, args.seed)
+        with open(args.stages_output, 'w') as f:
+            json.dump(stages, f)
+        return
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'settings': {
+            'seed': args.seed,
+            'geo_bounds': GEO_BOUNDS,
+            'adaptive_threshold': ADAPTIVE_THRESHOLD,
+            'clip_meters_above_rh98': CLIP_METERS_ABOVE_RH98,
+            'match_queries': MATCH_QUERIES,
+        },
+        'runs': [],
+    }
+    for n_footprints in args.footprints:
+        print(f'\n{n_footprints:,} footprints')
+        stages_path = os.path.join(workdir, f'stages_{n_footprints}.json')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--run-size', str(n_footprints),
+                        '--seed', str(args.seed), '--workdir', workdir, '--stages-output', stages_path], check=True)
+        with open(stages_path) as f:
+            results['runs'].append({'footprints': n_footprints, 'stages': json.load(f)})
+        os.remove(stages_path)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults: \t\t\t{args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != results['settings']:
+            print('Warning: the baseline was run with different settings')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
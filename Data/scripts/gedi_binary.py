@@ -0,0 +1,103 @@
+import numpy as np
+
+# binary export of the footprint table written by pkl2CSV.py, all little-endian:
+#
+#   header          HEADER, 32 bytes
+#   scalars         float64 [n_footprints] per SCALAR_COLUMNS entry, in that order
+#   offsets         int64 [n_footprints + 1], footprint k owns samples [offsets[k]:offsets[k+1]]
+#   rh_waveform     float32 [n_footprints, rh_width], normalized as in the CSV
+#   values          float32 [n_samples]   raw_waveform_values
+#   lengths         int32 [n_samples]     raw_waveform_lengths
+#   positions       float32 [n_samples]   raw_waveform_positions
+
+MAGIC = b'GEDIWAVE'
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('rh_width', '<u4'),
+    ('n_footprints', '<u8'),
+    ('n_samples', '<u8'),
+])
+
+SCALAR_COLUMNS = [
+    'latitude',
+    'longitude',
+    'elevation',
+    'instrument_lat',
+    'instrument_lon',
+    'instrument_alt',
+    'lowest_lat',
+    'lowest_lon',
+    'lowest_elev',
+    'wgs84_elevation',
+    'rh2',
+    'rh50',
+    'rh98',
+]
+
+# variable-length sections and their on-disk dtypes
+SAMPLE_COLUMNS = {
+    'raw_waveform_values': '<f4',
+    'raw_waveform_lengths': '<i4',
+    'raw_waveform_positions': '<f4',
+}
+
+
+def write_binary(table, path):
+    # table: dict of SCALAR_COLUMNS, 'rh_waveform', SAMPLE_COLUMNS and 'raw_waveform_offsets'
+    offsets = np.asarray(table['raw_waveform_offsets'], dtype='<i8')
+    rh_waveform = np.asarray(table['rh_waveform'], dtype='<f4')
+
+    n_footprints = len(offsets) - 1
+    rh_width = rh_waveform.shape[1] if rh_waveform.ndim == 2 else 0
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['rh_width'] = rh_width
+    header['n_footprints'] = n_footprints
+    header['n_samples'] = offsets[-1]
+
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        for name in SCALAR_COLUMNS:
+            f.write(np.asarray(table[name], dtype='<f8').tobytes())
+        f.write(offsets.tobytes())
+        f.write(rh_waveform.tobytes())
+        for name, dtype in SAMPLE_COLUMNS.items():
+            f.write(np.asarray(table[name], dtype=dtype).tobytes())
+
+
+def read_binary(path):
+    # returns the table as written by write_binary, with on-disk dtypes
+    with open(path, 'rb') as f:
+        header = np.fromfile(f, dtype=HEADER, count=1)
+        if header.size == 0 or header['magic'][0] != MAGIC:
+            raise ValueError(f'{path} is not a GEDI waveform file')
+        if header['version'][0] != VERSION:
+            raise ValueError(f"{path}: unsupported version {header['version'][0]}")
+
+        n_footprints = int(header['n_footprints'][0])
+        n_samples = int(header['n_samples'][0])
+        rh_width = int(header['rh_width'][0])
+
+        table = {}
+        for name in SCALAR_COLUMNS:
+            table[name] = np.fromfile(f, dtype='<f8', count=n_footprints)
+        table['raw_waveform_offsets'] = np.fromfile(f, dtype='<i8', count=n_footprints + 1)
+        table['rh_waveform'] = np.fromfile(f, dtype='<f4', count=n_footprints * rh_width).reshape(n_footprints, rh_width)
+        for name, dtype in SAMPLE_COLUMNS.items():
+            table[name] = np.fromfile(f, dtype=dtype, count=n_samples)
+
+    if table['raw_waveform_positions'].size != n_samples:
+        raise ValueError(f'{path} is truncated')
+
+    return table
+
+
+def footprint_waveform(table, k):
+    # (values, lengths, positions) of footprint k
+    start, stop = table['raw_waveform_offsets'][k], table['raw_waveform_offsets'][k + 1]
+    return tuple(table[name][start:stop] for name in SAMPLE_COLUMNS)
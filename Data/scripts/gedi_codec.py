@@ -0,0 +1,320 @@
+import zlib
+
+import numpy as np
+
+import gedi_binary
+
+# lossy-bounded waveform file of the footprint table written by pkl2CSV.py, all little-endian:
+#
+#   header          HEADER, 48 bytes
+#   block offsets   int64 [n_blocks + 1], block b is bytes [offsets[b]:offsets[b + 1]] after the offsets
+#   blocks          each BLOCK_FOOTPRINTS footprints (the last one fewer), compressed as a whole
+#
+# a block decompresses to a directory of STREAM entries, one per name in STREAMS, followed by
+# the streams. values and rh_waveform are quantized to value_bits per footprint (per row of the
+# rh): q = rint((v - lo) / (hi - lo) * (2^bits - 1)) with lo, hi the footprint's min and max, so
+# the error is at most (hi - lo) / (2^bits - 1) / 2. positions are rounded to 1 / position_scale,
+# which is exact for the pipeline's start / n_samples positions when n_samples divides it.
+# quantized values, rh and positions are delta-encoded within a footprint and zigzag mapped, and
+# integer streams use the narrowest unsigned dtype that fits. scalars and lengths are lossless
+#
+# blocks are zlib compressed by default, which .NET inflates without extra packages, or zstd
+# (smaller and faster, needs the zstandard package on both ends)
+
+MAGIC = b'GEDIWFC\0'
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('value_bits', '<u2'),
+    ('compression', '<u2'),
+    ('n_footprints', '<u8'),
+    ('n_samples', '<u8'),
+    ('n_blocks', '<u4'),
+    ('block_footprints', '<u4'),
+    ('position_scale', '<u4'),
+    ('rh_width', '<u4'),
+])
+
+# directory entry of a stream: numpy dtype string and byte count
+STREAM = np.dtype([('dtype', 'S3'), ('nbytes', '<u8')])
+
+STREAMS = ['scalars', 'counts', 'lengths', 'positions', 'value_range', 'values', 'rh_range', 'rh']
+
+COMPRESSIONS = {'zlib': 0, 'zstd': 1}
+
+VALUE_BITS = 12
+POSITION_SCALE = 2 ** 16
+BLOCK_FOOTPRINTS = 4096
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+SCALAR_COLUMNS = gedi_binary.SCALAR_COLUMNS
+
+# columns decoded within the quantization bound, the others are exact
+LOSSY_COLUMNS = ['raw_waveform_values', 'rh_waveform', 'raw_waveform_positions']
+
+
+def narrow(values):
+    # non-negative integers in the smallest unsigned dtype holding them
+    values = np.asarray(values)
+    top = int(values.max()) if values.size else 0
+    for dtype in ('<u1', '<u2', '<u4'):
+        if top <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype('<u8')
+
+
+def zigzag(values):
+    # signed -> unsigned, small magnitudes of either sign stay small
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def delta_encode(values, offsets):
+    # differences to the previous element of the same footprint, a footprint's first element is kept
+    values = np.asarray(values, dtype=np.int64)
+    deltas = np.diff(values, prepend=0)
+    starts = offsets[:-1][np.diff(offsets) > 0]
+    deltas[starts] = values[starts]
+    return deltas
+
+
+def delta_decode(deltas, offsets):
+    sums = np.concatenate([[0], np.cumsum(deltas, dtype=np.int64)])
+    return sums[1:] - np.repeat(sums[offsets[:-1]], np.diff(offsets))
+
+
+def value_ranges(values, offsets):
+    # float32 (lo, hi) of each footprint ignoring NaNs, (0, 0) for footprints without values
+    # footprints of NaNs only (normalized without energy) get a NaN range and decode to NaNs
+    counts = np.diff(offsets)
+    ranges = np.zeros((counts.size, 2), dtype='<f4')
+    filled = counts > 0
+    if values.size:
+        starts = offsets[:-1][filled]
+        with np.errstate(invalid='ignore'):
+            ranges[filled, 0] = np.fmin.reduceat(values, starts)
+            ranges[filled, 1] = np.fmax.reduceat(values, starts)
+    return ranges
+
+
+def quantization_steps(ranges, bits):
+    # value of one quantization step per footprint, 0 for constant footprints
+    return (ranges[:, 1].astype(np.float64) - ranges[:, 0]) / (2 ** bits - 1)
+
+
+def quantize(values, offsets, bits):
+    # (q, ranges) of values quantized per footprint to bits
+    values = np.asarray(values, dtype=np.float64)
+    ranges = value_ranges(values, offsets)
+    counts = np.diff(offsets)
+    steps = np.repeat(quantization_steps(ranges, bits), counts)
+    lows = np.repeat(ranges[:, 0].astype(np.float64), counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        q = np.nan_to_num(np.where(steps > 0, np.rint((values - lows) / steps), 0))
+    return np.clip(q, 0, 2 ** bits - 1).astype(np.int64), ranges
+
+
+def dequantize(q, ranges, offsets, bits):
+    counts = np.diff(offsets)
+    steps = np.repeat(quantization_steps(ranges, bits), counts)
+    return (np.repeat(ranges[:, 0].astype(np.float64), counts) + q * steps).astype('<f4')
+
+
+def encode_block(table, value_bits, position_scale):
+    # streams of a table of footprints, {name: array} in STREAMS order
+    offsets = np.asarray(table['raw_waveform_offsets'], dtype=np.int64)
+    offsets = offsets - offsets[0]
+    rh = np.asarray(table['rh_waveform'], dtype=np.float64)
+    rh_offsets = np.arange(rh.shape[0] + 1, dtype=np.int64) * (rh.shape[1] if rh.ndim == 2 else 0)
+
+    values, value_range = quantize(table['raw_waveform_values'], offsets, value_bits)
+    rh_values, rh_range = quantize(rh.ravel(), rh_offsets, value_bits)
+    ticks = np.rint(np.asarray(table['raw_waveform_positions'], dtype=np.float64) * position_scale)
+
+    return {
+        'scalars': np.stack([np.asarray(table[name], dtype='<f8') for name in SCALAR_COLUMNS]),
+        'counts': narrow(np.diff(offsets)),
+        'lengths': narrow(table['raw_waveform_lengths']),
+        'positions': narrow(zigzag(delta_encode(ticks, offsets))),
+        'value_range': value_range,
+        'values': narrow(zigzag(delta_encode(values, offsets))),
+        'rh_range': rh_range,
+        'rh': narrow(zigzag(delta_encode(rh_values, rh_offsets))),
+    }
+
+
+def decode_block(streams, value_bits, position_scale, rh_width):
+    # footprint table of a block's streams, with the dtypes of gedi_binary.read_binary
+    counts = streams['counts'].astype(np.int64)
+    n_footprints = counts.size
+    offsets = np.zeros(n_footprints + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    rh_offsets = np.arange(n_footprints + 1, dtype=np.int64) * rh_width
+
+    table = {name: column for name, column in zip(SCALAR_COLUMNS, streams['scalars'].reshape(len(SCALAR_COLUMNS), n_footprints))}
+    table['raw_waveform_offsets'] = offsets
+    rh = delta_decode(unzigzag(streams['rh']), rh_offsets)
+    table['rh_waveform'] = dequantize(rh, streams['rh_range'].reshape(-1, 2), rh_offsets, value_bits).reshape(n_footprints, rh_width)
+    values = delta_decode(unzigzag(streams['values']), offsets)
+    table['raw_waveform_values'] = dequantize(values, streams['value_range'].reshape(-1, 2), offsets, value_bits)
+    table['raw_waveform_lengths'] = streams['lengths'].astype('<i4')
+    table['raw_waveform_positions'] = (delta_decode(unzigzag(streams['positions']), offsets) / position_scale).astype('<f4')
+    return table
+
+
+def compressor(compression):
+    # (compress, decompress) of a compression name
+    if compression == 'zlib':
+        return (lambda data: zlib.compress(data, ZLIB_LEVEL)), zlib.decompress
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression needs the zstandard package (pip install zstandard)')
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f'unknown compression {compression!r}, expected one of {list(COMPRESSIONS)}')
+
+
+def pack_streams(streams):
+    directory = np.zeros(len(STREAMS), dtype=STREAM)
+    for entry, name in zip(directory, STREAMS):
+        entry['dtype'] = streams[name].dtype.str.encode()
+        entry['nbytes'] = streams[name].nbytes
+    return directory.tobytes() + b''.join(np.ascontiguousarray(streams[name]).tobytes() for name in STREAMS)
+
+
+def unpack_streams(data):
+    directory = np.frombuffer(data, dtype=STREAM, count=len(STREAMS))
+    streams = {}
+    position = directory.nbytes
+    for entry, name in zip(directory, STREAMS):
+        nbytes = int(entry['nbytes'])
+        streams[name] = np.frombuffer(data, dtype=entry['dtype'].decode(), count=nbytes // np.dtype(entry['dtype'].decode()).itemsize,
+                                      offset=position)
+        position += nbytes
+    return streams
+
+
+def encode(table, value_bits=VALUE_BITS, compression='zlib', position_scale=POSITION_SCALE,
+           block_footprints=BLOCK_FOOTPRINTS):
+    # bytes of the codec file of a footprint table (the output table of pkl2CSV.py)
+    if not 1 <= value_bits <= 16:
+        raise ValueError(f'value_bits must be 1 to 16, got {value_bits}')
+    compress, _ = compressor(compression)
+
+    offsets = np.asarray(table['raw_waveform_offsets'], dtype=np.int64)
+    rh_waveform = np.asarray(table['rh_waveform'])
+    n_footprints = len(offsets) - 1
+    starts = list(range(0, n_footprints, block_footprints)) or [0]
+
+    blocks = []
+    for start in starts:
+        stop = min(start + block_footprints, n_footprints)
+        block = {name: np.asarray(table[name])[start:stop] for name in SCALAR_COLUMNS}
+        block['rh_waveform'] = rh_waveform[start:stop]
+        block['raw_waveform_offsets'] = offsets[start:stop + 1]
+        for name in gedi_binary.SAMPLE_COLUMNS:
+            block[name] = np.asarray(table[name])[offsets[start]:offsets[stop]]
+        blocks.append(compress(pack_streams(encode_block(block, value_bits, position_scale))))
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['value_bits'] = value_bits
+    header['compression'] = COMPRESSIONS[compression]
+    header['n_footprints'] = n_footprints
+    header['n_samples'] = offsets[-1] - offsets[0] if offsets.size else 0
+    header['n_blocks'] = len(blocks)
+    header['block_footprints'] = block_footprints
+    header['position_scale'] = position_scale
+    header['rh_width'] = rh_waveform.shape[1] if rh_waveform.ndim == 2 else 0
+
+    block_offsets = np.zeros(len(blocks) + 1, dtype='<i8')
+    block_offsets[1:] = np.cumsum([len(block) for block in blocks])
+    return header.tobytes() + block_offsets.tobytes() + b''.join(blocks)
+
+
+def decode(data):
+    # footprint table of codec file bytes, with the dtypes of gedi_binary.read_binary
+    header = np.frombuffer(data, dtype=HEADER, count=1)
+    if header.size == 0 or header['magic'][0] != MAGIC.rstrip(b'\0'):
+        raise ValueError('not a GEDI waveform codec file')
+    if header['version'][0] != VERSION:
+        raise ValueError(f"unsupported version {header['version'][0]}")
+
+    names = {code: name for name, code in COMPRESSIONS.items()}
+    _, decompress = compressor(names[int(header['compression'][0])])
+    value_bits = int(header['value_bits'][0])
+    position_scale = int(header['position_scale'][0])
+    rh_width = int(header['rh_width'][0])
+    n_blocks = int(header['n_blocks'][0])
+
+    block_offsets = np.frombuffer(data, dtype='<i8', count=n_blocks + 1, offset=HEADER.itemsize)
+    base = HEADER.itemsize + block_offsets.nbytes
+    if base + block_offsets[-1] > len(data):
+        raise ValueError('codec file is truncated')
+
+    blocks = [decode_block(unpack_streams(decompress(data[base + start:base + stop])), value_bits, position_scale, rh_width)
+              for start, stop in zip(block_offsets[:-1], block_offsets[1:])]
+
+    table = {}
+    for name in [*SCALAR_COLUMNS, 'rh_waveform', *gedi_binary.SAMPLE_COLUMNS]:
+        table[name] = np.concatenate([block[name] for block in blocks])
+    counts = np.concatenate([np.diff(block['raw_waveform_offsets']) for block in blocks])
+    table['raw_waveform_offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype('<i8')
+    return table
+
+
+def write_codec(table, path, value_bits=VALUE_BITS, compression='zlib'):
+    with open(path, 'wb') as f:
+        f.write(encode(table, value_bits, compression))
+
+
+def read_codec(path):
+    with open(path, 'rb') as f:
+        return decode(f.read())
+
+
+def check_errors(table, decoded, value_bits=VALUE_BITS, position_scale=POSITION_SCALE):
+    # {column: max abs error} of a decoded table against the table it was encoded from
+    # raises ValueError when a column doesn't decode to its shape or an element is further off than the codec's bound
+    offsets = np.asarray(table['raw_waveform_offsets'], dtype=np.int64)
+    offsets = offsets - offsets[0]
+    values = np.asarray(table['raw_waveform_values'], dtype=np.float64)
+    rh = np.asarray(table['rh_waveform'], dtype=np.float64)
+    rh_offsets = np.arange(rh.shape[0] + 1, dtype=np.int64) * (rh.shape[1] if rh.ndim == 2 else 0)
+
+    def max_error(name, original, bound=0.0):
+        original = np.asarray(original, dtype=np.float64).ravel()
+        result = np.asarray(decoded[name], dtype=np.float64).ravel()
+        if result.shape != original.shape:
+            raise ValueError(f'{name}: {result.shape} decoded for {original.shape}')
+        missing = np.isnan(original) & np.isnan(result)
+        error = np.where(missing, 0, np.abs(result - original))
+        # float32 outputs add their own rounding to the quantization
+        bound = bound + np.abs(original) * np.finfo(np.float32).eps
+        over = ~(missing | (error <= bound))
+        if over.any():
+            raise ValueError(f'{name}: error {error[over].max()} over the bound at {np.flatnonzero(over)[:5]}')
+        return float(error.max()) if error.size else 0.0
+
+    value_steps = np.repeat(quantization_steps(value_ranges(values, offsets), value_bits), np.diff(offsets))
+    rh_steps = np.repeat(quantization_steps(value_ranges(rh.ravel(), rh_offsets), value_bits), np.diff(rh_offsets))
+    errors = {
+        'raw_waveform_values': max_error('raw_waveform_values', values, value_steps / 2),
+        'rh_waveform': max_error('rh_waveform', rh, rh_steps / 2),
+        'raw_waveform_positions': max_error('raw_waveform_positions', table['raw_waveform_positions'], 0.5 / position_scale),
+        'raw_waveform_lengths': max_error('raw_waveform_lengths', table['raw_waveform_lengths']),
+        'raw_waveform_offsets': max_error('raw_waveform_offsets', offsets),
+    }
+    for name in SCALAR_COLUMNS:
+        errors[name] = max_error(name, table[name])
+    return errors
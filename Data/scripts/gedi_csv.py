@@ -0,0 +1,36 @@
+import gzip
+
+# chunked CSV writing for pkl2CSV.py: the table is written a chunk of rows at a time into one
+# open handle, so the text of the whole CSV is never built in memory. gzip uses the standard
+# library, zstd needs the zstandard package
+
+# file suffix of each compression
+SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def open_text(path, compression=None):
+    # text handle writing path with the given compression
+    if compression is None:
+        return open(path, 'w', newline='')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', newline='', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression needs the zstandard package (pip install zstandard)')
+        return zstandard.open(path, 'wt', newline='', cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+    raise ValueError(f'unknown compression {compression!r}, expected one of {list(SUFFIXES)}')
+
+
+def write_frames(frames, path, compression=None):
+    # writes DataFrames one after the other as a single CSV with one header, returns the row count
+    rows = 0
+    with open_text(path, compression) as f:
+        for k, frame in enumerate(frames):
+            frame.to_csv(f, header=k == 0, index=False)
+            rows += len(frame)
+    return rows
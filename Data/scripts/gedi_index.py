@@ -0,0 +1,304 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+import gedi_store
+
+# persistent lat/lon indexes over a column cache (see gedi_store.py)
+#
+# SpatialIndex: footprints are bucketed into TILE_DEGREES square tiles, keyed row by row from (-180, -90),
+# and their indices are stored sorted by tile key. a [W, E, S, N] query looks up the tiles
+# overlapping the box, so it only reads the footprints of the region instead of the whole file.
+# the index lives inside the cache directory and goes away whenever the cache is rebuilt:
+#   spatial/<lon column>+<lat column>/
+#       meta.json       columns, tile size and footprint count
+#       order.npy       footprint indices sorted by tile key
+#       keys.npy        sorted keys of the non-empty tiles
+#       starts.npy      tile keys[t] owns order[starts[t]:starts[t + 1]]
+#
+# CoordinateIndex looks shots up by coordinates, exactly (to COORDINATE_DECIMALS) or within a tolerance:
+#   lookup/<lon column>+<lat column>/
+#       meta.json       columns, decimals, rounding (python_floats) and footprint count
+#       order.npy       footprint indices sorted by coordinate key
+#       keys.npy        coordinate key of each entry of order
+
+INDEX_VERSION = 2
+INDEX_DIRNAME = 'spatial'
+TILE_DEGREES = 0.1
+
+LOOKUP_DIRNAME = 'lookup'
+COORDINATE_DECIMALS = 6
+
+
+def grid_shape(tile_degrees):
+    # (rows, cols) of the tile grid over the whole globe
+    return int(np.ceil(180 / tile_degrees)), int(np.ceil(360 / tile_degrees))
+
+
+def tile_rows(lat, tile_degrees):
+    n_rows, _ = grid_shape(tile_degrees)
+    return np.clip(np.floor((np.asarray(lat, dtype=np.float64) + 90) / tile_degrees), 0, n_rows - 1)
+
+
+def tile_cols(lng, tile_degrees):
+    _, n_cols = grid_shape(tile_degrees)
+    return np.clip(np.floor((np.asarray(lng, dtype=np.float64) + 180) / tile_degrees), 0, n_cols - 1)
+
+
+def tile_keys(lng, lat, tile_degrees=TILE_DEGREES):
+    # row-major tile key of each footprint, footprints without coordinates get a key past the last tile
+    n_rows, n_cols = grid_shape(tile_degrees)
+    rows = tile_rows(lat, tile_degrees)
+    cols = tile_cols(lng, tile_degrees)
+
+    valid = np.isfinite(rows) & np.isfinite(cols)
+    keys = np.full(rows.shape, n_rows * n_cols, dtype=np.int64)
+    keys[valid] = rows[valid].astype(np.int64) * n_cols + cols[valid].astype(np.int64)
+    return keys
+
+
+def index_dir(store, lon_column, lat_column, dirname=INDEX_DIRNAME):
+    return os.path.join(store.directory, dirname, f'{lon_column}+{lat_column}'.replace('/', '__'))
+
+
+def write_index(directory, arrays, meta):
+    # arrays and meta.json written next to directory and renamed into place
+    building_dir = f'{directory}.building'
+    shutil.rmtree(building_dir, ignore_errors=True)
+    os.makedirs(building_dir)
+
+    gedi_store.save_columns(arrays, building_dir)
+    with open(os.path.join(building_dir, gedi_store.META_FILENAME), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(building_dir, directory)
+    return directory
+
+
+def is_current(store, directory, **settings):
+    # index built for this store with these settings
+    try:
+        with open(os.path.join(directory, gedi_store.META_FILENAME)) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return (meta.get('version') == INDEX_VERSION and meta.get('n_footprints') == store.n_footprints
+            and all(meta.get(name) == value for name, value in settings.items()))
+
+
+class SpatialIndex:
+    # tile index of one (longitude, latitude) column pair of a store
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, gedi_store.META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self.tile_degrees = self.meta['tile_degrees']
+        arrays = gedi_store.load_columns(directory, ['order', 'keys', 'starts'])
+        self.order = arrays['order']
+        self.keys = np.asarray(arrays['keys'])
+        self.starts = np.asarray(arrays['starts'])
+
+    def candidates(self, bounds):
+        # sorted indices of the footprints in the tiles overlapping bounds = [W, E, S, N]
+        # a superset of the footprints inside bounds, callers still apply their exact filter
+        west, east, south, north = bounds
+        if not (west <= east and south <= north):
+            return np.empty(0, dtype=np.int64)
+
+        _, n_cols = grid_shape(self.tile_degrees)
+        first_col, last_col = tile_cols([west, east], self.tile_degrees).astype(np.int64)
+        first_row, last_row = tile_rows([south, north], self.tile_degrees).astype(np.int64)
+
+        # each tile row of the box is one contiguous run of keys
+        rows = np.arange(first_row, last_row + 1)
+        lo = self.starts[np.searchsorted(self.keys, rows * n_cols + first_col, side='left')]
+        hi = self.starts[np.searchsorted(self.keys, rows * n_cols + last_col, side='right')]
+
+        runs = [self.order[start:stop] for start, stop in zip(lo, hi) if stop > start]
+        if not runs:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(runs))
+
+
+def build_index(store, lon_column, lat_column, tile_degrees=TILE_DEGREES):
+    keys = tile_keys(store[lon_column], store[lat_column], tile_degrees)
+    order = np.argsort(keys, kind='stable')
+    tile_keys_sorted, first = np.unique(keys[order], return_index=True)
+    starts = np.append(first, len(order)).astype(np.int64)
+
+    meta = {
+        'version': INDEX_VERSION,
+        'lon_column': lon_column,
+        'lat_column': lat_column,
+        'tile_degrees': tile_degrees,
+        'n_footprints': store.n_footprints,
+    }
+    return write_index(index_dir(store, lon_column, lat_column), {'order': order, 'keys': tile_keys_sorted, 'starts': starts}, meta)
+
+
+def open_index(store, lon_column, lat_column, tile_degrees=TILE_DEGREES, verbose=True):
+    # tile index of the store's (lon_column, lat_column), built on first use
+    directory = index_dir(store, lon_column, lat_column)
+
+    if not is_current(store, directory, tile_degrees=tile_degrees):
+        if verbose:
+            print(f'Building spatial index: \t{directory}')
+        build_index(store, lon_column, lat_column, tile_degrees)
+
+    return SpatialIndex(directory)
+
+
+# ====== COORDINATE LOOKUP ======
+
+def coordinate_grid(decimals):
+    # integer steps per degree and number of longitude steps in a latitude row
+    scale = 10 ** decimals
+    return scale, 360 * scale + 1
+
+
+def quantize(degrees, decimals, python_floats=False):
+    # coordinates as integer steps of 10^-decimals degrees, rounded the way the built-in round(degrees, decimals)
+    # rounds the pickle's values: np.round for NumPy scalars, and for Python floats (python_floats) half to even
+    # on the exact binary value. degrees * 10^decimals can round onto or across a half step, so those steps are
+    # rounded again by round()
+    degrees = np.asarray(degrees, dtype=np.float64)
+    scaled = degrees * 10 ** decimals
+    steps = np.rint(scaled)
+    if python_floats:
+        near_half = np.abs(np.abs(scaled - steps) - 0.5) <= 2 * np.spacing(np.abs(scaled))
+        flat = steps.reshape(-1)
+        for k in np.flatnonzero(near_half):
+            flat[k] = np.rint(round(float(degrees.flat[k]), decimals) * 10 ** decimals)
+    return steps
+
+
+def coordinate_keys(lat, lng, decimals=COORDINATE_DECIMALS, python_floats=False):
+    # latitude-major key of the quantized (lat, lng), -1 for shots without coordinates
+    scale, row_width = coordinate_grid(decimals)
+    lat_steps = quantize(lat, decimals, python_floats)
+    lng_steps = quantize(lng, decimals, python_floats)
+
+    valid = np.isfinite(lat_steps) & np.isfinite(lng_steps)
+    keys = np.full(lat_steps.shape, -1, dtype=np.int64)
+    keys[valid] = ((lat_steps[valid].astype(np.int64) + 90 * scale) * row_width
+                   + lng_steps[valid].astype(np.int64) + 180 * scale)
+    return keys
+
+
+class CoordinateIndex:
+    # shot lookup by (lat, lon) of one column pair of a store
+
+    def __init__(self, store, directory):
+        self.store = store
+        self.directory = directory
+        with open(os.path.join(directory, gedi_store.META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self.decimals = self.meta['decimals']
+        self.python_floats = self.meta['python_floats']
+        arrays = gedi_store.load_columns(directory, ['order', 'keys'])
+        self.order = arrays['order']
+        self.keys = arrays['keys']
+
+    def key_ranges(self, lat, lng=None):
+        # [start, stop) into order of each target, a whole latitude row when lng is None
+        scale, row_width = coordinate_grid(self.decimals)
+        lat_steps = quantize(np.atleast_1d(lat), self.decimals, self.python_floats)
+        lng_steps = np.zeros_like(lat_steps) if lng is None else quantize(np.atleast_1d(lng), self.decimals, self.python_floats)
+        valid = np.isfinite(lat_steps) & np.isfinite(lng_steps)
+
+        rows = (np.where(valid, lat_steps, 0).astype(np.int64) + 90 * scale) * row_width
+        if lng is None:
+            first, last = rows, rows + row_width - 1
+        else:
+            first = last = rows + np.where(valid, lng_steps, 0).astype(np.int64) + 180 * scale
+
+        # targets without coordinates match nothing
+        starts = np.searchsorted(self.keys, first, side='left')
+        stops = np.where(valid, np.searchsorted(self.keys, last, side='right'), starts)
+        return starts, stops
+
+    def lookup(self, lat, lng=None):
+        # sorted footprint indices at each target, rounded to decimals
+        # (lat only matches every longitude)
+        starts, stops = self.key_ranges(lat, lng)
+        return [np.sort(self.order[start:stop]) for start, stop in zip(starts, stops)]
+
+    def first(self, lat, lng=None):
+        # lowest footprint index at each target, -1 where there is none
+        starts, stops = self.key_ranges(lat, lng)
+        first = np.full(len(starts), -1, dtype=np.int64)
+        for t in np.flatnonzero(stops > starts):
+            first[t] = self.order[starts[t]:stops[t]].min()
+        return first
+
+    def exact(self, lat, lng):
+        # lowest index of a shot stored at exactly (lat, lng) for each target, -1 where there is none
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lng = np.atleast_1d(np.asarray(lng, dtype=np.float64))
+        starts, stops = self.key_ranges(lat, lng)
+
+        # every entry of every target's key range, then the exact test on the stored coordinates
+        counts = stops - starts
+        targets = np.repeat(np.arange(len(starts)), counts)
+        entries = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        shots = np.asarray(self.order[entries], dtype=np.int64)
+        same = ((self.store[self.meta['lat_column']][shots] == lat[targets])
+                & (self.store[self.meta['lon_column']][shots] == lng[targets]))
+
+        first = np.full(len(starts), np.iinfo(np.int64).max)
+        np.minimum.at(first, targets[same], shots[same])
+        first[first == np.iinfo(np.int64).max] = -1
+        return first
+
+    def within(self, lat, lng, tolerance):
+        # sorted indices of the shots within tolerance degrees of (lat, lng) in both axes
+        scale, row_width = coordinate_grid(self.decimals)
+        first_row, last_row = quantize([lat - tolerance, lat + tolerance], self.decimals, self.python_floats).astype(np.int64)
+        first_col, last_col = quantize([lng - tolerance, lng + tolerance], self.decimals, self.python_floats).astype(np.int64)
+
+        rows = (np.arange(first_row, last_row + 1) + 90 * scale) * row_width
+        starts = np.searchsorted(self.keys, rows + first_col + 180 * scale, side='left')
+        stops = np.searchsorted(self.keys, rows + last_col + 180 * scale, side='right')
+
+        runs = [self.order[start:stop] for start, stop in zip(starts, stops) if stop > start]
+        if not runs:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.sort(np.concatenate(runs))
+
+        # quantized keys only narrow it down, the exact test is on the stored coordinates
+        lats = self.store[self.meta['lat_column']][candidates]
+        lngs = self.store[self.meta['lon_column']][candidates]
+        return candidates[(np.abs(lats - lat) <= tolerance) & (np.abs(lngs - lng) <= tolerance)]
+
+
+def build_coordinate_index(store, lon_column, lat_column, decimals=COORDINATE_DECIMALS):
+    python_floats = store.python_floats(lat_column) and store.python_floats(lon_column)
+    keys = coordinate_keys(store[lat_column], store[lon_column], decimals, python_floats)
+    order = np.argsort(keys, kind='stable')
+
+    meta = {
+        'version': INDEX_VERSION,
+        'lon_column': lon_column,
+        'lat_column': lat_column,
+        'decimals': decimals,
+        'python_floats': python_floats,
+        'n_footprints': store.n_footprints,
+    }
+    directory = index_dir(store, lon_column, lat_column, LOOKUP_DIRNAME)
+    return write_index(directory, {'order': order, 'keys': keys[order]}, meta)
+
+
+def open_coordinate_index(store, lon_column, lat_column, decimals=COORDINATE_DECIMALS, verbose=True):
+    # coordinate lookup of the store's (lon_column, lat_column), built on first use
+    directory = index_dir(store, lon_column, lat_column, LOOKUP_DIRNAME)
+
+    if not is_current(store, directory, decimals=decimals):
+        if verbose:
+            print(f'Building coordinate index: \t{directory}')
+        build_coordinate_index(store, lon_column, lat_column, decimals)
+
+    return CoordinateIndex(store, directory)
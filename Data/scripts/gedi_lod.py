@@ -0,0 +1,113 @@
+import numpy as np
+
+import gedi_binary
+
+# level of detail pyramid of the waveforms written by pkl2CSV.py, all little-endian:
+#
+#   header          HEADER, 32 bytes
+#   offsets         int64 [n_levels, n_footprints + 1], footprint k of level l owns
+#                   samples [offsets[l, k]:offsets[l, k + 1]]
+#   values          float32 [n_samples]   raw_waveform_values of all levels
+#   lengths         int32 [n_samples]     raw_waveform_lengths of all levels
+#   positions       float32 [n_samples]   raw_waveform_positions of all levels
+#
+# level 0 is the clipped waveform of the CSV, level l merges each run of 2^l segments of a
+# footprint into one: lengths add up, the position is the run's first and the value is the
+# length-weighted mean, like a segment of adaptive_downsample. levels are stored one after
+# the other, so a viewer can read just the levels it draws. footprint k is row k of the CSV
+
+MAGIC = b'GEDILOD\0'
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('n_levels', '<u4'),
+    ('n_footprints', '<u8'),
+    ('n_samples', '<u8'),
+])
+
+SAMPLE_COLUMNS = gedi_binary.SAMPLE_COLUMNS
+
+
+def coarsen(values, lengths, positions, offsets, factor):
+    # merges every factor consecutive segments of each footprint, returns (values, lengths, positions, offsets)
+    counts = np.diff(offsets)
+    coarse_offsets = np.zeros(counts.size + 1, dtype=np.int64)
+    coarse_offsets[1:] = np.cumsum((counts + factor - 1) // factor)
+    if values.size == 0:
+        return values, lengths, positions, coarse_offsets
+
+    # first segment of each run, runs restart at every footprint
+    local = np.arange(values.size) - np.repeat(offsets[:-1], counts)
+    starts = np.flatnonzero(local % factor == 0)
+
+    coarse_lengths = np.add.reduceat(lengths, starts)
+    coarse_values = np.add.reduceat(values.astype(np.float64) * lengths, starts) / coarse_lengths
+
+    return coarse_values.astype(values.dtype), coarse_lengths, positions[starts], coarse_offsets
+
+
+def build_pyramid(table, n_levels):
+    # levels 0..n_levels of the table's clipped waveforms, concatenated level after level
+    values = table['raw_waveform_values']
+    lengths = table['raw_waveform_lengths']
+    positions = table['raw_waveform_positions']
+    offsets = np.asarray(table['raw_waveform_offsets'], dtype=np.int64)
+
+    levels = [(values, lengths, positions, offsets)]
+    for level in range(1, n_levels + 1):
+        levels.append(coarsen(values, lengths, positions, offsets, 2 ** level))
+
+    # per level offsets shifted to absolute positions in the concatenated arrays
+    shifts = np.cumsum([0] + [level_offsets[-1] for *_, level_offsets in levels[:-1]])
+    pyramid = {'offsets': np.stack([level_offsets + shift for (*_, level_offsets), shift in zip(levels, shifts)])}
+    for column, name in enumerate(SAMPLE_COLUMNS):
+        pyramid[name] = np.concatenate([level[column] for level in levels])
+    return pyramid
+
+
+def write_lod(pyramid, path):
+    offsets = np.asarray(pyramid['offsets'], dtype='<i8')
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['n_levels'] = offsets.shape[0]
+    header['n_footprints'] = offsets.shape[1] - 1
+    header['n_samples'] = offsets[-1, -1]
+
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(offsets.tobytes())
+        for name, dtype in SAMPLE_COLUMNS.items():
+            f.write(np.asarray(pyramid[name], dtype=dtype).tobytes())
+
+
+def read_lod(path):
+    # returns the pyramid as written by write_lod, with on-disk dtypes
+    with open(path, 'rb') as f:
+        header = np.fromfile(f, dtype=HEADER, count=1)
+        if header.size == 0 or header['magic'][0] != MAGIC.rstrip(b'\0'):
+            raise ValueError(f'{path} is not a GEDI LOD file')
+        if header['version'][0] != VERSION:
+            raise ValueError(f"{path}: unsupported version {header['version'][0]}")
+
+        n_levels = int(header['n_levels'][0])
+        n_footprints = int(header['n_footprints'][0])
+        n_samples = int(header['n_samples'][0])
+
+        pyramid = {'offsets': np.fromfile(f, dtype='<i8', count=n_levels * (n_footprints + 1)).reshape(n_levels, n_footprints + 1)}
+        for name, dtype in SAMPLE_COLUMNS.items():
+            pyramid[name] = np.fromfile(f, dtype=dtype, count=n_samples)
+
+    if pyramid['raw_waveform_positions'].size != n_samples:
+        raise ValueError(f'{path} is truncated')
+
+    return pyramid
+
+
+def footprint_level(pyramid, level, k):
+    # (values, lengths, positions) of footprint k at a level
+    start, stop = pyramid['offsets'][level, k], pyramid['offsets'][level, k + 1]
+    return tuple(pyramid[name][start:stop] for name in SAMPLE_COLUMNS)
@@ -0,0 +1,126 @@
+import numpy as np
+
+# ground surface mesh of the footprints written by pkl2CSV.py, all little-endian:
+#
+#   header          HEADER, 72 bytes
+#   vertices        float32 [n_vertices, 3]     east, elevation, north in meters
+#   uvs             float32 [n_vertices, 2]     texture coords over uv_bounds
+#   triangles       uint32 [n_triangles, 3]     vertex indices, in Unity's winding
+#
+# vertex k is footprint k of the CSV. east/north are meters from (origin_lon, origin_lat),
+# with the same 111000 m per degree flat projection as LatLong2Unity in WaveformVisualizer.cs.
+# footprints left out of the triangulation (no coordinates, duplicates) are unused vertices
+
+MAGIC = b'GEDIMESH'
+VERSION = 1
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('n_vertices', '<u4'),
+    ('n_triangles', '<u8'),
+    ('origin_lon', '<f8'),
+    ('origin_lat', '<f8'),
+    ('uv_bounds', '<f8', 4),
+])
+
+METERS_PER_DEGREE = 111000
+
+
+def local_meters(lon, lat, origin_lon, origin_lat):
+    # (east, north) meters from the origin
+    east = (np.asarray(lon, dtype=np.float64) - origin_lon) * METERS_PER_DEGREE * np.cos(np.radians(origin_lat))
+    north = (np.asarray(lat, dtype=np.float64) - origin_lat) * METERS_PER_DEGREE
+    return east, north
+
+
+def build_mesh(lon, lat, elevation, geo_bounds, max_edge=0):
+    # Delaunay triangulation of the footprints in the horizontal plane, geo_bounds = [W, E, S, N]
+    # is both the origin (its center) and the texture extent
+    # triangles with an edge longer than max_edge meters are dropped, 0 keeps all of them
+    # scipy is only imported by exports that write a mesh
+    from scipy.spatial import Delaunay, QhullError
+
+    west, east_bound, south, north_bound = geo_bounds
+    origin_lon = (west + east_bound) / 2
+    origin_lat = (south + north_bound) / 2
+
+    east, north = local_meters(lon, lat, origin_lon, origin_lat)
+    elevation = np.asarray(elevation, dtype=np.float64)
+
+    mesh = {
+        'origin_lon': origin_lon,
+        'origin_lat': origin_lat,
+        'uv_bounds': np.array(geo_bounds, dtype=np.float64),
+        'vertices': np.column_stack([east, elevation, north]),
+        'uvs': np.column_stack([(np.asarray(lon) - west) / (east_bound - west),
+                                (np.asarray(lat) - south) / (north_bound - south)]),
+        'triangles': np.empty((0, 3), dtype=np.int64),
+    }
+
+    usable = np.flatnonzero(np.isfinite(east) & np.isfinite(north) & np.isfinite(elevation))
+    if usable.size < 3:
+        return mesh
+    try:
+        triangles = usable[Delaunay(np.column_stack([east[usable], north[usable]])).simplices]
+    except QhullError:
+        # all points on a line
+        return mesh
+
+    # counter-clockwise seen from above, like Triangle.NET's output
+    a, b, c = (np.column_stack([east, north])[triangles[:, k]] for k in range(3))
+    cross = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    triangles[cross < 0] = triangles[cross < 0][:, [0, 2, 1]]
+
+    # sliver triangles across gaps between tracks
+    if max_edge:
+        longest = np.max([np.hypot(*(a - b).T), np.hypot(*(b - c).T), np.hypot(*(c - a).T)], axis=0)
+        triangles = triangles[longest <= max_edge]
+
+    # GEDITerrainCreator.generateSolid adds each triangle as (0, 2, 1)
+    mesh['triangles'] = triangles[:, [0, 2, 1]]
+    return mesh
+
+
+def write_mesh(mesh, path):
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['n_vertices'] = len(mesh['vertices'])
+    header['n_triangles'] = len(mesh['triangles'])
+    header['origin_lon'] = mesh['origin_lon']
+    header['origin_lat'] = mesh['origin_lat']
+    header['uv_bounds'] = mesh['uv_bounds']
+
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(np.asarray(mesh['vertices'], dtype='<f4').tobytes())
+        f.write(np.asarray(mesh['uvs'], dtype='<f4').tobytes())
+        f.write(np.asarray(mesh['triangles'], dtype='<u4').tobytes())
+
+
+def read_mesh(path):
+    # returns the mesh as written by write_mesh, with on-disk dtypes
+    with open(path, 'rb') as f:
+        header = np.fromfile(f, dtype=HEADER, count=1)
+        if header.size == 0 or header['magic'][0] != MAGIC:
+            raise ValueError(f'{path} is not a GEDI mesh file')
+        if header['version'][0] != VERSION:
+            raise ValueError(f"{path}: unsupported version {header['version'][0]}")
+
+        n_vertices = int(header['n_vertices'][0])
+        n_triangles = int(header['n_triangles'][0])
+
+        mesh = {
+            'origin_lon': float(header['origin_lon'][0]),
+            'origin_lat': float(header['origin_lat'][0]),
+            'uv_bounds': header['uv_bounds'][0],
+            'vertices': np.fromfile(f, dtype='<f4', count=n_vertices * 3).reshape(n_vertices, 3),
+            'uvs': np.fromfile(f, dtype='<f4', count=n_vertices * 2).reshape(n_vertices, 2),
+            'triangles': np.fromfile(f, dtype='<u4', count=n_triangles * 3).reshape(n_triangles, 3),
+        }
+
+    if mesh['triangles'].size != n_triangles * 3:
+        raise ValueError(f'{path} is truncated')
+
+    return mesh
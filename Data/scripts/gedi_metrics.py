@@ -0,0 +1,181 @@
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# run instrumentation of pkl2CSV.py: wall and CPU time, footprint counts and memory per stage,
+# a progress line printed at most every PROGRESS_INTERVAL seconds, and a JSON run report
+#
+# a stage entered several times (once per chunk) adds up into one record, and the records of
+# worker processes are merged into it. stages can nest, in chunked runs writing the csv pulls
+# the chunks through the conversion stages. memory is the change of the resident set size over
+# the stage and the peak RSS of the process once it is done
+
+REPORT_VERSION = 1
+
+# seconds between two progress lines
+PROGRESS_INTERVAL = 0.5
+
+
+def rss_mb():
+    # current resident set size, None where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def peak_rss_mb():
+    # peak resident set size of this process, None where the resource module is missing
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def cpu_seconds():
+    # user and system time of this process and its finished children
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Stage:
+    # totals of one stage over all the times it ran
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rss_delta_mb = None
+        self.peak_rss_mb = None
+
+    def count(self, items):
+        # footprints (or other items) handled by the current run of the stage
+        self.items += int(items)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'items': self.items,
+            'seconds': round(self.seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'items_per_second': round(self.items / self.seconds, 1) if self.seconds > 0 and self.items else None,
+            'rss_delta_mb': None if self.rss_delta_mb is None else round(self.rss_delta_mb, 1),
+            'peak_rss_mb': None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+        }
+
+
+class RunReport:
+    # stages of one export, in the order they first ran
+
+    def __init__(self):
+        self.stages = {}
+        self.created = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        self.start = time.perf_counter()
+        self.cpu_start = cpu_seconds()
+
+    @contextmanager
+    def stage(self, name, items=0):
+        # times the with block as a run of stage name, yields the Stage to count() items on
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name)
+        rss_before = rss_mb()
+        start, cpu_start = time.perf_counter(), cpu_seconds()
+        try:
+            stage.count(items)
+            yield stage
+        finally:
+            stage.calls += 1
+            stage.seconds += time.perf_counter() - start
+            stage.cpu_seconds += cpu_seconds() - cpu_start
+            rss_after = rss_mb()
+            if rss_before is not None and rss_after is not None:
+                stage.rss_delta_mb = (stage.rss_delta_mb or 0) + rss_after - rss_before
+            stage.peak_rss_mb = peak_rss_mb()
+
+    def merge(self, stages):
+        # adds the stage records of another process, {name: Stage}: their times add up across
+        # processes, so a stage can take more seconds than the whole run
+        for name, other in stages.items():
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = Stage(name)
+            stage.calls += other.calls
+            stage.items += other.items
+            stage.seconds += other.seconds
+            stage.cpu_seconds += other.cpu_seconds
+
+    def to_dict(self, settings=None):
+        peak = peak_rss_mb()
+        return {
+            'version': REPORT_VERSION,
+            'created': self.created,
+            'environment': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'cpu_count': os.cpu_count(),
+            },
+            'settings': settings or {},
+            'seconds': round(time.perf_counter() - self.start, 4),
+            'cpu_seconds': round(cpu_seconds() - self.cpu_start, 4),
+            'peak_rss_mb': None if peak is None else round(peak, 1),
+            'stages': [stage.to_dict() for stage in self.stages.values()],
+        }
+
+    def write(self, path, settings=None):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(settings), f, indent=2)
+
+    def print_stages(self):
+        for stage in self.stages.values():
+            rate = f'{stage.items / stage.seconds:,.0f}/s' if stage.seconds > 0 and stage.items else ''
+            print(f"{f'Stage {stage.name}:':<32}{stage.seconds:8.3f} s  {stage.cpu_seconds:8.3f} s CPU  {rate}")
+
+
+class Progress:
+    # progress line of a long loop, redrawn at most every interval seconds
+
+    def __init__(self, label, total, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.last = None
+
+    def update(self, items):
+        self.done += items
+        now = time.perf_counter()
+        if self.last is None or now - self.last >= self.interval or self.done >= self.total:
+            self.last = now
+            print(f'\r{self.label}: \t{self.done}/{self.total}', end='', flush=True)
+
+    def close(self):
+        if self.last is not None:
+            print()
+
+
+@contextmanager
+def profiled(path):
+    # runs the with block under cProfile and saves its stats to path, for pstats or snakeviz
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,429 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import ElevationValidator
+import gedi_binary
+import gedi_index
+import gedi_store
+import pkl2CSV
+
+# resident query server over the column caches of GEDI pickles (see gedi_store.py), so region
+# exports and lookups don't reload the data every time:
+#   python gedi_server.py ../pkls/MapiaInauini.pkl ../pkls/Bolivia_saltflats.pkl --port 8765
+# HTTP on 127.0.0.1 only, a dataset is named after its pickle (MapiaInauini):
+#   GET  /datasets                          names and footprint counts, JSON
+#   POST /export                            {"dataset", "geo_bounds": [W, E, S, N], ...}
+#   GET  /nearest?dataset=&lon=&lat=        closest footprint, JSON (or converted with &format=)
+#   POST /waveforms                         {"dataset", "shot_numbers": [...], ...}
+# /export and /waveforms take the processing keys of the YAML configs (adaptive_threshold,
+# clip_meters_above_rh98, apply_square_root) and "format": "csv" or "binary", and answer with
+# the footprints converted by pkl2CSV.py in that output format. conversions run in a process
+# pool whose workers keep the stores mapped, answers are kept in an LRU cache keyed by the request
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+# bytes of answers kept by the result cache
+CACHE_BYTES = 512 * 2 ** 20
+
+# largest accepted request body and shot list
+MAX_REQUEST_BYTES = 2 ** 20
+MAX_SHOTS = 100000
+
+SHOT_COLUMN = 'prop/shot_number'
+
+FORMATS = {'csv': 'text/csv', 'binary': 'application/octet-stream'}
+
+# bounds of /waveforms and /nearest conversions, every footprint with coordinates is inside
+ALL_BOUNDS = [-np.inf, np.inf, -np.inf, np.inf]
+
+
+class RequestError(Exception):
+    # request the server can't answer, sent back as {"error": message} with status
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ====== WORKERS ======
+
+_worker_datasets = None
+
+
+def _init_worker(datasets):
+    # datasets: {name: pkl path}, each worker maps the stores once and keeps them for all requests
+    global _worker_datasets
+    _worker_datasets = {name: (pkl_file, gedi_store.open_gedi(pkl_file, verbose=False))
+                        for name, pkl_file in datasets.items()}
+
+
+def pipeline_config(pkl_file, settings, output_dir):
+    # pkl2CSV config dict of a request's settings
+    return {
+        'input': {'pkl_file': pkl_file},
+        'processing': {
+            'adaptive_threshold': settings['adaptive_threshold'],
+            'geo_bounds': settings['geo_bounds'],
+            'clip_meters_above_rh98': settings['clip_meters_above_rh98'],
+            'apply_square_root': settings['apply_square_root'],
+        },
+        'output': {'path': output_dir, 'base_filename': 'response', 'format': settings['format']},
+    }
+
+
+def _convert(dataset, settings, index=None):
+    # (output bytes, footprint count) of a dataset converted with settings: the region of
+    # settings['geo_bounds'], or the store rows index in that order
+    pkl_file, store = _worker_datasets[dataset]
+    with tempfile.TemporaryDirectory() as directory:
+        pkl2CSV.apply_config(pipeline_config(pkl_file, settings, directory + os.sep))
+        if index is None:
+            columns = pkl2CSV.store_columns(store)
+        else:
+            columns = gedi_store.SubsetColumns(store, np.asarray(index, dtype=np.int64), pkl2CSV.INPUT_COLUMNS)
+        table = pkl2CSV.convert_footprints(columns)
+
+        path = os.path.join(directory, 'response')
+        if settings['format'] == 'csv':
+            pkl2CSV.write_csv(pkl2CSV.table_frames(table), path)
+        else:
+            gedi_binary.write_binary(table, path)
+        with open(path, 'rb') as f:
+            return f.read(), len(table['latitude'])
+
+
+# ====== SERVER ======
+
+class ResultCache:
+    # futures of answers by request key, shared by concurrent identical requests
+    # finished answers are evicted least recently used first once they pass max_bytes
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, submit):
+        # (future, hit) of key, submit() starts the computation on a miss
+        with self.lock:
+            future = self.entries.get(key)
+            if future is not None:
+                self.entries.move_to_end(key)
+                return future, True
+            future = self.entries[key] = submit()
+        future.add_done_callback(lambda done: self.finished(key, done))
+        return future, False
+
+    def finished(self, key, future):
+        with self.lock:
+            if self.entries.get(key) is not future:
+                return
+            if future.cancelled() or future.exception() is not None:
+                # failures are not kept, the next request retries
+                del self.entries[key]
+                return
+            self.sizes[key] = len(future.result()[0])
+            total = sum(self.sizes.values())
+            for old_key in list(self.entries):
+                if total <= self.max_bytes or old_key == key:
+                    break
+                if old_key in self.sizes:
+                    total -= self.sizes.pop(old_key)
+                    del self.entries[old_key]
+
+
+class NearestIndex:
+    # the validator's KD-tree (ElevationValidator.PointTree) over a dataset's footprints, matched on the
+    # validator's coordinate columns and with its tie rule, so /nearest answers what ElevationValidator matches
+
+    def __init__(self, store, metric):
+        self.tree = ElevationValidator.PointTree(store[ElevationValidator.LON_COLUMN],
+                                                 store[ElevationValidator.LAT_COLUMN], metric)
+
+    def query(self, lng, lat):
+        # (footprint index, distance) of the closest footprint, distance in degrees or meters
+        nearest, distances = self.tree.nearest([lng], [lat])
+        if nearest[0] < 0:
+            raise RequestError(404, 'the dataset has no footprints with coordinates')
+        return int(nearest[0]), float(distances[0])
+
+
+class ShotIndex:
+    # store rows of shot numbers
+
+    def __init__(self, shot_numbers):
+        shot_numbers = np.asarray(shot_numbers, dtype=np.int64)
+        self.order = np.argsort(shot_numbers, kind='stable')
+        self.sorted = shot_numbers[self.order]
+
+    def lookup(self, shot_numbers):
+        # (rows of the shots found, shots not found)
+        shot_numbers = np.asarray(shot_numbers, dtype=np.int64)
+        position = np.minimum(np.searchsorted(self.sorted, shot_numbers), max(self.sorted.size - 1, 0))
+        found = (self.sorted.size > 0) & (self.sorted[position] == shot_numbers)
+        return self.order[position[found]], shot_numbers[~found]
+
+
+class GEDIService:
+    # the datasets, worker pool, result cache and lookup structures of a running server
+
+    def __init__(self, pkl_files, workers=None, cache_bytes=CACHE_BYTES):
+        self.datasets = {}
+        for pkl_file in pkl_files:
+            name = os.path.splitext(os.path.basename(pkl_file))[0]
+            if name in self.datasets:
+                raise ValueError(f'two datasets named {name}')
+            # converted and indexed here, so workers only ever map finished caches
+            store = gedi_store.open_gedi(pkl_file)
+            gedi_index.open_index(store, pkl2CSV.LONGITUDE_COLUMN, pkl2CSV.LATITUDE_COLUMN)
+            self.datasets[name] = (os.path.abspath(pkl_file), store)
+
+        self.pool = ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker,
+                                        initargs=({name: pkl_file for name, (pkl_file, _) in self.datasets.items()},))
+        self.cache = ResultCache(cache_bytes)
+        self.lookups = {}
+        self.lookups_lock = threading.Lock()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def store(self, name):
+        if name not in self.datasets:
+            raise RequestError(404, f'unknown dataset {name!r}, serving {list(self.datasets)}')
+        return self.datasets[name][1]
+
+    def lookup(self, key, build):
+        # NearestIndex / ShotIndex built on first use and kept
+        with self.lookups_lock:
+            if key not in self.lookups:
+                self.lookups[key] = build()
+            return self.lookups[key]
+
+    def converted(self, key, *args):
+        # (bytes, footprints, cache hit) of a _convert call through the result cache
+        future, hit = self.cache.get(json.dumps(key, sort_keys=True), lambda: self.pool.submit(_convert, *args))
+        data, n_footprints = future.result()
+        return data, n_footprints, hit
+
+    def datasets_info(self):
+        return [{'name': name, 'footprints': store.n_footprints, 'pkl_file': pkl_file}
+                for name, (pkl_file, store) in self.datasets.items()]
+
+    def export(self, request):
+        dataset = request.get('dataset')
+        self.store(dataset)
+        settings = processing_settings(request, request_bounds(request.get('geo_bounds')))
+        return self.converted(['export', dataset, settings], dataset, settings)
+
+    def waveforms(self, request):
+        dataset = request.get('dataset')
+        store = self.store(dataset)
+        shot_numbers = request.get('shot_numbers')
+        if not isinstance(shot_numbers, list) or not 0 < len(shot_numbers) <= MAX_SHOTS:
+            raise RequestError(400, f'shot_numbers must be a list of 1 to {MAX_SHOTS} shot numbers')
+        if not all(is_shot_number(shot) for shot in shot_numbers):
+            raise RequestError(400, 'shot_numbers must be integers or strings of digits')
+        shot_numbers = [int(shot) for shot in shot_numbers]
+        if SHOT_COLUMN not in store:
+            raise RequestError(404, f'dataset {dataset!r} has no {SHOT_COLUMN} column')
+
+        shots = self.lookup(('shots', dataset), lambda: ShotIndex(store[SHOT_COLUMN]))
+        rows, missing = shots.lookup(shot_numbers)
+        if rows.size == 0:
+            raise RequestError(404, f'none of the shot numbers are in dataset {dataset!r}')
+        settings = processing_settings(request, ALL_BOUNDS)
+        rows = rows.tolist()
+        data, n_footprints, hit = self.converted(['waveforms', dataset, settings, rows], dataset, settings, rows)
+        return data, n_footprints, hit, missing.tolist()
+
+    def nearest(self, query):
+        dataset = query.get('dataset')
+        store = self.store(dataset)
+        try:
+            lng, lat = float(query['lon']), float(query['lat'])
+        except (KeyError, ValueError):
+            raise RequestError(400, 'lon and lat are required numbers')
+        metric = query.get('metric', ElevationValidator.MATCH_METRIC)
+        if metric not in ('degrees', 'haversine'):
+            raise RequestError(400, f'unknown metric {metric!r}, expected degrees or haversine')
+
+        index = self.lookup(('nearest', dataset, metric), lambda: NearestIndex(store, metric))
+        k, distance = index.query(lng, lat)
+
+        if query.get('format', 'json') != 'json':
+            settings = processing_settings(query, ALL_BOUNDS)
+            return self.converted(['waveforms', dataset, settings, [k]], dataset, settings, [k])
+
+        footprint = {'dataset': dataset, 'index': k, 'metric': metric, 'distance': distance}
+        if SHOT_COLUMN in store:
+            footprint['shot_number'] = int(store[SHOT_COLUMN][k])
+        for name, column in pkl2CSV.FIELD_COLUMNS.items():
+            footprint[name] = float(store[column][k])
+        return footprint
+
+
+def request_bounds(bounds):
+    if not isinstance(bounds, list) or len(bounds) != 4 or not all(is_number(bound) for bound in bounds):
+        raise RequestError(400, 'geo_bounds must be [W, E, S, N]')
+    return bounds
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_shot_number(value):
+    # shot numbers are past 2^53, so clients may send them as strings. floats (1.5, 1e17) are refused
+    # rather than truncated
+    if isinstance(value, str):
+        if not (value.isascii() and value.isdigit()):
+            return False
+        value = int(value)
+    elif not isinstance(value, int) or isinstance(value, bool):
+        return False
+    return 0 <= value < 2 ** 63
+
+
+def processing_settings(request, geo_bounds):
+    # the processing settings of a request, with the defaults of pkl2CSV.configure
+    # request values from a query string are strings and are parsed here
+    settings = {
+        'geo_bounds': geo_bounds,
+        'adaptive_threshold': request.get('adaptive_threshold', 0),
+        'clip_meters_above_rh98': request.get('clip_meters_above_rh98', 5),
+        'apply_square_root': request.get('apply_square_root', False),
+        'format': request.get('format', 'csv'),
+    }
+    for name in ('adaptive_threshold', 'clip_meters_above_rh98'):
+        if isinstance(settings[name], str):
+            try:
+                settings[name] = float(settings[name])
+            except ValueError:
+                pass
+        if not is_number(settings[name]):
+            raise RequestError(400, f'{name} must be a number')
+    if isinstance(settings['apply_square_root'], str):
+        settings['apply_square_root'] = settings['apply_square_root'].lower() in ('1', 'true', 'yes')
+    if not isinstance(settings['apply_square_root'], bool):
+        raise RequestError(400, 'apply_square_root must be true or false')
+    if settings['format'] not in FORMATS:
+        raise RequestError(400, f"format must be one of {list(FORMATS)}")
+    return settings
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'GEDIServer/1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        self.answer(lambda: self.route_get(url.path, query))
+
+    def do_POST(self):
+        self.answer(lambda: self.route_post(urlparse(self.path).path, self.read_json()))
+
+    def route_get(self, path, query):
+        service = self.server.service
+        if path == '/datasets':
+            return self.json_response(service.datasets_info())
+        if path == '/nearest':
+            result = service.nearest(query)
+            if isinstance(result, dict):
+                return self.json_response(result)
+            data, n_footprints, hit = result
+            return data, FORMATS[query['format']], {'X-GEDI-Footprints': n_footprints, 'X-GEDI-Cache': cache_status(hit)}
+        raise RequestError(404, f'no such endpoint {path}')
+
+    def route_post(self, path, request):
+        service = self.server.service
+        if path == '/export':
+            data, n_footprints, hit = service.export(request)
+            return data, FORMATS[request.get('format', 'csv')], {'X-GEDI-Footprints': n_footprints,
+                                                                 'X-GEDI-Cache': cache_status(hit)}
+        if path == '/waveforms':
+            data, n_footprints, hit, missing = service.waveforms(request)
+            return data, FORMATS[request.get('format', 'csv')], {'X-GEDI-Footprints': n_footprints,
+                                                                 'X-GEDI-Cache': cache_status(hit),
+                                                                 'X-GEDI-Missing-Shots': len(missing)}
+        raise RequestError(404, f'no such endpoint {path}')
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            raise RequestError(413, f'request body over {MAX_REQUEST_BYTES} bytes')
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            raise RequestError(400, f'request body is not JSON: {e}')
+        if not isinstance(request, dict):
+            raise RequestError(400, 'request body must be a JSON object')
+        return request
+
+    @staticmethod
+    def json_response(value):
+        return json.dumps(value).encode(), 'application/json', {}
+
+    def answer(self, respond):
+        try:
+            status = 200
+            data, content_type, headers = respond()
+        except RequestError as e:
+            status = e.status
+            (data, content_type, headers) = self.json_response({'error': str(e)})
+        except Exception as e:
+            status = 500
+            (data, content_type, headers) = self.json_response({'error': f'{type(e).__name__}: {e}'})
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def cache_status(hit):
+    return 'hit' if hit else 'miss'
+
+
+def serve(pkl_files, port=PORT, workers=None, cache_bytes=CACHE_BYTES):
+    service = GEDIService(pkl_files, workers, cache_bytes)
+    server = ThreadingHTTPServer((HOST, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f'Serving: \t\t\t{", ".join(service.datasets)}')
+    print(f'Listening on: \t\t\thttp://{HOST}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve GEDI region exports and lookups on localhost')
+    parser.add_argument('pkl', nargs='+', help='GEDI pickles (or their column caches) to serve')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, help='conversion processes (default: one per CPU)')
+    parser.add_argument('--cache-mb', type=int, default=CACHE_BYTES // 2 ** 20, help='result cache size')
+    args = parser.parse_args()
+
+    serve(args.pkl, args.port, args.workers, args.cache_mb * 2 ** 20)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import shutil
+
+import gedi_store
+
+# on-disk cache of the intermediate results of pkl2CSV.py, for incremental re-exports
+#
+# each stage result is keyed by a hash of the key of the stage it was computed from and the
+# settings the stage reads, so changing a setting only misses the stages downstream of it:
+#   <cache dir>/
+#       <stage>-<key>/
+#           meta.json       stage, key, settings and array names
+#           <name>.npy      one array of the result, memory-mapped when loaded
+# only the KEEP_ENTRIES most recently used results of each stage are kept
+
+STAGE_VERSION = 2
+KEEP_ENTRIES = 4
+
+
+def stage_key(stage, parent, settings):
+    # hex key of a stage result computed from the parent key (or source description) with settings
+    description = {'version': STAGE_VERSION, 'stage': stage, 'parent': parent, 'settings': settings}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class StageCache:
+    # stage results of one cache directory
+
+    def __init__(self, directory, keep=KEEP_ENTRIES, verbose=True):
+        self.directory = directory
+        self.keep = keep
+        self.verbose = verbose
+
+    def entry_dir(self, stage, key):
+        return os.path.join(self.directory, f'{stage}-{key}')
+
+    def load(self, stage, key):
+        # the cached result as a dict of memory-mapped arrays, None if there is none
+        directory = self.entry_dir(stage, key)
+        try:
+            with open(os.path.join(directory, gedi_store.META_FILENAME)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # marks the entry as recently used for pruning
+        os.utime(directory)
+        return gedi_store.load_columns(directory, meta['names'])
+
+    def save(self, stage, key, arrays, settings=None):
+        # result written next to its directory and renamed into place
+        directory = self.entry_dir(stage, key)
+        building_dir = f'{directory}.building'
+        shutil.rmtree(building_dir, ignore_errors=True)
+        os.makedirs(building_dir)
+
+        gedi_store.save_columns(arrays, building_dir)
+        meta = {'stage': stage, 'key': key, 'settings': settings or {}, 'names': list(arrays)}
+        with open(os.path.join(building_dir, gedi_store.META_FILENAME), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(building_dir, directory)
+        self.prune(stage)
+
+    def prune(self, stage):
+        # drops all but the keep most recently used results of a stage
+        prefix = f'{stage}-'
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.startswith(prefix) and not name.endswith('.building')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for directory in entries[self.keep:]:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def get(self, stage, key, compute, settings=None):
+        # cached result of a stage, computed and saved by compute() on a miss
+        result = self.load(stage, key)
+        status = 'cached'
+        if result is None:
+            result = compute()
+            os.makedirs(self.directory, exist_ok=True)
+            self.save(stage, key, result, settings)
+            status = 'computed'
+
+        if self.verbose:
+            print(f"{f'Stage {stage}:':<32}{status}")
+        return result
@@ -0,0 +1,300 @@
+import json
+import os
+import pickle
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+
+# columnar on-disk cache of a GEDI pickle
+#
+# a pickle holds data['prop'] and data['prop_rh'] (one dict per footprint), plus the
+# data['y'] waveforms and data['rh'] percentiles. the cache is a directory of .npy files,
+# one per column, memory-mapped on first use:
+#   'prop/<key>', 'prop_rh/<key>'   scalar fields of the footprint dicts
+#   'y', 'rh'                       (n_footprints, n_samples) matrices
+# meta.json records the source pickle's size and mtime, a changed pickle rebuilds the cache, and
+# which record columns held Python floats (python_floats), as NumPy 2 promotes those differently
+# from NumPy scalars (NEP 50)
+#
+# iter_batches / iter_footprints read a store a batch of footprints at a time, so a stage
+# consuming them only holds batch_size footprints in memory however large the store is
+
+STORE_VERSION = 2
+META_FILENAME = 'meta.json'
+RECORD_GROUPS = ('prop', 'prop_rh')
+MATRIX_COLUMNS = ('y', 'rh')
+
+# rows copied per step when writing the waveform matrices
+CHUNK_ROWS = 65536
+
+# default footprints per batch of iter_batches / iter_footprints
+BATCH_FOOTPRINTS = 8192
+
+
+def column_filename(name):
+    return name.replace('/', '__') + '.npy'
+
+
+def save_columns(columns, directory):
+    # one .npy per column, so other processes can memory-map them
+    for name, array in columns.items():
+        np.save(os.path.join(directory, column_filename(name)), array)
+
+
+def load_columns(directory, names, mmap_mode='r'):
+    return {name: np.load(os.path.join(directory, column_filename(name)), mmap_mode=mmap_mode) for name in names}
+
+
+def default_cache_dir(pkl_path):
+    return f'{pkl_path}.columns'
+
+
+def source_stamp(pkl_path):
+    stat = os.stat(pkl_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class GEDIStore(Mapping):
+    # read-only mapping of column name -> memory-mapped array
+    #
+    # store['prop'] and store['prop_rh'] also give the pickle's per-footprint dicts,
+    # so store['prop'][i]['geolocation/latitude_bin0'] works as it does on the pickle
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILENAME)) as f:
+            self.meta = json.load(f)
+        self._arrays = {}
+        self._group_keys = {}
+
+    def __len__(self):
+        return len(self.meta['columns'])
+
+    def __iter__(self):
+        return iter(self.meta['columns'])
+
+    def __getitem__(self, name):
+        if name in RECORD_GROUPS:
+            return RecordView(self, name)
+        if name not in self.meta['columns']:
+            raise KeyError(name)
+        if name not in self._arrays:
+            self._arrays[name] = load_columns(self.directory, [name])[name]
+        return self._arrays[name]
+
+    @property
+    def n_footprints(self):
+        return self.meta['n_footprints']
+
+    def python_floats(self, name):
+        # whether the pickle held column name as Python floats rather than NumPy scalars
+        return self.meta['columns'][name].get('python_floats', False)
+
+    def group_keys(self, group):
+        if group not in self._group_keys:
+            prefix = f'{group}/'
+            self._group_keys[group] = [name[len(prefix):] for name in self.meta['columns'] if name.startswith(prefix)]
+        return self._group_keys[group]
+
+    def record(self, group, i):
+        # footprint i of data[group], read a field at a time like the pickle's dict
+        return Record(self, group, i)
+
+
+class Record(Mapping):
+    # one footprint dict of data['prop'] / data['prop_rh'], reading only the fields indexed
+
+    def __init__(self, store, group, i):
+        self.store = store
+        self.group = group
+        self.i = i
+
+    def __len__(self):
+        return len(self.store.group_keys(self.group))
+
+    def __iter__(self):
+        return iter(self.store.group_keys(self.group))
+
+    def __getitem__(self, key):
+        name = f'{self.group}/{key}'
+        if name not in self.store.meta['columns']:
+            raise KeyError(key)
+        return self.store[name][self.i]
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class RecordView:
+    # lazy stand-in for the list of footprint dicts in data['prop'] / data['prop_rh']
+
+    def __init__(self, store, group):
+        self.store = store
+        self.group = group
+
+    def __len__(self):
+        return self.store.n_footprints
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.store.record(self.group, i)
+
+
+class RowSubset:
+    # rows index of an array, read only when indexed: subset[a:b] reads rows index[a:b]
+
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        return self.array[self.index[key]]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.array[self.index], dtype=dtype)
+
+
+class SubsetColumns(Mapping):
+    # columns of a store restricted to the footprints at index, as RowSubsets
+
+    def __init__(self, store, index, names):
+        self.store = store
+        self.index = index
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        return RowSubset(self.store[name], self.index)
+
+
+def iter_batches(columns, batch_size=BATCH_FOOTPRINTS, names=None, index=None):
+    # consecutive batches of footprints of columns (a store, SubsetColumns or dict of arrays)
+    # yields (footprints, batch): the footprint indices read and a dict of name -> in-memory rows
+    # names defaults to every column, index restricts the batches to those footprints, in that order
+    names = list(columns) if names is None else list(names)
+    n_footprints = len(columns[names[0]]) if index is None else len(index)
+
+    for start in range(0, n_footprints, batch_size):
+        stop = min(start + batch_size, n_footprints)
+        if index is None:
+            footprints = np.arange(start, stop)
+            rows = slice(start, stop)
+        else:
+            footprints = rows = np.asarray(index[start:stop])
+        yield footprints, {name: np.asarray(columns[name][rows]) for name in names}
+
+
+def iter_footprints(store, batch_size=BATCH_FOOTPRINTS, index=None):
+    # footprints of a store one at a time, as {'prop': {...}, 'prop_rh': {...}, 'y': ..., 'rh': ...}
+    # like the pickle's records, read batch_size footprints at a time
+    for footprints, batch in iter_batches(store, batch_size, index=index):
+        for k in range(len(footprints)):
+            footprint = {group: {} for group in RECORD_GROUPS}
+            for name, column in batch.items():
+                group, _, key = name.partition('/')
+                if key:
+                    footprint[group][key] = column[k]
+                else:
+                    footprint[name] = column[k]
+            yield footprint
+
+
+def python_floats(records, key):
+    # whether key of a list of footprint dicts holds Python floats (np.float64 is a float subclass)
+    return len(records) > 0 and type(records[0][key]) is float
+
+
+def convert_pickle(pkl_path, cache_dir=None):
+    # one-time conversion of a GEDI pickle into a columnar cache directory
+    cache_dir = cache_dir or default_cache_dir(pkl_path)
+    stamp = source_stamp(pkl_path)
+
+    with open(pkl_path, 'rb') as f:
+        data = pickle.load(f)
+
+    # written next to the final directory and renamed, so a crash never leaves a half cache
+    building_dir = f'{cache_dir}.building'
+    shutil.rmtree(building_dir, ignore_errors=True)
+    os.makedirs(building_dir)
+
+    n_footprints = len(data['prop'])
+    columns = {}
+
+    for group in RECORD_GROUPS:
+        records = data[group]
+        keys = records[0].keys() if records else []
+        for key in keys:
+            column = np.asarray([record[key] for record in records])
+            # strings or ragged values stay in the pickle
+            if column.dtype == object:
+                continue
+            name = f'{group}/{key}'
+            np.save(os.path.join(building_dir, column_filename(name)), column)
+            columns[name] = {'dtype': column.dtype.str, 'shape': list(column.shape),
+                             'python_floats': python_floats(records, key)}
+
+    for name in MATRIX_COLUMNS:
+        rows = data[name]
+        n_samples = len(rows[0]) if n_footprints else 0
+        dtype = np.asarray(rows[0]).dtype if n_footprints else np.float64
+        matrix = np.lib.format.open_memmap(os.path.join(building_dir, column_filename(name)), mode='w+',
+                                           dtype=dtype, shape=(n_footprints, n_samples))
+        for start in range(0, n_footprints, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n_footprints)
+            matrix[start:stop] = np.asarray(rows[start:stop])
+        matrix.flush()
+        columns[name] = {'dtype': matrix.dtype.str, 'shape': list(matrix.shape)}
+        del matrix
+
+    meta = {
+        'version': STORE_VERSION,
+        'source': os.path.abspath(pkl_path),
+        'source_stamp': stamp,
+        'n_footprints': n_footprints,
+        'columns': columns,
+    }
+    with open(os.path.join(building_dir, META_FILENAME), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(building_dir, cache_dir)
+    return cache_dir
+
+
+def is_current(pkl_path, cache_dir):
+    try:
+        with open(os.path.join(cache_dir, META_FILENAME)) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return meta.get('version') == STORE_VERSION and meta.get('source_stamp') == source_stamp(pkl_path)
+
+
+def open_gedi(pkl_path, cache_dir=None, verbose=True):
+    # columnar store of a GEDI pickle, converting it first if the cache is missing or stale
+    cache_dir = cache_dir or default_cache_dir(pkl_path)
+
+    # a cache without its pickle is still usable
+    if not os.path.exists(pkl_path) and os.path.exists(os.path.join(cache_dir, META_FILENAME)):
+        return GEDIStore(cache_dir)
+
+    if not is_current(pkl_path, cache_dir):
+        if verbose:
+            print(f'Building column cache: \t\t{cache_dir}')
+        convert_pickle(pkl_path, cache_dir)
+
+    return GEDIStore(cache_dir)
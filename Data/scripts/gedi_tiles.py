@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+import gedi_index
+
+# tiled export of the footprint table written by pkl2CSV.py
+#
+# footprints are split into tile_degrees square tiles on the same global grid as the spatial
+# index (see gedi_index.py), so a tile has the same name and bounds in every region:
+#   <base>_tiles/
+#       manifest.json       tile size, region bounds, and per tile its bounds, count and files
+#       <row>_<col>.csv     footprints of the tile, in the CSV layout (.bin for the binary one)
+#
+# inside a tile footprints follow a Morton (Z-order) curve, so neighbours on the ground are
+# mostly neighbours in the file as well
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+# bits per axis of the Morton code inside a tile
+MORTON_BITS = 16
+
+
+def part_bits(values):
+    # spreads the low 16 bits of each value to the even bits of a uint32
+    values = np.asarray(values, dtype=np.uint32) & 0xFFFF
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    values = (values | (values << 1)) & 0x55555555
+    return values
+
+
+def morton_codes(lng, lat, west, south, tile_degrees):
+    # Z-order code of each footprint within its tile, whose south-west corner is (west, south)
+    scale = (1 << MORTON_BITS) - 1
+    x = np.clip((np.asarray(lng, dtype=np.float64) - west) / tile_degrees, 0, 1) * scale
+    y = np.clip((np.asarray(lat, dtype=np.float64) - south) / tile_degrees, 0, 1) * scale
+    return part_bits(x.astype(np.uint32)) | (part_bits(y.astype(np.uint32)) << 1)
+
+
+def tile_order(lng, lat, tile_degrees):
+    # footprint order grouped by tile, Morton order within each tile
+    # returns (order, rows, cols, starts), tile t is (rows[t], cols[t]) and owns order[starts[t]:starts[t + 1]]
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    keys = gedi_index.tile_keys(lng, lat, tile_degrees)
+    rows = gedi_index.tile_rows(lat, tile_degrees)
+    cols = gedi_index.tile_cols(lng, tile_degrees)
+
+    # footprints without coordinates have no tile
+    valid = np.isfinite(rows) & np.isfinite(cols)
+    codes = np.zeros(len(keys), dtype=np.uint32)
+    codes[valid] = morton_codes(lng[valid], lat[valid], cols[valid] * tile_degrees - 180,
+                                rows[valid] * tile_degrees - 90, tile_degrees)
+
+    order = np.flatnonzero(valid)
+    order = order[np.lexsort((codes[order], keys[order]))]
+
+    _, n_cols = gedi_index.grid_shape(tile_degrees)
+    tile_keys_sorted, first = np.unique(keys[order], return_index=True)
+    starts = np.append(first, len(order)).astype(np.int64)
+    return order, tile_keys_sorted // n_cols, tile_keys_sorted % n_cols, starts
+
+
+def tile_bounds(row, col, tile_degrees):
+    # [W, E, S, N] of a tile, rounded off the float noise of the grid arithmetic
+    west = float(col) * tile_degrees - 180
+    south = float(row) * tile_degrees - 90
+    return [round(bound, 9) for bound in (west, west + tile_degrees, south, south + tile_degrees)]
+
+
+def tile_name(row, col):
+    return f'{row}_{col}'
+
+
+def write_tiles(table, directory, tile_degrees, writers, geo_bounds):
+    # one file per tile and writer, written next to directory and renamed into place
+    # writers: {extension: write(table, path)}, table: output table of pkl2CSV.py
+    order, rows, cols, starts = tile_order(table['longitude'], table['latitude'], tile_degrees)
+
+    building_dir = f'{directory}.building'
+    shutil.rmtree(building_dir, ignore_errors=True)
+    os.makedirs(building_dir)
+
+    tiles = []
+    for row, col, start, stop in zip(rows, cols, starts[:-1], starts[1:]):
+        tile = take_footprints(table, order[start:stop])
+        files = {}
+        for extension, write in writers.items():
+            filename = f'{tile_name(row, col)}.{extension}'
+            path = os.path.join(building_dir, filename)
+            write(tile, path)
+            files[filename] = os.path.getsize(path)
+        tiles.append({
+            'name': tile_name(row, col),
+            'row': int(row),
+            'col': int(col),
+            'bounds': tile_bounds(row, col, tile_degrees),
+            'count': int(stop - start),
+            'files': files,
+        })
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'tile_degrees': tile_degrees,
+        'geo_bounds': list(geo_bounds),
+        'count': int(len(order)),
+        'tiles': tiles,
+    }
+    with open(os.path.join(building_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(building_dir, directory)
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILENAME)) as f:
+        return json.load(f)
+
+
+def tiles_in(manifest, bounds):
+    # manifest entries of the tiles overlapping bounds = [W, E, S, N]
+    west, east, south, north = bounds
+    return [tile for tile in manifest['tiles']
+            if tile['bounds'][0] <= east and tile['bounds'][1] >= west
+            and tile['bounds'][2] <= north and tile['bounds'][3] >= south]
+
+
+def take_footprints(table, index):
+    # rows index of a footprint table, waveform samples and offsets included
+    offsets = np.asarray(table['raw_waveform_offsets'], dtype=np.int64)
+    counts = offsets[1:][index] - offsets[:-1][index]
+    taken_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    taken_offsets[1:] = np.cumsum(counts)
+
+    samples = np.repeat(offsets[:-1][index] - taken_offsets[:-1], counts) + np.arange(taken_offsets[-1])
+
+    taken = {}
+    for name, column in table.items():
+        if name == 'raw_waveform_offsets':
+            taken[name] = taken_offsets
+        elif name.startswith('raw_waveform_'):
+            taken[name] = column[samples]
+        else:
+            taken[name] = column[index]
+    return taken
@@ -1,65 +1,193 @@
 import pickle
-import pandas as pd
 import numpy as np
 import sys
+import argparse
+import tempfile
 import warnings
 import random
 import yaml
 import os
+import gedi_binary
+import gedi_codec
+import gedi_csv
+import gedi_lod
+import gedi_mesh
+import gedi_metrics
+import gedi_stages
+import gedi_store
+import gedi_tiles
+import gedi_index
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-CONFIG_FILE_PATH = './yamls/mapia_partial.yaml'
+# config read when none is given on the command line
+DEFAULT_CONFIG_FILE = './yamls/mapia_partial.yaml'
 
 # ====== START YAML STUFF ======
 
-try:
-    with open(CONFIG_FILE_PATH, 'r') as f:
-        config = yaml.safe_load(f)
-except FileNotFoundError:
-    print(f"Error: Configuration file not found at {CONFIG_FILE_PATH}")
-    sys.exit(1)
-except yaml.YAMLError as e:
-    print(f"Error parsing configuration file {CONFIG_FILE_PATH}: {e}")
-    sys.exit(1)
-
-# prints PKL data and stops program
-DEBUG_MODE = config.get('debug_mode', False)
-
-# input config
-input_config = config.get('input', {})
-PKL_FILE = input_config.get('pkl_file')
-if not PKL_FILE:
-    print("PKL file error")
-    sys.exit(1)
-
-# processing config
-proc_config = config.get('processing', {})
-ADAPTIVE_THRESHOLD = proc_config.get('adaptive_threshold', 0)
-GEO_BOUNDS = proc_config.get('geo_bounds')
-if not GEO_BOUNDS or len(GEO_BOUNDS) != 4:
-     print("Geo bounds error")
-     sys.exit(1)
-CLIP_METERS_ABOVE_RH98 = proc_config.get('clip_meters_above_rh98', 5)
-APPLY_SQUARE_ROOT = proc_config.get('apply_square_root', False)
-
-# output config
-output_config = config.get('output', {})
-OUTPUT_PATH = output_config.get('path')
-BASE_FILENAME = output_config.get('base_filename')
-if not OUTPUT_PATH or not BASE_FILENAME:
-    print("Output error")
-    sys.exit(1)
-
-# output filename
-OUTPUT_FILENAME = f'{BASE_FILENAME}.csv'
-FULL_OUTPUT_PATH = os.path.join(OUTPUT_PATH, OUTPUT_FILENAME)
+# settings of the loaded config, nothing is read until configure() is called. the values here
+# are the defaults of the optional keys, functions defaulting to a setting read it when called
+CONFIG_FILE_PATH = None
+CONFIG = None
+DEBUG_MODE = False
+PKL_FILE = None
+USE_CACHE = True
+CACHE_DIR = None
+ADAPTIVE_THRESHOLD = 0
+GEO_BOUNDS = None
+CLIP_METERS_ABOVE_RH98 = 5
+APPLY_SQUARE_ROOT = False
+INCREMENTAL = False
+STAGE_CACHE_DIR = None
+OUTPUT_PATH = None
+BASE_FILENAME = None
+OUTPUT_FORMAT = 'csv'
+MESH_OUTPUT = False
+MESH_MAX_EDGE = 0
+LOD_LEVELS = 0
+TILE_DEGREES = 0
+CSV_COMPRESSION = None
+CHUNK_FOOTPRINTS = 0
+CODEC_BITS = 0
+REPORT_OUTPUT = False
+PROFILE_OUTPUT = False
+
+def configure(config_file_path):
+    # reads a YAML config into the module settings below, so one process can run several configs
+    global CONFIG_FILE_PATH
+    try:
+        with open(config_file_path, 'r') as f:
+            config = yaml.safe_load(f)
+    except FileNotFoundError:
+        print(f"Error: Configuration file not found at {config_file_path}")
+        sys.exit(1)
+    except yaml.YAMLError as e:
+        print(f"Error parsing configuration file {config_file_path}: {e}")
+        sys.exit(1)
+
+    apply_config(config)
+    CONFIG_FILE_PATH = config_file_path
+
+
+def apply_config(config):
+    # sets the module settings from a config dict laid out like the YAML files
+    global CONFIG_FILE_PATH, CONFIG
+    global DEBUG_MODE, PKL_FILE, USE_CACHE, CACHE_DIR, ADAPTIVE_THRESHOLD, GEO_BOUNDS, \
+        CLIP_METERS_ABOVE_RH98, APPLY_SQUARE_ROOT, INCREMENTAL, STAGE_CACHE_DIR, OUTPUT_PATH, \
+        BASE_FILENAME, OUTPUT_FORMAT, MESH_OUTPUT, MESH_MAX_EDGE, LOD_LEVELS, TILE_DEGREES, \
+        CSV_COMPRESSION, CHUNK_FOOTPRINTS, CODEC_BITS, REPORT_OUTPUT, PROFILE_OUTPUT, OUTPUT_FILENAME, \
+        BINARY_FILENAME, CODEC_FILENAME, MESH_FILENAME, LOD_FILENAME, TILES_DIRNAME, REPORT_FILENAME, PROFILE_FILENAME, \
+        FULL_OUTPUT_PATH
+    CONFIG_FILE_PATH = None
+    CONFIG = config
+
+    # prints PKL data and stops program
+    DEBUG_MODE = config.get('debug_mode', False)
+
+    # input config
+    input_config = config.get('input', {})
+    PKL_FILE = input_config.get('pkl_file')
+    if not PKL_FILE:
+        print("PKL file error")
+        sys.exit(1)
+    # read through the memory-mapped column cache (see gedi_store.py), default <pkl_file>.columns
+    USE_CACHE = input_config.get('use_cache', True)
+    CACHE_DIR = input_config.get('cache_dir')
+
+    # processing config
+    proc_config = config.get('processing', {})
+    ADAPTIVE_THRESHOLD = proc_config.get('adaptive_threshold', 0)
+    GEO_BOUNDS = proc_config.get('geo_bounds')
+    if not GEO_BOUNDS or len(GEO_BOUNDS) != 4:
+         print("Geo bounds error")
+         sys.exit(1)
+    CLIP_METERS_ABOVE_RH98 = proc_config.get('clip_meters_above_rh98', 5)
+    APPLY_SQUARE_ROOT = proc_config.get('apply_square_root', False)
+    # reuse the filtered, downsampled, normalized and clipped results of earlier runs (see gedi_stages.py),
+    # so a settings change only reruns the stages after it. default cache <output path>/.stages
+    INCREMENTAL = proc_config.get('incremental', False)
+    STAGE_CACHE_DIR = proc_config.get('stage_cache_dir')
+
+    # output config
+    output_config = config.get('output', {})
+    OUTPUT_PATH = output_config.get('path')
+    BASE_FILENAME = output_config.get('base_filename')
+    if not OUTPUT_PATH or not BASE_FILENAME:
+        print("Output error")
+        sys.exit(1)
+
+    # csv, binary (see gedi_binary.py) or both
+    OUTPUT_FORMAT = output_config.get('format', 'csv')
+    if OUTPUT_FORMAT not in ('csv', 'binary', 'both'):
+        print("Output format error")
+        sys.exit(1)
+
+    # Delaunay ground mesh of the footprints (see gedi_mesh.py), triangles with an edge longer
+    # than mesh_max_edge meters are dropped (0 keeps all)
+    MESH_OUTPUT = output_config.get('mesh', False)
+    MESH_MAX_EDGE = output_config.get('mesh_max_edge', 0)
+
+    # waveform level of detail pyramid (see gedi_lod.py), each level halves the segments of the
+    # previous one (0 writes no pyramid)
+    LOD_LEVELS = output_config.get('lod_levels', 0)
+
+    # tiled export (see gedi_tiles.py), one file per tile_degrees square tile in the output format
+    # plus a manifest, for viewers streaming in the tiles near the camera (0 writes no tiles)
+    TILE_DEGREES = output_config.get('tile_degrees', 0)
+
+    # csv compression (see gedi_csv.py): None, gzip or zstd
+    CSV_COMPRESSION = output_config.get('compression')
+    if CSV_COMPRESSION not in gedi_csv.SUFFIXES:
+        print("Output compression error")
+        sys.exit(1)
+
+    # lossy waveform file (see gedi_codec.py), raw and RH waveforms quantized to codec_bits per
+    # footprint, for shipping to the headset (0 writes none)
+    CODEC_BITS = output_config.get('codec_bits', 0)
+    if CODEC_BITS and not 1 <= CODEC_BITS <= 16:
+        print("Codec bits error")
+        sys.exit(1)
+
+    # convert and write the csv chunk_footprints footprints at a time, so memory stays flat however
+    # large the region is (0 converts the whole region at once). the binary, codec, mesh, lod
+    # and tile outputs and the stage cache need the whole region, so they can't be combined with it
+    CHUNK_FOOTPRINTS = output_config.get('chunk_footprints', 0)
+    if CHUNK_FOOTPRINTS and (OUTPUT_FORMAT != 'csv' or MESH_OUTPUT or LOD_LEVELS or TILE_DEGREES or CODEC_BITS
+                             or INCREMENTAL):
+        print("Chunked output error")
+        sys.exit(1)
+
+    # per stage time, CPU time, footprint counts and memory of the run as JSON (see gedi_metrics.py)
+    REPORT_OUTPUT = output_config.get('report', False)
+    # cProfile stats of the run, for python -m pstats or snakeviz
+    PROFILE_OUTPUT = output_config.get('profile', False)
+
+    # output filename
+    OUTPUT_FILENAME = f'{BASE_FILENAME}.csv{gedi_csv.SUFFIXES[CSV_COMPRESSION]}'
+    BINARY_FILENAME = f'{BASE_FILENAME}.bin'
+    CODEC_FILENAME = f'{BASE_FILENAME}.wfc'
+    MESH_FILENAME = f'{BASE_FILENAME}.mesh'
+    LOD_FILENAME = f'{BASE_FILENAME}.lod'
+    TILES_DIRNAME = f'{BASE_FILENAME}_tiles'
+    REPORT_FILENAME = f'{BASE_FILENAME}.report.json'
+    PROFILE_FILENAME = f'{BASE_FILENAME}.prof'
+    FULL_OUTPUT_PATH = os.path.join(OUTPUT_PATH, OUTPUT_FILENAME)
+
+
+# stage records of the current export, see gedi_metrics.py
+RUN_REPORT = gedi_metrics.RunReport()
 
 
 # ====== END YAML STUFF ======
 
-def adaptive_downsample(waveform, similarity_threshold=ADAPTIVE_THRESHOLD, min_segment_length=3):
+def adaptive_downsample(waveform, similarity_threshold=None, min_segment_length=3):
     # returns tuple of (downsampled_values, segment_lengths, physical_positions)
+    # similarity_threshold defaults to the configured ADAPTIVE_THRESHOLD
+    if similarity_threshold is None:
+        similarity_threshold = ADAPTIVE_THRESHOLD
     downsampled = []
     segment_lengths = []
     physical_positions = []
@@ -101,8 +229,255 @@ def adaptive_downsample(waveform, similarity_threshold=ADAPTIVE_THRESHOLD, min_s
     return np.array(downsampled), np.array(segment_lengths), np.array(physical_positions)
 
 
-with open(PKL_FILE, 'rb') as f:
-    data = pickle.load(f)
+def adaptive_downsample_batch(waveforms, similarity_threshold=None, min_segment_length=3):
+    # batched adaptive_downsample over an (n_footprints, n_samples) waveform matrix
+    # returns flat (downsampled_values, segment_lengths, physical_positions) and offsets,
+    # footprint k owns [offsets[k]:offsets[k+1]] of each flat array
+    if similarity_threshold is None:
+        similarity_threshold = ADAPTIVE_THRESHOLD
+    waveforms = np.asarray(waveforms)
+    n_rows = len(waveforms)
+
+    if waveforms.size == 0:
+        dtype = waveforms.dtype if np.issubdtype(waveforms.dtype, np.floating) else np.float64
+        offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        return np.array([], dtype=dtype), np.array([], dtype=np.int64), np.array([]), offsets
+
+    n_samples = waveforms.shape[1]
+
+    # segments are anchored at their first sample, so runs of abs(diff) <= threshold
+    # only reproduce adaptive_downsample when the threshold is 0 (exact repeats)
+    if similarity_threshold <= 0:
+        rows, starts, lengths = _repeat_segments(waveforms, similarity_threshold, min_segment_length)
+    else:
+        rows, starts, lengths = _anchored_segments(waveforms, similarity_threshold, min_segment_length)
+
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(rows, minlength=n_rows))
+
+    values = _segment_means(waveforms, rows, starts, lengths)
+
+    # starts equal the accumulated sample count of the scalar version
+    physical_positions = starts / n_samples
+
+    return values, lengths, physical_positions, offsets
+
+
+def _repeat_segments(waveforms, similarity_threshold, min_segment_length):
+    # threshold <= 0: a segment is a run of samples matching their neighbour
+    n_rows, n_samples = waveforms.shape
+
+    new_run = np.ones((n_rows, n_samples), dtype=bool)
+    new_run[:, 1:] = ~(np.abs(waveforms[:, 1:] - waveforms[:, :-1]) <= similarity_threshold)
+
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, waveforms.size))
+
+    # long runs become one segment, short runs fall back to single samples
+    sample_run_length = np.repeat(run_lengths, run_lengths)
+    segment_start = new_run.ravel() | (sample_run_length < min_segment_length)
+
+    flat_starts = np.flatnonzero(segment_start)
+    lengths = np.diff(np.append(flat_starts, waveforms.size))
+    rows, starts = np.divmod(flat_starts, n_samples)
+
+    return rows, starts, lengths
+
+
+def _anchored_segments(waveforms, similarity_threshold, min_segment_length):
+    # threshold > 0: walk all footprints in lockstep, one sample comparison per pass
+    n_rows, n_samples = waveforms.shape
+
+    start = np.zeros(n_rows, dtype=np.int64)
+    scan = np.ones(n_rows, dtype=np.int64)
+    active = np.arange(n_rows)
+
+    out_rows = []
+    out_starts = []
+    out_lengths = []
+
+    while active.size:
+        current_start = start[active]
+        current_scan = scan[active]
+
+        anchor = waveforms[active, current_start]
+        sample = waveforms[active, np.minimum(current_scan, n_samples - 1)]
+        extend = (current_scan < n_samples) & (np.abs(sample - anchor) <= similarity_threshold)
+        scan[active[extend]] += 1
+
+        # close the segment, or emit a single sample and restart right after it
+        close = ~extend
+        closed_rows = active[close]
+        closed_starts = current_start[close]
+        segment_length = current_scan[close] - closed_starts
+        segment_length = np.where(segment_length >= min_segment_length, segment_length, 1)
+
+        out_rows.append(closed_rows)
+        out_starts.append(closed_starts)
+        out_lengths.append(segment_length)
+
+        next_start = closed_starts + segment_length
+        start[closed_rows] = next_start
+        scan[closed_rows] = next_start + 1
+
+        keep = extend.copy()
+        keep[close] = next_start < n_samples
+        active = active[keep]
+
+    rows = np.concatenate(out_rows)
+    starts = np.concatenate(out_starts)
+    lengths = np.concatenate(out_lengths)
+
+    # segments of a footprint are emitted in order, so a stable sort groups them
+    order = np.argsort(rows, kind='stable')
+    return rows[order], starts[order], lengths[order]
+
+
+def _segment_means(waveforms, rows, starts, lengths):
+    # np.mean per segment, computed for all segments of equal length at once
+    dtype = waveforms.dtype if np.issubdtype(waveforms.dtype, np.floating) else np.float64
+    values = np.empty(rows.size, dtype=dtype)
+
+    # the mean of a single sample is the sample itself
+    single = lengths == 1
+    values[single] = waveforms[rows[single], starts[single]]
+
+    for length in np.unique(lengths[~single]):
+        selected = np.flatnonzero(lengths == length)
+        columns = starts[selected, None] + np.arange(length)
+        values[selected] = waveforms[rows[selected, None], columns].mean(axis=1)
+
+    return values
+
+
+# output columns copied from the pickle, named '<prop or prop_rh>/<key>'
+FIELD_COLUMNS = {
+    'latitude': 'prop/geolocation/latitude_bin0',
+    'longitude': 'prop/geolocation/longitude_bin0',
+    'elevation': 'prop_rh/geolocation/digital_elevation_model',
+    'instrument_lat': 'prop_rh/geolocation/latitude_instrument',
+    'instrument_lon': 'prop_rh/geolocation/longitude_instrument',
+    'instrument_alt': 'prop_rh/geolocation/altitude_instrument',
+    'lowest_lat': 'prop_rh/lat_lowestmode',
+    'lowest_lon': 'prop_rh/lon_lowestmode',
+    'lowest_elev': 'prop_rh/elev_lowestmode',
+    'wgs84_elevation': 'prop_rh/geolocation/digital_elevation_model',
+}
+ELEVATION_BIN0_COLUMN = 'prop/geolocation/elevation_bin0'
+
+# latitude = prop_rh['lat_lowestmode']
+# longitude = prop_rh['lon_lowestmode']
+LATITUDE_COLUMN = FIELD_COLUMNS['latitude']
+LONGITUDE_COLUMN = FIELD_COLUMNS['longitude']
+
+# footprints per DataFrame when writing the CSV of a whole table
+CSV_CHUNK_ROWS = 4096
+
+# every column convert_footprints reads
+INPUT_COLUMNS = list(dict.fromkeys([*FIELD_COLUMNS.values(), ELEVATION_BIN0_COLUMN, 'y', 'rh']))
+
+# whether Python floats added to a NumPy float32 stay float32, true from NumPy 2 on (NEP 50)
+WEAK_PYTHON_FLOATS = (np.float32(1) + 1.0).dtype == np.float32
+
+# whether the input pickle held its elevations as Python floats, set by pickle_columns and
+# store_columns (see clip_elevations)
+PYTHON_FLOAT_ELEVATIONS = False
+
+
+def dict_column(records, key, index=None):
+    # one key of a list of footprint dicts as a numpy array
+    if index is None:
+        return np.asarray([record[key] for record in records])
+    return np.asarray([records[i][key] for i in index])
+
+
+def footprint_matrix(arrays, index):
+    # selected per-footprint arrays (y, rh) stacked into an (n_footprints, n_samples) matrix
+    if isinstance(arrays, np.ndarray):
+        return arrays[index]
+    if len(index) == 0:
+        return np.empty((0, len(arrays[0]) if len(arrays) else 0))
+    return np.stack([arrays[i] for i in index])
+
+
+def footprint_sums(values, offsets):
+    # np.sum of each footprint's slice, computed for all footprints of equal length at once
+    counts = np.diff(offsets)
+    sums = np.zeros(counts.size, dtype=values.dtype)
+
+    for count in np.unique(counts[counts > 0]):
+        selected = np.flatnonzero(counts == count)
+        sums[selected] = values[offsets[selected, None] + np.arange(count)].sum(axis=1)
+
+    return sums
+
+
+def normalize_waveforms(values, offsets, apply_square_root=None):
+    # non negative, optional square root (default the configured APPLY_SQUARE_ROOT), then each
+    # footprint normalized to sum to 1
+    if apply_square_root is None:
+        apply_square_root = APPLY_SQUARE_ROOT
+    values = np.maximum(0, values)
+
+    if apply_square_root:
+        values = np.sqrt(values + 1e-6)
+
+    sums = footprint_sums(values, offsets)
+    return values / np.repeat(sums, np.diff(offsets))
+
+
+def normalize_rh(rh):
+    # rh waveforms scaled to sum to 30, rows without energy are left as is
+    rh_sums = rh.sum(axis=1)
+    positive = rh_sums > 0
+
+    normalized = rh.copy()
+    normalized[positive] = rh[positive] / rh_sums[positive, None] * 30
+    return normalized
+
+
+def clip_waveforms(values, lengths, positions, offsets, elevation_bin0, elevation, rh98,
+                   clip_meters_above_rh98=None, clip_elevation=None):
+    # drops samples higher than rh98 + clip_meters_above_rh98 (default the configured CLIP_METERS_ABOVE_RH98)
+    # above the ground, for all footprints at once
+    # clip_elevation: elevation in the dtype the threshold is computed in (see clip_elevations), default elevation
+    # returns the clipped (values, lengths, positions, offsets)
+    if clip_meters_above_rh98 is None:
+        clip_meters_above_rh98 = CLIP_METERS_ABOVE_RH98
+    if clip_elevation is None:
+        clip_elevation = elevation
+    counts = np.diff(offsets)
+
+    clip_height_above_ground = rh98 + clip_meters_above_rh98
+    clip_elevation_threshold = clip_elevation + clip_height_above_ground
+
+    # max(0.01, x) including its NaN handling
+    vertical_extent = elevation_bin0 - elevation
+    waveform_vertical_range = np.where(vertical_extent > 0.01, vertical_extent, 0.01)
+
+    sample_elevation = np.repeat(elevation_bin0, counts) - (positions * np.repeat(waveform_vertical_range, counts))
+    keep = sample_elevation <= np.repeat(clip_elevation_threshold, counts)
+
+    footprint = np.repeat(np.arange(counts.size), counts)
+    clipped_offsets = np.zeros(counts.size + 1, dtype=np.int64)
+    clipped_offsets[1:] = np.cumsum(np.bincount(footprint[keep], minlength=counts.size))
+
+    return values[keep], lengths[keep], positions[keep], clipped_offsets
+
+
+def clip_elevations(elevation, rh98, python_floats):
+    # elevations in the dtype the per-footprint version added them to its rh98 + clip scalar in:
+    # NumPy 2 adds Python floats in the dtype of the rh (NEP 50), so pickles of Python floats got
+    # a float32 threshold. NumPy scalars, and everything under NumPy 1.x, promote like arrays do
+    if python_floats and WEAK_PYTHON_FLOATS and np.issubdtype(rh98.dtype, np.floating):
+        return elevation.astype(rh98.dtype)
+    return elevation
+
+
+def join_footprints(values, offsets):
+    # comma-joined string of each footprint's slice
+    return [','.join(map(str, values[offsets[k]:offsets[k + 1]])) for k in range(len(offsets) - 1)]
+
 
 def area_filter(lng, lat):
     # random_number = random.randint(0, 10)
@@ -117,146 +492,496 @@ def area_filter(lng, lat):
     # return (lng>-69) & (lng<-68.5) & (lat>-9) & (lat<-8.5)  # mapia small
     # bounds = (lng>-67.8) & (lng<-67.3) & (lat>-20.5) & (lat<-19.9)  # bolivia small
     # bounds = (lng>-67.8) & (lng<-67.7) & (lat>-20.5) & (lat<-20.4)  # bolivia smaller
-    bounds = (lng > GEO_BOUNDS[0]) & (lng < GEO_BOUNDS[1]) & (lat > GEO_BOUNDS[2]) & (lat < GEO_BOUNDS[3])
+    bounds = in_bounds(lng, lat, GEO_BOUNDS)
     return bounds
 
 
-data_list = []
+def in_bounds(lng, lat, geo_bounds):
+    # strictly inside [W, E, S, N]
+    return (lng > geo_bounds[0]) & (lng < geo_bounds[1]) & (lat > geo_bounds[2]) & (lat < geo_bounds[3])
 
-# Print data keys in debug mode
-if DEBUG_MODE:
-    print(f'keys: {data.keys()}\n')
-    print(f"prop: {data['prop'][0]}\n")
-    print(f"prop_rh: {data['prop_rh'][0]}\n")
-    print(f"rh: {data['rh'][0]}\n")
-    sys.exit()
 
-# Print stats
-if ADAPTIVE_THRESHOLD == 0:
-    print(f'Adaptive sampling threshold: \t{ADAPTIVE_THRESHOLD} (off)')
-else:
-    print(f'Adaptive sampling threshold: \t{ADAPTIVE_THRESHOLD}')
-print(f'Meters clipped above RH98: \t{CLIP_METERS_ABOVE_RH98}m')
+def pickle_columns(data, regions=None):
+    # columns of the footprints inside GEO_BOUNDS, or inside any of a list of [W, E, S, N] regions,
+    # pulled out of the pickle dicts once
+    global PYTHON_FLOAT_ELEVATIONS
+    group, key = FIELD_COLUMNS['elevation'].split('/', 1)
+    PYTHON_FLOAT_ELEVATIONS = gedi_store.python_floats(data[group], key)
 
-count = 0
+    latitude = dict_column(data['prop'], 'geolocation/latitude_bin0')
+    longitude = dict_column(data['prop'], 'geolocation/longitude_bin0')
+    if regions is None:
+        in_area = np.flatnonzero(area_filter(longitude, latitude))
+    else:
+        in_area = np.flatnonzero(np.any([in_bounds(longitude, latitude, bounds) for bounds in regions], axis=0))
 
-for i in range(len(data['prop'])):
-    # print waveform count
-    count += 1
-    print(f'\rWaveforms processed: \t\t{count}', end='')
+    columns = {}
+    for name in INPUT_COLUMNS:
+        if name in ('y', 'rh'):
+            columns[name] = footprint_matrix(data[name], in_area)
+        else:
+            group, key = name.split('/', 1)
+            columns[name] = dict_column(data[group], key, in_area)
+    return columns
+
+
+def store_columns(store):
+    # columns of the footprints in the index tiles overlapping GEO_BOUNDS, read from the column cache
+    # (a superset of the footprints inside GEO_BOUNDS, convert_footprints does the exact filtering)
+    # rows are read lazily, by each converted range of footprints
+    global PYTHON_FLOAT_ELEVATIONS
+    PYTHON_FLOAT_ELEVATIONS = store.python_floats(FIELD_COLUMNS['elevation'])
+    candidates = gedi_index.open_index(store, LONGITUDE_COLUMN, LATITUDE_COLUMN).candidates(GEO_BOUNDS)
+    return gedi_store.SubsetColumns(store, candidates, INPUT_COLUMNS)
+
+
+def filter_footprints(columns, start=0, stop=None):
+    # footprints [start, stop) of the columns that are inside GEO_BOUNDS
+    # returns their output fields plus the clip_elevation, elevation_bin0 and y the later stages read
+    latitude = columns[LATITUDE_COLUMN][start:stop]
+    longitude = columns[LONGITUDE_COLUMN][start:stop]
+    in_area = start + np.flatnonzero(area_filter(longitude, latitude))
+
+    out = {name: np.asarray(columns[column][in_area]) for name, column in FIELD_COLUMNS.items()}
+
+    rh = np.asarray(columns['rh'][in_area])
+    out['rh2'] = rh[:, 2]
+    out['rh50'] = rh[:, 50]
+    out['rh98'] = rh[:, 98]
+    # CHECK
+    out['rh_waveform'] = normalize_rh(rh)
 
-    entry = data['prop'][i]
-    prop_rh = data['prop_rh'][i]
-    
-    latitude = entry['geolocation/latitude_bin0']
-    longitude = entry['geolocation/longitude_bin0']
+    out['clip_elevation'] = clip_elevations(out['elevation'], out['rh98'], PYTHON_FLOAT_ELEVATIONS)
+    out['elevation_bin0'] = np.asarray(columns[ELEVATION_BIN0_COLUMN][in_area])
+    out['y'] = np.asarray(columns['y'][in_area])
+    return out
 
-    # latitude = prop_rh['lat_lowestmode']
-    # longitude = prop_rh['lon_lowestmode']
 
+def downsample_footprints(filtered):
+    # Adaptive downsampling of raw waveform
+    values, lengths, positions, offsets = adaptive_downsample_batch(filtered['y'], ADAPTIVE_THRESHOLD)
+    return {'values': values, 'lengths': lengths, 'positions': positions, 'offsets': offsets}
 
-    # elevation = entry['geolocation/elevation_bin0']
-    # elevation = entry['elev_lowestmode']
 
-    elevation = prop_rh['geolocation/digital_elevation_model']
-    elevation_bin0 = entry['geolocation/elevation_bin0']
+def normalize_footprints(segments):
+    # apply square root then normalize
+    return {'values': normalize_waveforms(segments['values'], segments['offsets'], APPLY_SQUARE_ROOT)}
 
-    if not area_filter(longitude, latitude):
-        continue
 
-    # Get instrument and lowestmode coordinates
-    instrument_lat = prop_rh['geolocation/latitude_instrument']
-    instrument_lon = prop_rh['geolocation/longitude_instrument']
-    instrument_alt = prop_rh['geolocation/altitude_instrument']
-    
-    lowest_lat = prop_rh['lat_lowestmode']
-    lowest_lon = prop_rh['lon_lowestmode']
-    lowest_elev = prop_rh['elev_lowestmode']
+def clip_footprints(filtered, segments, normalized):
+    # clip spindles
+    values, lengths, positions, offsets = clip_waveforms(
+        normalized['values'], segments['lengths'], segments['positions'], segments['offsets'],
+        filtered['elevation_bin0'], filtered['elevation'], filtered['rh98'], CLIP_METERS_ABOVE_RH98,
+        filtered['clip_elevation'])
+    return {'values': values, 'lengths': lengths, 'positions': positions, 'offsets': offsets}
 
-    # Get WGS84 elevation from digital elevation model
-    wgs84_elevation = prop_rh['geolocation/digital_elevation_model']
 
-    rh_2 = data['rh'][i][2]
-    rh_50 = data['rh'][i][50]
-    rh_98 = data['rh'][i][98]
-    rh_waveform = data['rh'][i]
-    # CHECK
-    rh_waveform = rh_waveform/rh_waveform.sum()*30 if rh_waveform.sum() > 0 else rh_waveform
-    rh_waveform_str = ','.join(map(str, rh_waveform))
+def output_table(filtered, clipped):
+    # output table of the filtered footprints and their clipped waveforms
+    out = {name: filtered[name] for name in [*FIELD_COLUMNS, 'rh2', 'rh50', 'rh98', 'rh_waveform']}
+    out['raw_waveform_values'] = clipped['values']
+    out['raw_waveform_lengths'] = clipped['lengths']
+    out['raw_waveform_positions'] = clipped['positions']
+    out['raw_waveform_offsets'] = clipped['offsets']
+    return out
 
-    # Adaptive downsampling of raw waveform
-    raw_waveform = data['y'][i]
-    downsampled_values, segment_lengths, physical_positions = adaptive_downsample(raw_waveform)
 
-    # apply square root then normalize
-    if downsampled_values.size > 0:
-        # non negative
-        values_to_process = np.maximum(0, downsampled_values)
+def timed(stage, items, function, *args):
+    # function(*args) timed as a run of stage in the run report
+    with RUN_REPORT.stage(stage, items):
+        return function(*args)
 
-        # apply square root
-        if APPLY_SQUARE_ROOT:
-            values_to_process = np.sqrt(values_to_process + 1e-6)
 
-        # NORMALIZE sqrt values
-        current_sum = np.sum(values_to_process)
-        normalized_values = values_to_process / current_sum
-        processed_values = normalized_values
+def filter_stage(columns, start=0, stop=None):
+    # filter_footprints timed in the run report, counting the footprints it scans
+    n_footprints = len(range(len(columns[LATITUDE_COLUMN]))[start:stop])
+    return timed('filter', n_footprints, filter_footprints, columns, start, stop)
 
-    # processed_values = downsampled_values
-    # clip spindles
-    clip_height_above_ground = rh_98 + CLIP_METERS_ABOVE_RH98
-    clip_elevation_threshold = elevation + clip_height_above_ground
 
-    waveform_vertical_range = max(0.01, elevation_bin0 - elevation)
+def convert_footprints(columns, start=0, stop=None):
+    # filter, downsample, normalize and clip footprints [start, stop) of the columns
+    # returns the output table of the footprints inside GEO_BOUNDS, waveforms as flat arrays with offsets
+    filtered = filter_stage(columns, start, stop)
+    n_footprints = len(filtered['y'])
+    segments = timed('downsample', n_footprints, downsample_footprints, filtered)
+    normalized = timed('normalize', n_footprints, normalize_footprints, segments)
+    return output_table(filtered, timed('clip', n_footprints, clip_footprints, filtered, segments, normalized))
+
+
+def source_settings():
+    # identity of the input for the stage cache, the pickle's path, size and mtime
+    if os.path.exists(PKL_FILE):
+        stamp = gedi_store.source_stamp(PKL_FILE)
+    else:
+        stamp = gedi_store.GEDIStore(CACHE_DIR or gedi_store.default_cache_dir(PKL_FILE)).meta['source_stamp']
+    return {'pkl_file': os.path.abspath(PKL_FILE), **stamp}
+
+
+def convert_incremental(cache, load_columns):
+    # convert_footprints through the stage cache (see gedi_stages.py), a stage only reruns when
+    # its settings or an upstream stage changed. load_columns() is only called when filtering reruns
+    filter_settings = {'geo_bounds': GEO_BOUNDS}
+    downsample_settings = {'adaptive_threshold': ADAPTIVE_THRESHOLD}
+    normalize_settings = {'apply_square_root': APPLY_SQUARE_ROOT}
+    clip_settings = {'clip_meters_above_rh98': CLIP_METERS_ABOVE_RH98}
+
+    filter_key = gedi_stages.stage_key('filter', source_settings(), filter_settings)
+    downsample_key = gedi_stages.stage_key('downsample', filter_key, downsample_settings)
+    normalize_key = gedi_stages.stage_key('normalize', downsample_key, normalize_settings)
+    clip_key = gedi_stages.stage_key('clip', normalize_key, clip_settings)
+
+    filtered = cache.get('filter', filter_key, lambda: filter_stage(load_columns()), filter_settings)
+    n_footprints = len(filtered['y'])
+
+    def clip():
+        segments = cache.get('downsample', downsample_key,
+                             lambda: timed('downsample', n_footprints, downsample_footprints, filtered), downsample_settings)
+        normalized = cache.get('normalize', normalize_key,
+                               lambda: timed('normalize', n_footprints, normalize_footprints, segments), normalize_settings)
+        return timed('clip', n_footprints, clip_footprints, filtered, segments, normalized)
+
+    return output_table(filtered, cache.get('clip', clip_key, clip, clip_settings))
+
+
+def merge_tables(tables):
+    # concatenates footprint tables in order, shifting the waveform offsets
+    # empty tables are skipped, their placeholder dtypes would change the merged columns
+    tables = [table for table in tables if len(table['raw_waveform_offsets']) > 1] or tables[:1]
+
+    merged = {}
+    for name in tables[0]:
+        if name == 'raw_waveform_offsets':
+            shifts = np.cumsum([0] + [table[name][-1] for table in tables[:-1]])
+            merged[name] = np.concatenate([tables[0][name][:1]] + [table[name][1:] + shift for table, shift in zip(tables, shifts)])
+        else:
+            merged[name] = np.concatenate([table[name] for table in tables])
+    return merged
+
+
+def to_frame(table):
+    # CSV layout, waveforms as comma-joined strings
+    # pandas is imported on first use, runs writing only binary outputs never load it
+    import pandas as pd
+    offsets = table['raw_waveform_offsets']
+    frame = {name: table[name] for name in FIELD_COLUMNS}
+    frame['rh2'] = table['rh2']
+    frame['rh50'] = table['rh50']
+    frame['rh98'] = table['rh98']
+    frame['rh_waveform'] = [','.join(map(str, row)) for row in table['rh_waveform']]
+    frame['raw_waveform_values'] = join_footprints(table['raw_waveform_values'], offsets)
+    frame['raw_waveform_lengths'] = join_footprints(table['raw_waveform_lengths'], offsets)
+    frame['raw_waveform_positions'] = join_footprints(table['raw_waveform_positions'], offsets)
+    return pd.DataFrame(frame)
+
+
+def slice_footprints(table, start, stop):
+    # footprints [start, stop) of a table, as views
+    offsets = table['raw_waveform_offsets']
+    sliced = {}
+    for name, column in table.items():
+        if name == 'raw_waveform_offsets':
+            sliced[name] = offsets[start:stop + 1] - offsets[start]
+        elif name.startswith('raw_waveform_'):
+            sliced[name] = column[offsets[start]:offsets[stop]]
+        else:
+            sliced[name] = column[start:stop]
+    return sliced
+
+
+def table_frames(table, rows=CSV_CHUNK_ROWS):
+    # to_frame of each rows footprints of the table, so only one chunk of CSV text exists at a time
+    n_footprints = len(table['raw_waveform_offsets']) - 1
+    for start in range(0, max(n_footprints, 1), rows):
+        yield to_frame(slice_footprints(table, start, min(start + rows, n_footprints)))
+
+
+def write_csv(frames, path):
+    # frames written as one CSV, compressed as configured, returns the row count
+    return gedi_csv.write_frames(frames, path, CSV_COMPRESSION)
+
+
+# ====== WORKER POOL ======
+
+_worker_columns = None
+
+
+def _init_worker(directory, names, config, index=None, python_float_elevations=False):
+    # settings of the config being converted, spawned workers would otherwise have none
+    # index: rows of the columns to convert, all of them if None
+    global _worker_columns, PYTHON_FLOAT_ELEVATIONS
+    apply_config(config)
+    PYTHON_FLOAT_ELEVATIONS = python_float_elevations
+    _worker_columns = gedi_store.load_columns(directory, names)
+    if index is not None:
+        _worker_columns = {name: gedi_store.RowSubset(column, index) for name, column in _worker_columns.items()}
+
+
+def _convert_shard(bounds):
+    # the shard's output table and the stage records of its conversion
+    global RUN_REPORT
+    RUN_REPORT = gedi_metrics.RunReport()
+    return convert_footprints(_worker_columns, *bounds), RUN_REPORT.stages
+
+
+def convert_parallel(columns, workers, shards_per_worker=4):
+    # footprint range split into shards, converted in a process pool and returned in footprint order
+    n_footprints = len(columns['y'])
+    edges = np.linspace(0, n_footprints, workers * shards_per_worker + 1).astype(int)
+    shards = [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+    if not shards:
+        return [convert_footprints(columns)]
+
+    with _pool_source(columns) as (directory, index):
+        return _run_pool(directory, workers, shards, index)
 
-    clipped_values = []
-    clipped_lengths = []
-    clipped_positions = []
 
-    if processed_values.size > 0:
-        for j in range(len(processed_values)):
-            sample_elevation = elevation_bin0 - (physical_positions[j] * waveform_vertical_range)
+def convert_chunks(columns, workers=1, chunk_footprints=None):
+    # convert_footprints of consecutive chunk_footprints ranges of the columns, yielded in footprint order
+    # with workers, at most two chunks per worker are in flight so they don't pile up ahead of the writer
+    chunk_footprints = chunk_footprints or CHUNK_FOOTPRINTS
+    n_footprints = len(columns['y'])
+    shards = [(start, min(start + chunk_footprints, n_footprints)) for start in range(0, n_footprints, chunk_footprints)]
 
-            if sample_elevation <= clip_elevation_threshold:
-                clipped_values.append(processed_values[j])
-                clipped_lengths.append(segment_lengths[j])
-                clipped_positions.append(physical_positions[j])
+    if not shards:
+        yield convert_footprints(columns)
+        return
 
-    if not clipped_values:
-        values_str = ""
-        lengths_str = ""
-        positions_str = ""
+    progress = gedi_metrics.Progress('Footprints converted', n_footprints)
+    if workers <= 1:
+        for footprints, batch in gedi_store.iter_batches(columns, chunk_footprints, INPUT_COLUMNS):
+            table = convert_footprints(batch)
+            progress.update(len(footprints))
+            yield table
+        progress.close()
+        return
+
+    with _pool_source(columns) as (directory, index):
+        with _pool(directory, workers, index) as pool:
+            pending = deque()
+            for shard in shards:
+                pending.append((shard, pool.submit(_convert_shard, shard)))
+                if len(pending) >= 2 * workers:
+                    yield _shard_result(*pending.popleft(), progress)
+            while pending:
+                yield _shard_result(*pending.popleft(), progress)
+    progress.close()
+
+
+@contextmanager
+def _pool_source(columns):
+    # (directory, index) workers read the columns from: store columns are mapped from the column
+    # cache directly, in-memory columns are saved to a temp dir first
+    if isinstance(columns, gedi_store.SubsetColumns):
+        yield columns.store.directory, columns.index
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        gedi_store.save_columns(columns, directory)
+        yield directory, None
+
+
+def _pool(directory, workers, index=None):
+    return ProcessPoolExecutor(workers, initializer=_init_worker,
+                               initargs=(directory, INPUT_COLUMNS, CONFIG, index, PYTHON_FLOAT_ELEVATIONS))
+
+
+def _run_pool(directory, workers, shards, index=None):
+    progress = gedi_metrics.Progress('Footprints converted', shards[-1][1] - shards[0][0])
+    with _pool(directory, workers, index) as pool:
+        futures = [(shard, pool.submit(_convert_shard, shard)) for shard in shards]
+        tables = [_shard_result(shard, future, progress) for shard, future in futures]
+    progress.close()
+    return tables
+
+
+def _shard_result(shard, future, progress):
+    # table of a converted shard, its worker's stage records added to the run report
+    table, stages = future.result()
+    RUN_REPORT.merge(stages)
+    progress.update(shard[1] - shard[0])
+    return table
+
+
+def load_data():
+    # the column cache, or the whole pickle when use_cache is off
+    if USE_CACHE:
+        return gedi_store.open_gedi(PKL_FILE, CACHE_DIR)
+    with open(PKL_FILE, 'rb') as f:
+        return pickle.load(f)
+
+
+def input_columns(data):
+    return store_columns(data) if USE_CACHE else pickle_columns(data)
+
+
+def export(load_columns, workers=1):
+    # converts the configured region and writes its outputs, with the run report and profile if configured
+    # load_columns() returns the input columns, it is not called when the stage cache has everything
+    global RUN_REPORT
+    RUN_REPORT = gedi_metrics.RunReport()
+
+    def load_stage():
+        with RUN_REPORT.stage('load'):
+            return load_columns()
+
+    if PROFILE_OUTPUT:
+        with gedi_metrics.profiled(f'{OUTPUT_PATH}{PROFILE_FILENAME}'):
+            convert_and_write(load_stage, workers)
+        print(f'Output profile: \t\t{PROFILE_FILENAME}')
     else:
-        values_str = ','.join(map(str, clipped_values))
-        lengths_str = ','.join(map(str, clipped_lengths))
-        positions_str = ','.join(map(str, clipped_positions))
-    
-    # # Convert to strings and combine with delimiter
-    # values_str = ','.join(map(str, downsampled_values))
-    # lengths_str = ','.join(map(str, segment_lengths))
-    # positions_str = ','.join(map(str, physical_positions))
-
-    data_list.append({
-        'latitude': latitude,
-        'longitude': longitude,
-        'elevation': elevation,
-        'instrument_lat': instrument_lat,
-        'instrument_lon': instrument_lon, 
-        'instrument_alt': instrument_alt,
-        'lowest_lat': lowest_lat,
-        'lowest_lon': lowest_lon,
-        'lowest_elev': lowest_elev,
-        'wgs84_elevation': wgs84_elevation,
-        'rh2': rh_2,
-        'rh50': rh_50,
-        'rh98': rh_98,
-        'rh_waveform': rh_waveform_str,
-        'raw_waveform_values': values_str,
-        'raw_waveform_lengths': lengths_str,
-        'raw_waveform_positions': positions_str,
-    })
-
-df = pd.DataFrame(data_list)
-df.to_csv(f'{OUTPUT_PATH}{OUTPUT_FILENAME}', index=False)
-print(f'\nOutput path: \t\t\t{OUTPUT_PATH}')
-print(f'Output filename: \t\t{OUTPUT_FILENAME}')
\ No newline at end of file
+        convert_and_write(load_stage, workers)
+
+    if REPORT_OUTPUT:
+        RUN_REPORT.print_stages()
+        RUN_REPORT.write(f'{OUTPUT_PATH}{REPORT_FILENAME}', report_settings(workers))
+        print(f'Output report: \t\t\t{REPORT_FILENAME}')
+
+
+def report_settings(workers):
+    # the settings of the run, saved with its report
+    return {
+        'config_file': CONFIG_FILE_PATH and os.path.abspath(CONFIG_FILE_PATH),
+        'pkl_file': os.path.abspath(PKL_FILE),
+        'use_cache': USE_CACHE,
+        'geo_bounds': GEO_BOUNDS,
+        'adaptive_threshold': ADAPTIVE_THRESHOLD,
+        'clip_meters_above_rh98': CLIP_METERS_ABOVE_RH98,
+        'apply_square_root': APPLY_SQUARE_ROOT,
+        'incremental': INCREMENTAL,
+        'format': OUTPUT_FORMAT,
+        'compression': CSV_COMPRESSION,
+        'chunk_footprints': CHUNK_FOOTPRINTS,
+        'codec_bits': CODEC_BITS,
+        'workers': workers,
+    }
+
+
+def convert_and_write(load_columns, workers=1):
+    # Print stats
+    if ADAPTIVE_THRESHOLD == 0:
+        print(f'Adaptive sampling threshold: \t{ADAPTIVE_THRESHOLD} (off)')
+    else:
+        print(f'Adaptive sampling threshold: \t{ADAPTIVE_THRESHOLD}')
+    print(f'Meters clipped above RH98: \t{CLIP_METERS_ABOVE_RH98}m')
+
+    if CHUNK_FOOTPRINTS:
+        # each chunk is written as soon as it is converted, the whole table never exists
+        print(f'Output path: \t\t\t{OUTPUT_PATH}')
+        tables = convert_chunks(load_columns(), workers)
+        with RUN_REPORT.stage('write_csv') as stage:
+            n_footprints = write_csv((to_frame(table) for table in tables), f'{OUTPUT_PATH}{OUTPUT_FILENAME}')
+            stage.count(n_footprints)
+        print(f'Waveforms processed: \t\t{n_footprints}')
+        print(f'Output filename: \t\t{OUTPUT_FILENAME}')
+        return
+
+    if INCREMENTAL:
+        # stages run in this process, --workers only applies to full runs
+        cache = gedi_stages.StageCache(STAGE_CACHE_DIR or os.path.join(OUTPUT_PATH, '.stages'))
+        table = convert_incremental(cache, load_columns)
+    elif workers > 1:
+        table = merge_tables(convert_parallel(load_columns(), workers))
+    else:
+        table = convert_footprints(load_columns())
+    n_footprints = len(table['latitude'])
+    print(f'Waveforms processed: \t\t{n_footprints}')
+
+    print(f'Output path: \t\t\t{OUTPUT_PATH}')
+    if OUTPUT_FORMAT in ('csv', 'both'):
+        timed('write_csv', n_footprints, write_csv, table_frames(table), f'{OUTPUT_PATH}{OUTPUT_FILENAME}')
+        print(f'Output filename: \t\t{OUTPUT_FILENAME}')
+    if OUTPUT_FORMAT in ('binary', 'both'):
+        timed('write_binary', n_footprints, gedi_binary.write_binary, table, f'{OUTPUT_PATH}{BINARY_FILENAME}')
+        print(f'Output filename: \t\t{BINARY_FILENAME}')
+    if CODEC_BITS:
+        timed('write_codec', n_footprints, gedi_codec.write_codec, table, f'{OUTPUT_PATH}{CODEC_FILENAME}', CODEC_BITS)
+        print(f'Output filename: \t\t{CODEC_FILENAME}')
+    if MESH_OUTPUT:
+        with RUN_REPORT.stage('write_mesh', n_footprints):
+            mesh = gedi_mesh.build_mesh(table['lowest_lon'], table['lowest_lat'], table['lowest_elev'],
+                                        GEO_BOUNDS, MESH_MAX_EDGE)
+            gedi_mesh.write_mesh(mesh, f'{OUTPUT_PATH}{MESH_FILENAME}')
+        print(f'Output filename: \t\t{MESH_FILENAME}')
+    if LOD_LEVELS:
+        with RUN_REPORT.stage('write_lod', n_footprints):
+            gedi_lod.write_lod(gedi_lod.build_pyramid(table, LOD_LEVELS), f'{OUTPUT_PATH}{LOD_FILENAME}')
+        print(f'Output filename: \t\t{LOD_FILENAME}')
+    if TILE_DEGREES:
+        writers = {}
+        if OUTPUT_FORMAT in ('csv', 'both'):
+            writers[f'csv{gedi_csv.SUFFIXES[CSV_COMPRESSION]}'] = lambda tile, path: write_csv(table_frames(tile), path)
+        if OUTPUT_FORMAT in ('binary', 'both'):
+            writers['bin'] = gedi_binary.write_binary
+        if CODEC_BITS:
+            writers['wfc'] = lambda tile, path: gedi_codec.write_codec(tile, path, CODEC_BITS)
+        manifest = timed('write_tiles', n_footprints, gedi_tiles.write_tiles, table, f'{OUTPUT_PATH}{TILES_DIRNAME}',
+                         TILE_DEGREES, writers, GEO_BOUNDS)
+        print(f'Output tiles: \t\t\t{TILES_DIRNAME} ({len(manifest["tiles"])} tiles)')
+
+
+def run_batch(config_paths, workers=1):
+    # exports every config, loading each input once: configs are grouped by their input and,
+    # without the column cache, one pass over the pickle pulls the footprints of all their regions
+    groups = {}
+    for config_path in config_paths:
+        configure(config_path)
+        source = (os.path.abspath(PKL_FILE), USE_CACHE, CACHE_DIR)
+        groups.setdefault(source, []).append((config_path, GEO_BOUNDS))
+
+    for (pkl_file, use_cache, _), configs in groups.items():
+        print(f'Input: \t\t\t\t{pkl_file} ({len(configs)} configs)')
+        regions = [bounds for _, bounds in configs]
+        loaded = []
+
+        def load_group():
+            # the store, or the columns of all regions from one pass over the pickle, loaded on first use
+            if not loaded:
+                loaded.append(load_data() if use_cache else pickle_columns(load_data(), regions))
+            return loaded[0]
+
+        for config_path, _ in configs:
+            configure(config_path)
+            print(f'\nConfig: \t\t\t{config_path}')
+            # each region reads its own index tiles of the shared store
+            export((lambda: store_columns(load_group())) if use_cache else load_group, workers)
+
+
+def run(config_file_path, workers=1):
+    # exports one YAML config, for notebooks and other scripts:
+    #   import pkl2CSV
+    #   pkl2CSV.run('yamls/mapia_partial.yaml')
+    # the stages can also be called one by one after configure(), see convert_footprints
+    configure(config_file_path)
+    export(lambda: input_columns(load_data()), workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a GEDI pickle to the visualization CSV')
+    parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_FILE,
+                        help=f'YAML config (default {DEFAULT_CONFIG_FILE})')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--batch', nargs='+', metavar='CONFIG',
+                        help='export all these YAML configs, loading each input pickle once')
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(args.batch, args.workers)
+        return
+
+    configure(args.config)
+
+    # Print data keys in debug mode
+    if DEBUG_MODE:
+        data = load_data()
+        print(f'keys: {list(data.keys())}\n')
+        print(f"prop: {data['prop'][0]}\n")
+        print(f"prop_rh: {data['prop_rh'][0]}\n")
+        print(f"rh: {data['rh'][0]}\n")
+        sys.exit()
+
+    export(lambda: input_columns(load_data()), args.workers)
+
+
+if __name__ == '__main__':
+    main()
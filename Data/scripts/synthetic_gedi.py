@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+import gedi_store
+
+# synthetic GEDI data with the schema of the pickles in Data/pkls, for benchmarks and tests
+#
+# footprints lie along ISS-like tracks crossing BOUNDS, over a smooth terrain() surface. each
+# gets a 512 sample waveform (noise floor, canopy returns, ground pulse) and RH percentiles
+# taken from the cumulative energy of that waveform, so the pipeline sees realistic shapes:
+#   python synthetic_gedi.py ../pkls/synthetic.pkl --footprints 100000 --tif ../tifs/synthetic.tif
+# --store writes the column cache (see gedi_store.py) directly, for sizes whose pickle would
+# not fit in memory; scripts open it through the pickle path like any other cache
+
+# region the footprints are spread over, [W, E, S, N], a bit larger than mapia_partial.yaml
+BOUNDS = [-69.2, -68.1, -9.2, -8.1]
+
+N_SAMPLES = 512
+N_RH = 101
+SAMPLE_METERS = 0.15  # vertical distance between waveform samples
+
+FOOTPRINTS_PER_TRACK = 2000
+FOOTPRINT_SPACING = 0.00054  # degrees between shots along a track, about 60 m
+
+# footprints generated per step
+BATCH_FOOTPRINTS = 8192
+
+DEM_RESOLUTION = 0.001  # degrees per GeoTIFF pixel
+DEM_NODATA = -9999.0
+
+
+def terrain(lon, lat):
+    # ground elevation in meters
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    return 150 + 60 * np.sin(3 * lon) * np.cos(2 * lat) + 25 * np.sin(17 * lon + 5 * lat) + 8 * np.cos(41 * lat)
+
+
+def track_parameters(n_footprints, seed, bounds=BOUNDS):
+    # (start lon, start lat, heading) of every track, headings like the ISS's ground tracks
+    rng = np.random.default_rng([seed, 0])
+    n_tracks = -(-n_footprints // FOOTPRINTS_PER_TRACK)
+    west, east, south, north = bounds
+    start_lon = rng.uniform(west, east, n_tracks)
+    start_lat = rng.uniform(south, north, n_tracks)
+    heading = rng.choice([-1, 1], n_tracks) * rng.uniform(np.radians(30), np.radians(60), n_tracks)
+    return start_lon, start_lat, heading
+
+
+def wrap(values, low, high):
+    # values folded back and forth into [low, high]
+    span = high - low
+    folded = np.mod(values - low, 2 * span)
+    return low + np.where(folded > span, 2 * span - folded, folded)
+
+
+def make_batch(start, stop, tracks, seed, bounds=BOUNDS):
+    # columns of footprints [start, stop): 'prop/<key>', 'prop_rh/<key>', 'y' and 'rh'
+    rng = np.random.default_rng([seed, 1, start])
+    n = stop - start
+    index = np.arange(start, stop)
+
+    # positions along the tracks
+    start_lon, start_lat, heading = tracks
+    track = index // FOOTPRINTS_PER_TRACK
+    along = (index % FOOTPRINTS_PER_TRACK) * FOOTPRINT_SPACING
+    west, east, south, north = bounds
+    lon = wrap(start_lon[track] + along * np.sin(heading[track]), west, east)
+    lat = wrap(start_lat[track] + along * np.cos(heading[track]), south, north)
+
+    # canopy, a fifth of the shots over bare ground
+    ground = terrain(lon, lat) + rng.normal(0, 0.5, n)
+    bare = rng.random(n) < 0.2
+    height = np.where(bare, 0, rng.uniform(5, 45, n))
+    cover = np.where(bare, 0, rng.uniform(0.2, 1, n))
+    bin0 = ground + height + rng.uniform(5, 15, n)
+    ground_sample = (bin0 - ground) / SAMPLE_METERS
+
+    # waveform: ground pulse and canopy layers over the noise floor
+    samples = np.arange(N_SAMPLES, dtype=np.float64)
+    signal = (rng.uniform(30, 300, n) * (1 - 0.7 * cover))[:, None] * np.exp(
+        -0.5 * ((samples - ground_sample[:, None]) / rng.uniform(3, 6, n)[:, None]) ** 2)
+    for _ in range(3):
+        layer = ground_sample - height * rng.uniform(0.3, 1, n) / SAMPLE_METERS
+        width = rng.uniform(5, 15, n)
+        signal += (cover * rng.uniform(15, 70, n))[:, None] * np.exp(
+            -0.5 * ((samples - layer[:, None]) / width[:, None]) ** 2)
+    noise_floor = rng.uniform(200, 240, n)
+    y = noise_floor[:, None] + signal + rng.normal(0, 1, (n, N_SAMPLES)) * rng.uniform(1.5, 3, n)[:, None]
+
+    rh = relative_heights(signal, ground_sample)
+
+    delta_time = 4.8e7 + index * 0.0166
+    shot_number = 34060800300000000 + index
+    lowest_lat = lat + rng.normal(0, 2e-6, n)
+    lowest_lon = lon + rng.normal(0, 2e-6, n)
+    elev_lowestmode = ground + rng.normal(0, 0.3, n)
+    highest = bin0 - np.argmax(signal > 0.05 * signal.max(axis=1, keepdims=True), axis=1) * SAMPLE_METERS
+
+    shared = {
+        'rx_sample_start_index': index * N_SAMPLES,
+        'rx_sample_count': np.full(n, N_SAMPLES),
+        'geolocation/latitude_bin0': lat,
+        'geolocation/longitude_bin0': lon,
+        'geolocation/elevation_bin0': bin0,
+        'geolocation/elevation_lastbin': bin0 - (N_SAMPLES - 1) * SAMPLE_METERS,
+        'geolocation/delta_time': delta_time,
+        'shot_number': shot_number,
+        'quality_flag': (rng.random(n) > 0.05).astype(np.int64),
+        'sensitivity': rng.uniform(0.9, 0.99, n),
+        'solar_elevation': rng.uniform(-30, 60, n),
+        'degrade_flag': np.zeros(n, dtype=np.int64),
+        'elev_lowestmode': elev_lowestmode,
+        'elev_highestreturn': highest,
+        'land_cover_data/landsat_treecover': np.round(cover * 100),
+        'land_cover_data/modis_nonvegetated': np.round((1 - cover) * rng.uniform(0, 30, n)),
+        'land_cover_data/modis_treecover': np.round(cover * rng.uniform(40, 90, n)),
+        'delta_time': delta_time,
+    }
+    prop = dict(shared)
+    for p in (0, 25, 50, 75, 98):
+        prop[f'rh_{p}'] = rh[:, p].astype(np.float64)
+    prop['surface_flag'] = np.ones(n)
+
+    prop_rh = dict(shared)
+    prop_rh.update({
+        'geolocation/latitude_instrument': lat + 0.3 * np.cos(heading[track]),
+        'geolocation/longitude_instrument': lon + 0.3 * np.sin(heading[track]),
+        'geolocation/altitude_instrument': rng.uniform(410000, 420000, n),
+        'geolocation/digital_elevation_model': ground + rng.normal(0, 1.5, n),
+        'geolocation/digital_elevation_model_srtm': ground + rng.normal(0, 3, n),
+        'lat_lowestmode': lowest_lat,
+        'lon_lowestmode': lowest_lon,
+        'rh_id': index,
+        'surface_flag': np.ones(n, dtype=bool),
+    })
+
+    columns = {f'prop/{key}': value for key, value in prop.items()}
+    columns.update({f'prop_rh/{key}': value for key, value in prop_rh.items()})
+    columns['y'] = y.astype(np.float32)
+    columns['rh'] = rh
+    return columns
+
+
+def relative_heights(signal, ground_sample):
+    # height above ground (m) where the energy cumulated from the bottom reaches 0..100 percent,
+    # returns weaker than 2% of the peak are below detection
+    n = len(signal)
+    detected = np.where(signal > 0.02 * signal.max(axis=1, keepdims=True), signal, 0)
+    cumulative = np.cumsum(detected[:, ::-1], axis=1)
+    cumulative /= cumulative[:, -1:]
+
+    # rows are offset by 2 so one searchsorted covers all of them, rh 0 is the first detected sample
+    rows = np.arange(n)
+    flat = (cumulative + 2 * rows[:, None]).ravel()
+    percents = np.maximum(np.linspace(0, 1, N_RH), 1e-9)
+    thresholds = (2 * rows[:, None] + percents[None, :]).ravel()
+    positions = np.searchsorted(flat, thresholds).reshape(n, N_RH) - (rows * N_SAMPLES)[:, None]
+    samples = N_SAMPLES - 1 - np.clip(positions, 0, N_SAMPLES - 1)
+
+    return ((ground_sample[:, None] - samples) * SAMPLE_METERS).astype(np.float32)
+
+
+def iter_batches(n_footprints, seed=0, bounds=BOUNDS, batch_footprints=BATCH_FOOTPRINTS):
+    tracks = track_parameters(n_footprints, seed, bounds)
+    for start in range(0, n_footprints, batch_footprints):
+        yield make_batch(start, min(start + batch_footprints, n_footprints), tracks, seed, bounds)
+
+
+def write_pickle(path, n_footprints, seed=0, bounds=BOUNDS):
+    # pickle laid out like the real ones: lists of per-footprint dicts and arrays
+    data = {'prop': [], 'prop_rh': [], 'y': [], 'rh': []}
+    for batch in iter_batches(n_footprints, seed, bounds):
+        for group in gedi_store.RECORD_GROUPS:
+            prefix = f'{group}/'
+            keys = [name for name in batch if name.startswith(prefix)]
+            values = zip(*(batch[name].tolist() for name in keys))
+            data[group].extend(dict(zip((key[len(prefix):] for key in keys), row)) for row in values)
+        data['y'].extend(batch['y'])
+        data['rh'].extend(batch['rh'])
+
+    with open(path, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def write_store(pkl_path, n_footprints, seed=0, bounds=BOUNDS, cache_dir=None):
+    # the column cache of a pickle that is never written, batch by batch so memory stays flat
+    cache_dir = cache_dir or gedi_store.default_cache_dir(pkl_path)
+    building_dir = f'{cache_dir}.building'
+    shutil.rmtree(building_dir, ignore_errors=True)
+    os.makedirs(building_dir)
+
+    columns = {}
+    start = 0
+    for batch in iter_batches(n_footprints, seed, bounds):
+        for name, values in batch.items():
+            if name not in columns:
+                columns[name] = np.lib.format.open_memmap(
+                    os.path.join(building_dir, gedi_store.column_filename(name)), mode='w+',
+                    dtype=values.dtype, shape=(n_footprints, *values.shape[1:]))
+            columns[name][start:start + len(values)] = values
+        start += len(batch['y'])
+
+    meta = {
+        'version': gedi_store.STORE_VERSION,
+        'source': os.path.abspath(pkl_path),
+        # no pickle to stamp, the generation time keeps stage caches of older data apart
+        'source_stamp': {'size': 0, 'mtime_ns': time.time_ns()},
+        'n_footprints': n_footprints,
+        'columns': {name: {'dtype': column.dtype.str, 'shape': list(column.shape),
+                           # write_pickle stores the record fields as Python floats (tolist)
+                           'python_floats': name.split('/')[0] in gedi_store.RECORD_GROUPS and column.dtype.kind == 'f'}
+                    for name, column in columns.items()},
+    }
+    for column in columns.values():
+        column.flush()
+    del columns
+    with open(os.path.join(building_dir, gedi_store.META_FILENAME), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(building_dir, cache_dir)
+    return cache_dir
+
+
+def write_dem(path, bounds=BOUNDS, resolution=DEM_RESOLUTION, seed=0):
+    # tiled float32 GeoTIFF of terrain() over bounds, with a little noise and a nodata corner
+    import rasterio
+    from rasterio.transform import Affine
+
+    west, east, south, north = bounds
+    width = int(round((east - west) / resolution))
+    height = int(round((north - south) / resolution))
+
+    lon = west + (np.arange(width) + 0.5) * resolution
+    lat = north - (np.arange(height) + 0.5) * resolution
+    rng = np.random.default_rng([seed, 2])
+    dem = terrain(lon[None, :], lat[:, None]) + rng.normal(0, 0.5, (height, width))
+    dem[:height // 20, :width // 20] = DEM_NODATA
+
+    profile = {
+        'driver': 'GTiff', 'width': width, 'height': height, 'count': 1, 'dtype': 'float32',
+        'crs': 'EPSG:4326', 'transform': Affine(resolution, 0, west, 0, -resolution, north),
+        'nodata': DEM_NODATA, 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+    }
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(dem.astype(np.float32), 1)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic GEDI pickle (and GeoTIFF)')
+    parser.add_argument('pkl', help='pickle path, also names the column cache with --store')
+    parser.add_argument('--footprints', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bounds', type=float, nargs=4, default=BOUNDS, metavar=('W', 'E', 'S', 'N'))
+    parser.add_argument('--store', action='store_true', help='write the column cache instead of the pickle')
+    parser.add_argument('--tif', help='also write a DEM GeoTIFF of the terrain')
+    args = parser.parse_args()
+
+    if args.store:
+        print(f'Column cache: \t\t\t{write_store(args.pkl, args.footprints, args.seed, args.bounds)}')
+    else:
+        print(f'Pickle: \t\t\t{write_pickle(args.pkl, args.footprints, args.seed, args.bounds)}')
+    if args.tif:
+        print(f'GeoTIFF: \t\t\t{write_dem(args.tif, args.bounds, seed=args.seed)}')
+
+
+if __name__ == '__main__':
+    main()
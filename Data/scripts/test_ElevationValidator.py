@@ -0,0 +1,90 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import ElevationValidator
+import gedi_store
+
+# the KD-tree matching of ElevationValidator.py against the linear scan it replaces
+#   python -m pytest test_ElevationValidator.py
+
+
+def linear_scan(lng, lat, query_lng, query_lat):
+    # the original matchGEDI loop: the first point strictly closer than every earlier one wins
+    nearest = np.full(len(query_lng), -1, dtype=np.int64)
+    distances = np.full(len(query_lng), np.inf)
+    for k in range(len(lng)):
+        for j in range(len(query_lng)):
+            dist = np.sqrt((lng[k] - query_lng[j]) ** 2 + (lat[k] - query_lat[j]) ** 2)
+            if dist < distances[j]:
+                distances[j] = dist
+                nearest[j] = k
+    return nearest, distances
+
+
+def tied_points():
+    # a shuffled grid with duplicate points, queried at grid points, midpoints of edges and cell
+    # centres (two or four points at exactly equal distance) and at random spots
+    rng = np.random.default_rng(2)
+    grid_lng, grid_lat = np.meshgrid(np.arange(-68.0, -67.0, 0.125), np.arange(-20.0, -19.0, 0.125))
+    lng, lat = grid_lng.ravel(), grid_lat.ravel()
+    duplicates = rng.choice(lng.size, 20, replace=False)
+    lng, lat = np.concatenate([lng, lng[duplicates]]), np.concatenate([lat, lat[duplicates]])
+    order = rng.permutation(lng.size)
+    lng, lat = lng[order], lat[order]
+
+    query_lng = np.concatenate([lng[:10], lng[:10] + 0.0625, lng[10:20], lng[20:30] + 0.0625,
+                                rng.uniform(-68.2, -66.8, 30)])
+    query_lat = np.concatenate([lat[:10], lat[:10], lat[10:20] + 0.0625, lat[20:30] + 0.0625,
+                                rng.uniform(-20.2, -18.8, 30)])
+    return lng, lat, query_lng, query_lat
+
+
+def test_nearest_points_matches_the_linear_scan():
+    lng, lat, query_lng, query_lat = tied_points()
+    nearest, distances = ElevationValidator.nearest_points(lng, lat, query_lng, query_lat)
+    expected_nearest, expected_distances = linear_scan(lng, lat, query_lng, query_lat)
+
+    np.testing.assert_array_equal(nearest, expected_nearest)
+    np.testing.assert_array_equal(distances, expected_distances)
+
+
+@pytest.mark.parametrize('batch_size', [7, 64, 1000])
+def test_match_batches_matches_the_linear_scan(batch_size):
+    lng, lat, query_lng, query_lat = tied_points()
+    batches = ((np.arange(start, min(start + batch_size, lng.size)),
+                lng[start:start + batch_size], lat[start:start + batch_size])
+               for start in range(0, lng.size, batch_size))
+    nearest, distances = ElevationValidator.match_batches(batches, query_lng, query_lat)
+    expected_nearest, expected_distances = linear_scan(lng, lat, query_lng, query_lat)
+
+    np.testing.assert_array_equal(nearest, expected_nearest)
+    np.testing.assert_array_equal(distances, expected_distances)
+
+
+def test_nearest_points_without_points():
+    lng, lat = np.array([np.nan, 1.0]), np.array([0.0, np.nan])
+    nearest, distances = ElevationValidator.nearest_points(lng, lat, [0.0, 1.0], [0.0, 1.0])
+    np.testing.assert_array_equal(nearest, [-1, -1])
+    np.testing.assert_array_equal(distances, [np.inf, np.inf])
+
+
+@pytest.mark.parametrize('scalar', [float, np.float64])
+def test_match_region_matches_the_linear_scan(monkeypatch, tmp_path, scalar):
+    # queries on shots are looked up in the coordinate index, the rest go through the trees
+    monkeypatch.setattr(ElevationValidator, 'GEO_BOUNDS', [-68.2, -66.8, -20.2, -18.8])
+    monkeypatch.setattr(ElevationValidator, 'MATCH_BATCH', 50)
+    lng, lat, query_lng, query_lat = tied_points()
+    data = {'prop': [{} for _ in lng],
+            'prop_rh': [{'lon_lowestmode': scalar(x), 'lat_lowestmode': scalar(y)} for x, y in zip(lng, lat)],
+            'y': [np.zeros(4, dtype=np.float32)] * len(lng), 'rh': [np.zeros(101, dtype=np.float32)] * len(lng)}
+    pkl_path = tmp_path / 'gedi.pkl'
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(data, f)
+    store = gedi_store.open_gedi(str(pkl_path), verbose=False)
+
+    nearest, distances = ElevationValidator.match_region(store, query_lng, query_lat)
+    expected_nearest, expected_distances = linear_scan(lng, lat, query_lng, query_lat)
+    np.testing.assert_array_equal(nearest, expected_nearest)
+    np.testing.assert_array_equal(distances, expected_distances)
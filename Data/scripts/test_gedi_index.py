@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import gedi_index
+
+# coordinate keys of gedi_index.py against the built-in round(x, 6) lookups they replace
+#   python -m pytest test_gedi_index.py
+
+
+def near_half_steps():
+    # coordinates at and one ulp either side of half a step of 1e-6 degrees, where x * 1e6 rounds onto
+    # or across the half, and random ones
+    rng = np.random.default_rng(3)
+    halves = (rng.integers(-180_000_000, 180_000_000, 20000) + 0.5) / 1e6
+    return np.concatenate([halves, np.nextafter(halves, np.inf), np.nextafter(halves, -np.inf),
+                           rng.uniform(-180, 180, 20000)])
+
+
+@pytest.mark.parametrize('scalar', [float, np.float64])
+def test_quantize_rounds_like_the_builtin_round(scalar):
+    # round() of a Python float rounds its exact binary value, of a NumPy scalar like np.round
+    degrees = near_half_steps()
+    expected = [round(round(scalar(x), 6) * 1e6) for x in degrees]
+    steps = gedi_index.quantize(degrees, 6, python_floats=scalar is float)
+    np.testing.assert_array_equal(steps, expected)
@@ -0,0 +1,39 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import ElevationValidator
+import gedi_server
+import gedi_store
+
+# request checks and lookups of gedi_server.py
+#   python -m pytest test_gedi_server.py
+
+
+@pytest.mark.parametrize('shot, valid', [
+    (12, True), ('236780200300264105', True), (2 ** 63 - 1, True),
+    (1.5, False), (1.0, False), ('1.5', False), ('1e17', False), ('-3', False), ('', False),
+    (True, False), (None, False), (2 ** 63, False),
+])
+def test_shot_numbers_are_integers(shot, valid):
+    assert gedi_server.is_shot_number(shot) == valid
+
+
+def test_nearest_matches_like_the_validator(tmp_path):
+    # on the validator's lowest mode coordinates, not bin0, the lowest of tied footprints first
+    lng = np.array([-68.0, -68.5, -68.5, -67.5])
+    lat = np.array([-20.0, -19.5, -19.5, -20.5])
+    data = {'prop': [{'geolocation/longitude_bin0': x + 1, 'geolocation/latitude_bin0': y + 1} for x, y in zip(lng, lat)],
+            'prop_rh': [{'lon_lowestmode': x, 'lat_lowestmode': y} for x, y in zip(lng, lat)],
+            'y': [np.zeros(4, dtype=np.float32)] * len(lng), 'rh': [np.zeros(101, dtype=np.float32)] * len(lng)}
+    pkl_path = tmp_path / 'gedi.pkl'
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(data, f)
+    store = gedi_store.open_gedi(str(pkl_path), verbose=False)
+
+    index = gedi_server.NearestIndex(store, 'degrees')
+    for query_lng, query_lat in [(-68.4, -19.6), (-67.0, -19.0), (-67.6, -20.4)]:
+        expected = ElevationValidator.nearest_points(lng, lat, [query_lng], [query_lat])
+        assert index.query(query_lng, query_lat) == (expected[0][0], expected[1][0])
+    assert index.query(-68.4, -19.6)[0] == 1
@@ -0,0 +1,281 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import gedi_binary
+import gedi_codec
+import gedi_store
+import pkl2CSV
+
+# the batched pipeline of pkl2CSV.py against the per-footprint versions it replaces
+#   python -m pytest test_pkl2CSV.py
+
+N_SAMPLES = 200
+
+
+def waveform_matrix(dtype):
+    # rows hitting the segmenting cases: flat, constant, random, repeats, slow drift and noise
+    # around the thresholds, steps longer and shorter than min_segment_length
+    rng = np.random.default_rng(0)
+    samples = np.arange(N_SAMPLES)
+    rows = [
+        np.zeros(N_SAMPLES),
+        np.full(N_SAMPLES, 227.5),
+        rng.normal(230, 5, N_SAMPLES),
+        np.round(rng.uniform(0, 1, N_SAMPLES), 1),
+        np.repeat(rng.normal(230, 5, N_SAMPLES // 4), 4),
+        np.repeat(rng.normal(230, 5, N_SAMPLES // 2), 2),
+        np.cumsum(rng.normal(0, 0.0005, N_SAMPLES)),
+        rng.uniform(0, 0.003, N_SAMPLES),
+        200 + 60 * np.exp(-0.5 * ((samples - 120) / 8) ** 2) + rng.normal(0, 0.05, N_SAMPLES),
+        np.where(samples % 10 < 7, 1.0, 1.05),
+    ]
+    return np.array(rows, dtype=dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('similarity_threshold', [0, 0.001, 0.1])
+@pytest.mark.parametrize('min_segment_length', [1, 3, 5])
+def test_batch_matches_adaptive_downsample(dtype, similarity_threshold, min_segment_length):
+    waveforms = waveform_matrix(dtype)
+    values, lengths, positions, offsets = pkl2CSV.adaptive_downsample_batch(
+        waveforms, similarity_threshold, min_segment_length)
+
+    assert offsets[0] == 0 and offsets[-1] == values.size
+    for k, waveform in enumerate(waveforms):
+        expected = pkl2CSV.adaptive_downsample(waveform, similarity_threshold, min_segment_length)
+        segment = slice(offsets[k], offsets[k + 1])
+        np.testing.assert_array_equal(values[segment], expected[0], err_msg=f'values of row {k}')
+        np.testing.assert_array_equal(lengths[segment], expected[1], err_msg=f'lengths of row {k}')
+        np.testing.assert_array_equal(positions[segment], expected[2], err_msg=f'positions of row {k}')
+        assert values.dtype == expected[0].dtype
+
+
+def test_batch_of_no_footprints():
+    values, lengths, positions, offsets = pkl2CSV.adaptive_downsample_batch(np.empty((0, N_SAMPLES)), 0.1)
+    assert values.size == lengths.size == positions.size == 0
+    np.testing.assert_array_equal(offsets, [0])
+
+
+def test_defaults_follow_the_configured_settings(monkeypatch):
+    # the settings configure() sets after import, not the built-in ones
+    monkeypatch.setattr(pkl2CSV, 'ADAPTIVE_THRESHOLD', 0.1)
+    monkeypatch.setattr(pkl2CSV, 'APPLY_SQUARE_ROOT', True)
+    monkeypatch.setattr(pkl2CSV, 'CLIP_METERS_ABOVE_RH98', 3)
+
+    waveform = np.array([1.0, 1.05, 1.02, 5.0, 5.01, 9.0])
+    assert len(pkl2CSV.adaptive_downsample(waveform)[0]) == 4
+    assert len(pkl2CSV.adaptive_downsample_batch(waveform[None])[0]) == 4
+
+    normalized = pkl2CSV.normalize_waveforms(np.array([4.0, 0.0]), np.array([0, 2]))
+    assert normalized[1] > 0
+
+    # the first sample is 10 m above the ground, rh98 is 4 m
+    clipped = pkl2CSV.clip_waveforms(np.ones(2), np.ones(2), np.array([0.0, 0.5]), np.array([0, 2]),
+                                     np.array([110.0]), np.array([100.0]), np.array([4.0], dtype=np.float32))
+    np.testing.assert_array_equal(clipped[3], [0, 1])
+
+
+GEO_BOUNDS = [-69.1, -68.2, -9.1, -8.2]
+CLIP_METERS = 5
+
+
+def gedi_pickle(scalar):
+    # pickle dicts with their float fields made by scalar (float or np.float64), float32 y and rh
+    # footprint 0 has a sample between its float32 and float64 clip thresholds
+    rng = np.random.default_rng(1)
+    n_footprints, n_samples = 40, 1000
+    data = {'prop': [], 'prop_rh': [], 'y': [], 'rh': []}
+    for i in range(n_footprints):
+        if i == 0:
+            # rh98 + clip is 9 and the threshold 109.000001, or 109 in float32. the sample at
+            # position 0.955 is 109.0000005 m high
+            elevation, rh98 = 100.000001, 4.0
+            bin0 = (109.0000005 - 0.955 * elevation) / 0.045
+        else:
+            elevation, rh98 = rng.uniform(100, 300), rng.uniform(1, 30)
+            bin0 = elevation + rng.uniform(50, 150)
+        lng, lat = rng.uniform(-69.0, -68.3), rng.uniform(-9.0, -8.3)
+        fields = {f'{column}': lng if 'lon' in column else lat if 'lat' in column else elevation
+                  for column in pkl2CSV.FIELD_COLUMNS.values()}
+        prop = {'geolocation/elevation_bin0': scalar(bin0)}
+        prop_rh = {}
+        for column, value in fields.items():
+            group, key = column.split('/', 1)
+            (prop if group == 'prop' else prop_rh)[key] = scalar(value)
+        rh = np.sort(rng.uniform(0, rh98, 101)).astype(np.float32)
+        rh[98] = rh98
+        data['prop'].append(prop)
+        data['prop_rh'].append(prop_rh)
+        data['y'].append(rng.uniform(200, 260, n_samples).astype(np.float32))
+        data['rh'].append(rh)
+    return data
+
+
+def per_footprint_waveforms(data):
+    # clipped (values, lengths, positions) of each footprint by the original per-footprint loop
+    footprints = []
+    for i in range(len(data['prop'])):
+        entry, prop_rh = data['prop'][i], data['prop_rh'][i]
+        if not pkl2CSV.in_bounds(entry['geolocation/longitude_bin0'], entry['geolocation/latitude_bin0'], GEO_BOUNDS):
+            continue
+        elevation = prop_rh['geolocation/digital_elevation_model']
+        elevation_bin0 = entry['geolocation/elevation_bin0']
+        rh_98 = data['rh'][i][98]
+
+        values, lengths, positions = pkl2CSV.adaptive_downsample(data['y'][i], 0)
+        values = np.maximum(0, values)
+        values = values / np.sum(values)
+
+        clip_elevation_threshold = elevation + (rh_98 + CLIP_METERS)
+        waveform_vertical_range = max(0.01, elevation_bin0 - elevation)
+        keep = [j for j in range(len(values))
+                if elevation_bin0 - (positions[j] * waveform_vertical_range) <= clip_elevation_threshold]
+        footprints.append((values[keep], lengths[keep], positions[keep]))
+    return footprints
+
+
+@pytest.mark.parametrize('scalar', [float, np.float64])
+@pytest.mark.parametrize('use_cache', [False, True])
+def test_clipping_matches_the_per_footprint_loop(monkeypatch, tmp_path, scalar, use_cache):
+    monkeypatch.setattr(pkl2CSV, 'GEO_BOUNDS', GEO_BOUNDS)
+    monkeypatch.setattr(pkl2CSV, 'ADAPTIVE_THRESHOLD', 0)
+    monkeypatch.setattr(pkl2CSV, 'APPLY_SQUARE_ROOT', False)
+    monkeypatch.setattr(pkl2CSV, 'CLIP_METERS_ABOVE_RH98', CLIP_METERS)
+    monkeypatch.setattr(pkl2CSV, 'PYTHON_FLOAT_ELEVATIONS', pkl2CSV.PYTHON_FLOAT_ELEVATIONS)
+
+    data = gedi_pickle(scalar)
+    if use_cache:
+        pkl_path = tmp_path / 'gedi.pkl'
+        with open(pkl_path, 'wb') as f:
+            pickle.dump(data, f)
+        columns = pkl2CSV.store_columns(gedi_store.open_gedi(str(pkl_path), verbose=False))
+    else:
+        columns = pkl2CSV.pickle_columns(data)
+    table = pkl2CSV.convert_footprints(columns)
+
+    expected = per_footprint_waveforms(data)
+    offsets = table['raw_waveform_offsets']
+    assert len(offsets) - 1 == len(expected)
+    for k, (values, lengths, positions) in enumerate(expected):
+        footprint = slice(offsets[k], offsets[k + 1])
+        np.testing.assert_array_equal(table['raw_waveform_values'][footprint], values, err_msg=f'values of {k}')
+        np.testing.assert_array_equal(table['raw_waveform_lengths'][footprint], lengths, err_msg=f'lengths of {k}')
+        np.testing.assert_array_equal(table['raw_waveform_positions'][footprint], positions, err_msg=f'positions of {k}')
+
+    # the sample between the thresholds is only clipped where the threshold is float32
+    float32_threshold = scalar is float and pkl2CSV.WEAK_PYTHON_FLOATS
+    assert offsets[1] == (44 if float32_threshold else 45)
+
+
+def footprint_table(counts, seed=0):
+    # output table of pkl2CSV.py with footprints of counts samples each (0 for fully clipped ones)
+    rng = np.random.default_rng(seed)
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.zeros(counts.size + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    table = {name: rng.uniform(-100, 300, counts.size) for name in gedi_binary.SCALAR_COLUMNS}
+    table['rh_waveform'] = rng.uniform(0, 1, (counts.size, 101)).astype(np.float32)
+    starts = np.concatenate([np.sort(rng.choice(512, count, replace=False)) for count in counts] or [[]])
+    table['raw_waveform_values'] = rng.uniform(0, 0.01, offsets[-1])
+    table['raw_waveform_lengths'] = rng.integers(1, 8, offsets[-1]).astype(np.int32)
+    table['raw_waveform_positions'] = starts / 512 if offsets[-1] else np.zeros(0)
+    table['raw_waveform_offsets'] = offsets
+    return table
+
+
+@pytest.mark.parametrize('counts', [[3, 0, 5, 1, 0], [0, 0], []])
+def test_binary_round_trip(tmp_path, counts):
+    table = footprint_table(counts)
+    path = tmp_path / 'footprints.bin'
+    gedi_binary.write_binary(table, path)
+    read = gedi_binary.read_binary(path)
+
+    assert set(read) == set(table)
+    for name in gedi_binary.SCALAR_COLUMNS:
+        np.testing.assert_array_equal(read[name], table[name], err_msg=name)
+    np.testing.assert_array_equal(read['raw_waveform_offsets'], table['raw_waveform_offsets'])
+    np.testing.assert_array_equal(read['rh_waveform'], table['rh_waveform'])
+
+    offsets = table['raw_waveform_offsets']
+    for k in range(len(counts)):
+        waveform = gedi_binary.footprint_waveform(read, k)
+        assert len(waveform[0]) == counts[k]
+        for (name, dtype), column in zip(gedi_binary.SAMPLE_COLUMNS.items(), waveform):
+            expected = np.asarray(table[name][offsets[k]:offsets[k + 1]], dtype=dtype)
+            assert column.dtype == np.dtype(dtype)
+            np.testing.assert_array_equal(column, expected, err_msg=f'{name} of {k}')
+
+
+def test_binary_rejects_truncated_files(tmp_path):
+    path = tmp_path / 'footprints.bin'
+    gedi_binary.write_binary(footprint_table([4, 2]), path)
+    data = path.read_bytes()
+    path.write_bytes(data[:-8])
+    with pytest.raises(ValueError, match='truncated'):
+        gedi_binary.read_binary(path)
+    path.write_bytes(b'NOTGEDI!' + data[8:])
+    with pytest.raises(ValueError, match='not a GEDI waveform file'):
+        gedi_binary.read_binary(path)
+
+
+def test_store_records_match_the_pickle(tmp_path):
+    data = gedi_pickle(float)
+    pkl_path = tmp_path / 'gedi.pkl'
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(data, f)
+    store = gedi_store.open_gedi(str(pkl_path), verbose=False)
+
+    for group in gedi_store.RECORD_GROUPS:
+        assert len(store[group]) == len(data[group])
+        for i in (0, 7, -1):
+            record = store[group][i]
+            assert dict(record) == data[group][i]
+            assert set(record) == set(data[group][i])
+        with pytest.raises(KeyError):
+            store[group][0]['missing']
+
+
+def assert_codec_round_trip(table, value_bits, **options):
+    # decoded within the codec's bound (check_errors raises otherwise), lossless columns exactly
+    decoded = gedi_codec.decode(gedi_codec.encode(table, value_bits, **options))
+    errors = gedi_codec.check_errors(table, decoded, value_bits)
+    for name in [*gedi_binary.SCALAR_COLUMNS, 'raw_waveform_lengths', 'raw_waveform_offsets']:
+        assert errors[name] == 0, name
+    return decoded, errors
+
+
+@pytest.mark.parametrize('value_bits', [1, 8, gedi_codec.VALUE_BITS, 16])
+@pytest.mark.parametrize('counts', [[3, 0, 5, 1, 0], [0, 0], []])
+def test_codec_round_trip(value_bits, counts):
+    assert_codec_round_trip(footprint_table(counts), value_bits)
+
+
+def test_codec_blocks_not_dividing_the_footprints():
+    # one footprint past a whole block, and blocks of 3 footprints over 10
+    counts = np.random.default_rng(4).integers(0, 6, gedi_codec.BLOCK_FOOTPRINTS + 1)
+    decoded, _ = assert_codec_round_trip(footprint_table(counts), gedi_codec.VALUE_BITS)
+    np.testing.assert_array_equal(np.diff(decoded['raw_waveform_offsets']), counts)
+    assert_codec_round_trip(footprint_table([2, 0, 4, 1, 3, 0, 0, 5, 2, 1]), gedi_codec.VALUE_BITS, block_footprints=3)
+
+
+def test_codec_constant_footprints():
+    # min == max, so a footprint or rh row decodes to its value exactly
+    counts = [4, 1, 0, 3]
+    table = footprint_table(counts)
+    table['raw_waveform_values'] = np.repeat([0.25, 0.003, 0.0, 1 / 3], counts)
+    table['rh_waveform'] = np.repeat(np.float32([[1.5], [0], [2.75], [-1 / 3]]), 101, axis=1)
+    decoded, errors = assert_codec_round_trip(table, gedi_codec.VALUE_BITS)
+    np.testing.assert_array_equal(decoded['raw_waveform_values'], table['raw_waveform_values'].astype(np.float32))
+    np.testing.assert_array_equal(decoded['rh_waveform'], table['rh_waveform'])
+
+
+def test_codec_errors_over_the_bound_raise():
+    table = footprint_table([3, 2])
+    decoded = gedi_codec.decode(gedi_codec.encode(table))
+    decoded['raw_waveform_values'][1] += 0.01
+    with pytest.raises(ValueError, match='raw_waveform_values'):
+        gedi_codec.check_errors(table, decoded)
+    with pytest.raises(ValueError, match='decoded for'):
+        gedi_codec.check_errors(footprint_table([3, 3]), decoded)